@@ -24,8 +24,6 @@ This example shows how to synthesize a population of cells with the same paramet
 
 from pathlib import Path
 
-import numpy as np
-
 import neurots
 
 
@@ -33,18 +31,18 @@ def run(output_dir, data_dir):
     """Run the example for generating a population of cells with the same parameters."""
     num_cells = 10
 
-    # Generate any number of cells, based on the same input
-    for i in np.arange(num_cells):
-        # Initialize a neuron
-        N = neurots.NeuronGrower(
-            input_distributions=data_dir / "bio_distr.json",
-            input_parameters=data_dir / "bio_params.json",
-        )
-
-        # Grow the neuron
-        neuron = N.grow()
-
-        # Export the synthesized cell
+    # Generate any number of cells, based on the same input (the inputs are loaded only once and
+    # the cells are grown in parallel, each cell using its own random number generator)
+    population = neurots.synthesize_population(
+        input_distributions=data_dir / "bio_distr.json",
+        input_parameters=data_dir / "bio_params.json",
+        n_cells=num_cells,
+        seed=0,
+        n_workers=2,
+    )
+
+    # Export the synthesized cells
+    for i, neuron in enumerate(population):
         neuron.write(output_dir / f"generated_cell_{i}.swc")
 
 
@@ -21,7 +21,13 @@ Synthesis of artificial neurons using their topological profiles package.
 import importlib.metadata
 
 from neurots.astrocyte.grower import AstrocyteGrower  # noqa
+from neurots.generate.grower import CompiledSynthesisInputs  # noqa
 from neurots.generate.grower import NeuronGrower  # noqa
+from neurots.generate.lockstep import LockstepGrower  # noqa
+from neurots.generate.population import iter_placed_population  # noqa
+from neurots.generate.population import iter_population  # noqa
+from neurots.generate.population import synthesize_placed_population  # noqa
+from neurots.generate.population import synthesize_population  # noqa
 from neurots.utils import NeuroTSError  # noqa
 
 __version__ = importlib.metadata.version("NeuroTS")
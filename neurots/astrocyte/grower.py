@@ -101,6 +101,7 @@ class AstrocyteGrower(NeuronGrower):
         skip_preprocessing=True,
         external_diametrizer=None,
         rng_or_seed=np.random,
+        instrument=False,
     ):
         super().__init__(
             input_parameters,
@@ -109,6 +110,7 @@ class AstrocyteGrower(NeuronGrower):
             external_diametrizer=external_diametrizer,
             skip_preprocessing=skip_preprocessing,
             rng_or_seed=rng_or_seed,
+            instrument=instrument,
         )
 
     def validate_params(self):
@@ -128,13 +130,14 @@ class AstrocyteGrower(NeuronGrower):
         tree_direction = self.soma_grower.soma.orientation_from_point(initial_soma_point)
 
         obj = TreeGrowerSpaceColonization(
-            self.neuron,
+            self._morphology_builder,
             initial_direction=tree_direction,
             initial_point=initial_soma_point,
             parameters=parameters,
             distributions=distributions,
             context=self.context,
             random_generator=self._rng,
+            statistics=self.statistics,
         )
 
         self.active_neurites.append(obj)
@@ -227,7 +230,8 @@ class AstrocyteGrower(NeuronGrower):
         origin = np.array(self.input_parameters["origin"], dtype=np.float32)
 
         for tree_type in self.input_parameters["grow_types"]:
-            parameters = self.input_parameters[tree_type]
+            # The input parameters may be shared with other growers so they are not updated in place
+            parameters = {**self.input_parameters[tree_type], "origin": origin}
+            self.input_parameters[tree_type] = parameters
             distributions = self.input_distributions[tree_type]
-            parameters["origin"] = origin
             self._create_process_trunks(tree_type, parameters, distributions)
@@ -84,6 +84,8 @@ class SectionSpatialGrower(SectionGrowerPath):
         only by the seeds that area available. This leads to a more spread out occupancy of space.
     """
 
+    __slots__ = ("_influence_distance",)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._influence_distance = self.context.influence_distance(self.step_size_distribution.loc)
@@ -15,11 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import copy
-
 from neurots.astrocyte.section import SectionSpatialGrower
 from neurots.astrocyte.space_colonization import SpaceColonization
 from neurots.astrocyte.space_colonization import SpaceColonizationTarget
+from neurots.generate.algorithms.common import copy_stop_criteria
 from neurots.generate.tree import TreeGrower
 
 GROWTH_ALGORITHMS = {
@@ -54,7 +53,7 @@ class TreeGrowerSpaceColonization(TreeGrower):
             parent=None,
             direction=self.direction,
             first_point=self.point,
-            stop=copy.deepcopy(stop),
+            stop=stop,
             process="major",
             pathlength=0.0,
             children=2 if num_sec > 1 else 0,
@@ -81,11 +80,12 @@ class TreeGrowerSpaceColonization(TreeGrower):
             direction=direction,
             parameters=self._section_parameters,
             process=process,
-            stop_criteria=copy.deepcopy(stop),
+            stop_criteria=copy_stop_criteria(stop),
             step_size_distribution=self.seg_length_distr,
             pathlength=pathlength,
             context=self.context,
             random_generator=self._rng,
+            sampler=self._sampler,
         )
 
         self.active_sections.append(sec_grower)
@@ -35,7 +35,8 @@ class AbstractAlgo:
     def __init__(self, input_data, params, start_point, context):
         """The TreeGrower Algorithm initialization."""
         self.context = context
-        self.input_data = copy.deepcopy(input_data)
+        # The input data are shared by all the trees and are only read, so they are not copied
+        self.input_data = input_data
         self.params = copy.deepcopy(params)
         self.start_point = start_point
 
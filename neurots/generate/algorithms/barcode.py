@@ -15,8 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import copy
-from collections import OrderedDict
+from collections.abc import Mapping
 
 import numpy as np
 
@@ -24,6 +23,101 @@ from neurots.basic import round_num
 from neurots.utils import NeuroTSError
 
 
+class _SortedBars(Mapping):
+    """Remaining bars sorted by value, as a mapping from their IDs to their values.
+
+    The IDs and the values of the bars are stored in arrays that are never modified. The positions
+    of the removed bars point to the next positions, so the first remaining bar after a given
+    position is found by following these pointers (the paths are compressed on the way, which
+    makes the queries logarithmic on average). A bar is remaining if its position points to itself.
+
+    Args:
+        ids (numpy.ndarray): The IDs of the bars sorted by value.
+        values (numpy.ndarray): The sorted values of the bars.
+    """
+
+    __slots__ = ("bar_ids", "bar_values", "_positions", "_next", "_last", "_size")
+
+    def __init__(self, ids, values):
+        self.bar_ids = ids
+        self.bar_values = values
+        self._positions = {bar_id: position for position, bar_id in enumerate(ids.tolist())}
+        # The last position is a sentinel used when all the next bars are removed
+        self._next = np.arange(len(ids) + 1)
+        self._last = len(ids) - 1
+        self._size = len(ids)
+
+    def copy(self):
+        """Return a copy in which the bars can be removed independently."""
+        # pylint: disable=protected-access
+        new_bars = _SortedBars.__new__(_SortedBars)
+        # The IDs, the values and the positions are never modified so they are shared
+        new_bars.bar_ids = self.bar_ids
+        new_bars.bar_values = self.bar_values
+        new_bars._positions = self._positions
+        new_bars._next = self._next.copy()
+        new_bars._last = self._last
+        new_bars._size = self._size
+        return new_bars
+
+    def _position(self, bar_id):
+        """Return the position of a remaining bar or None."""
+        position = self._positions.get(bar_id)
+        if position is None or self._next[position] != position:
+            return None
+        return position
+
+    def __getitem__(self, bar_id):
+        position = self._position(bar_id)
+        if position is None:
+            raise KeyError(bar_id)
+        return self.bar_values[position]
+
+    def __contains__(self, bar_id):
+        return self._position(bar_id) is not None
+
+    def __iter__(self):
+        position = self.first()
+        while position < len(self.bar_ids):
+            yield self.bar_ids[position]
+            position = self.first(position + 1)
+
+    def __len__(self):
+        return self._size
+
+    def remove(self, bar_id):
+        """Remove a bar."""
+        position = self._position(bar_id)
+        if position is None:
+            raise KeyError(bar_id)
+        self._next[position] = position + 1
+        self._size -= 1
+
+    def first(self, position=0):
+        """Return the first position of a remaining bar after the given one (included)."""
+        next_positions = self._next
+        root = position
+        while next_positions[root] != root:
+            root = next_positions[root]
+        while next_positions[position] != root:
+            next_positions[position], position = root, next_positions[position]
+        return root
+
+    def last(self):
+        """Return the position of the last remaining bar (-1 if all the bars are removed)."""
+        # The bars are never added back so the last position can only decrease
+        while self._last >= 0 and self._next[self._last] != self._last:
+            self._last -= 1
+        return self._last
+
+    def min_between(self, above, below):
+        """Return the first remaining bar whose value is in [above, below] or None."""
+        position = self.first(int(np.searchsorted(self.bar_values, above)))
+        if position < len(self.bar_ids) and self.bar_values[position] <= below:
+            return (self.bar_ids[position], self.bar_values[position])
+        return None
+
+
 class Barcode:
     """Class to generate the barcode structure.
 
@@ -52,12 +146,13 @@ class Barcode:
                 ]
 
     Returns:
-       The ph_angles will be decomposed in the following dictionaries::
+       The ph_angles will be decomposed in the following attributes, the bars being identified by
+       their index in the sorted persistence diagram::
 
            {
-               angles: {ID: 4D_angles}
-               bifs: {ID: start_point}
-               terms: {ID, end_point}
+               angles: (n, 4) array of the 4D_angles of each bar
+               bifs: {ID: start_point} for the remaining bifurcations, sorted by value
+               terms: {ID: end_point} for the remaining terminations, sorted by value
            }
     """
 
@@ -66,19 +161,36 @@ class Barcode:
         # Sort persistence bars according to bifurcation
         ph_angles.sort(key=lambda x: x[1])
 
-        self.bifs = OrderedDict()
-        self.terms = OrderedDict()
-        self.angles = OrderedDict()
+        bars = np.asarray(ph_angles, dtype=np.float64)
+        bifs = round_num(bars[:, 1])
+        terms = round_num(bars[:, 0])
+        self.angles = bars[:, 2:]
+        self._persistence_length = terms[0]
 
-        for bar_index, tmd_bar in enumerate(ph_angles):
-            self.bifs[bar_index] = round_num(tmd_bar[1])
-            self.terms[bar_index] = round_num(tmd_bar[0])
-            self.angles[bar_index] = tmd_bar[2:]
+        # The remaining bars sorted by value, the bifurcation at 0 is trivial so it is not included
+        bif_ids = np.argsort(bifs[1:], kind="stable") + 1
+        term_ids = np.argsort(terms, kind="stable")
+        self.bifs = _SortedBars(bif_ids, bifs[bif_ids])
+        self.terms = _SortedBars(term_ids, terms[term_ids])
 
-        # Sort the terminations according to value to optimize access
-        self.terms = OrderedDict(sorted(self.terms.items(), key=lambda x: x[1]))
-        # Bifurcation at 0 is trivial so it should be removed
-        del self.bifs[0]
+        # Number of searches of bars in the barcode
+        self.n_lookups = 0
+
+    def copy(self):
+        """Return a copy of the barcode in which the bars can be removed independently.
+
+        This is much faster than building a new barcode from the same persistence diagram because
+        the bars are already sorted and only the arrays of the removed bars are copied. The angles
+        are never modified so they are shared.
+        """
+        # pylint: disable=protected-access
+        new_barcode = self.__class__.__new__(self.__class__)
+        new_barcode.angles = self.angles
+        new_barcode._persistence_length = self._persistence_length
+        new_barcode.bifs = self.bifs.copy()
+        new_barcode.terms = self.terms.copy()
+        new_barcode.n_lookups = 0
+        return new_barcode
 
     @staticmethod
     def validate_persistence(ph_angles):
@@ -103,17 +215,17 @@ class Barcode:
 
     def get_persistence_length(self):
         """Returns the maximum bar length."""
-        return self.terms[0]
+        return self._persistence_length
 
     def remove_bif(self, bar_id):
         """Remove a bifurcation that has been used if bif_id is not None."""
         if bar_id is not None:
-            del self.bifs[bar_id]
+            self.bifs.remove(bar_id)
 
     def remove_term(self, bar_id):
         """Remove a termination that has been used, if term_id is not None."""
         if bar_id is not None:
-            del self.terms[bar_id]
+            self.terms.remove(bar_id)
 
     def get_term(self, bar_id):
         """Returns a termination based on index if the input ID exists of infinity.
@@ -134,6 +246,7 @@ class Barcode:
         is returned.
         If it doesn't exist the branch will terminate as it gets `term = -infinity`.
         """
+        self.n_lookups += 1
         try:
             term = self.terms[bar_id]
             if above <= term <= below:
@@ -150,12 +263,12 @@ class Barcode:
 
         If no value is valid, returns infinity (np.inf) and therefore the index is None.
         """
+        self.n_lookups += 1
         if np.isinf(bif_above):
             bif_above = 0.0
-        for bifurcation in self.bifs.items():
-            bifurcation_value = bifurcation[1]
-            if bif_below >= bifurcation_value >= bif_above:
-                return bifurcation
+        bifurcation = self.bifs.min_between(bif_above, bif_below)
+        if bifurcation is not None:
+            return bifurcation
         return (None, np.inf)
 
     def min_term(self, term_above=0.0, term_below=np.inf):
@@ -164,12 +277,12 @@ class Barcode:
         If no value is valid, returns zero, the section will terminate and therefore the index is
         None.
         """
+        self.n_lookups += 1
         if np.isinf(term_above):
             term_above = 0.0
-        for termination in self.terms.items():
-            termination_value = termination[1]
-            if term_below >= termination_value >= term_above:
-                return termination
+        termination = self.terms.min_between(term_above, term_below)
+        if termination is not None:
+            return termination
         return (None, 0)
 
     def max_term(self):
@@ -178,7 +291,11 @@ class Barcode:
         Termination list cannot be empty. This means the growth should have stopped, and therefore
         it will results in a 'StopIteration' error
         """
-        return next(reversed(self.terms.items()))
+        self.n_lookups += 1
+        position = self.terms.last()
+        if position < 0:
+            raise StopIteration
+        return (self.terms.bar_ids[position], self.terms.bar_values[position])
 
     def curate_stop_criterion(self, parent_stop, child_stop):
         """Checks if the children stop criterion is compatible with parent.
@@ -200,7 +317,7 @@ class Barcode:
             current one for both bif and term.
         """
         MAX_ref = parent_stop.term
-        target_stop = copy.deepcopy(child_stop)
+        target_stop = child_stop.copy()
 
         # Case 0. Incompatibility checks
         # One of the assumed conditions is wrong
@@ -231,10 +348,55 @@ class Barcode:
         below_bif <= bif <= above_bif
         below_term <= term <= above_term
         """
-        # Search bar according to minimum bifurcation
-        for bif_id, bif in self.bifs.items():
+        self.n_lookups += 1
+        # Search bar according to minimum bifurcation, only the bifurcations between below_bif and
+        # above_bif are considered
+        sorted_bifs = self.bifs
+        position = sorted_bifs.first(int(np.searchsorted(sorted_bifs.bar_values, below_bif)))
+        while position < len(sorted_bifs.bar_ids) and sorted_bifs.bar_values[position] <= above_bif:
+            bif_id = sorted_bifs.bar_ids[position]
             corresp_term = self.get_term(bif_id)
-            if (below_bif <= bif <= above_bif) and (below_term <= corresp_term <= above_term):
+            if below_term <= corresp_term <= above_term:
                 # Define new termination corresponding to bifurcation
-                return (bif_id, bif)
+                return (bif_id, sorted_bifs.bar_values[position])
+            position = sorted_bifs.first(position + 1)
         return (None, np.inf)
+
+
+class BarcodeTemplates:
+    """Barcodes built once from the persistence diagrams of a distribution.
+
+    The barcodes of all the persistence diagrams are built when the templates are created and the
+    requests return copies of these templates. Only the persistence diagram objects given to the
+    constructor are recognized, any other persistence diagram (e.g. a modified one) gives a new
+    barcode that is not stored.
+
+    Args:
+        persistence_diagrams (list): The persistence diagrams of a distribution.
+    """
+
+    def __init__(self, persistence_diagrams):
+        self._diagrams = persistence_diagrams
+        self._templates = [Barcode(list(diagram)) for diagram in persistence_diagrams]
+        self._indices = self._build_indices()
+
+    def _build_indices(self):
+        """Map the identities of the persistence diagrams to their indices."""
+        return {id(diagram): index for index, diagram in enumerate(self._diagrams)}
+
+    def __getstate__(self):
+        """Return the state without the identities of the diagrams, which are not persistent."""
+        return {"diagrams": self._diagrams, "templates": self._templates}
+
+    def __setstate__(self, state):
+        """Restore the state and the identities of the diagrams."""
+        self._diagrams = state["diagrams"]
+        self._templates = state["templates"]
+        self._indices = self._build_indices()
+
+    def barcode(self, ph_angles):
+        """Return a new barcode for the given persistence diagram."""
+        index = self._indices.get(id(ph_angles))
+        if index is None or self._diagrams[index] is not ph_angles:
+            return Barcode(list(ph_angles))
+        return self._templates[index].copy()
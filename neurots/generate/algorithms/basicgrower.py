@@ -22,6 +22,8 @@ import numpy as np
 from neurots.generate.algorithms.abstractgrower import AbstractAlgo
 from neurots.generate.algorithms.common import bif_methods
 from neurots.generate.algorithms.common import section_data
+from neurots.generate.section import SectionGrower
+from neurots.morphmath.sample import BlockSampler
 
 logger = logging.getLogger(__name__)
 
@@ -83,7 +85,17 @@ class TrunkAlgo(AbstractAlgo):
 
         Create a section with the selected parameters until at least one stop criterion is
         fulfilled.
+
+        When the random numbers of the section are drawn by blocks from independent streams, the
+        whole section is generated at once, which gives the same points as growing it point by
+        point.
         """
+        # The subclasses of SectionGrower may use other stop criteria
+        # pylint: disable=unidiomatic-typecheck
+        if type(current_section) is SectionGrower and isinstance(
+            current_section.sampler, BlockSampler
+        ):
+            return current_section.next_all()
         return current_section.next()
 
 
@@ -95,8 +107,8 @@ class AxonAlgo(TrunkAlgo):
     """
 
     def __init__(self, *args, **kwargs):
-        # Force num_seg in params to 1
-        params = kwargs.get("params", None) or args[1]
-        params["num_seg"] = 1
-
         super().__init__(*args, **kwargs)
+
+        # Force num_seg in params to 1 (the params are copied by AbstractAlgo so the input
+        # parameters are not updated)
+        self.params["num_seg"] = 1
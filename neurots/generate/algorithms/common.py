@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
+
 import numpy as np
 
 from neurots.morphmath import bifurcation as _bif
@@ -54,6 +56,17 @@ def checks_bif_term(ref, bif, term, target_length):
     return term_cond and bif_cond and term > bif
 
 
+def copy_stop_criteria(stop_criteria):
+    """Return a copy of a stop criteria dictionary in which the TMDStop objects are also copied.
+
+    The other values (e.g. ``num_seg``) are numbers, so they are not copied.
+    """
+    return {
+        key: value.copy() if isinstance(value, TMDStop) else value
+        for key, value in stop_criteria.items()
+    }
+
+
 def section_data(direction, first_point, stop_criteria, process_type):
     """Generate section data dictionary from arguments."""
     return {
@@ -75,6 +88,8 @@ class TMDStop:
         ref (float): The reference value (i.e for path or radial distances).
     """
 
+    __slots__ = ("bif_id", "bif", "term_id", "term", "ref")
+
     def __init__(self, bif_id, bif, term_id, term, ref):
         """Initialization of TMDStop class with parameters."""
         self.bif_id = bif_id
@@ -91,6 +106,24 @@ class TMDStop:
             f"Term: {self.term})"
         )
 
+    def copy(self):
+        """Return a shallow copy of the TMDStop.
+
+        This is much faster than :func:`copy.deepcopy` and equivalent as long as the attributes are
+        numbers, which is the case for the stop criteria created by the growth algorithms.
+        """
+        return TMDStop(self.bif_id, self.bif, self.term_id, self.term, self.ref)
+
+    def __copy__(self):
+        """Return a shallow copy of the TMDStop."""
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        """Return a deep copy of the TMDStop."""
+        return TMDStop(
+            self.bif_id, self.bif, self.term_id, self.term, copy.deepcopy(self.ref, memo)
+        )
+
     def printme(self):
         """Print all features."""
         print(self)  # pragma: no cover
@@ -42,6 +42,9 @@ class TMDAlgo(AbstractAlgo):
             the "min_bar_length" parameter are validated.
         context (Any): An object containing contextual information.
         random_generator (numpy.random.Generator): The random number generator to use.
+        barcode_templates (neurots.generate.algorithms.barcode.BarcodeTemplates): The templates
+            from which the barcode is copied if the selected persistence diagram is one of the
+            input ones and is not modified (a new barcode is built otherwise).
     """
 
     def __init__(
@@ -51,13 +54,17 @@ class TMDAlgo(AbstractAlgo):
         start_point,
         context=None,
         random_generator=np.random,
+        barcode_templates=None,
         **_,
     ):
         """TMD basic grower."""
         super().__init__(input_data, params, start_point, context)
         self.bif_method = bif_methods[params["branching_method"]]
         self.ph_angles = self.select_persistence(input_data, random_generator)
-        self.barcode = Barcode(list(self.ph_angles))
+        if barcode_templates is not None and not self.params.get("modify"):
+            self.barcode = barcode_templates.barcode(self.ph_angles)
+        else:
+            self.barcode = Barcode(list(self.ph_angles))
         self.apical_section = None
         self.apical_point_distance_from_soma = 0.0
         self.persistence_length = self.barcode.get_persistence_length()
@@ -72,8 +79,9 @@ class TMDAlgo(AbstractAlgo):
         persistence = sample.ph(list_of_persistences, random_generator)
 
         if self.params.get("modify"):
+            # The input diagrams are shared by all the trees, so the function gets a copy
             persistence = self.params["modify"]["funct"](
-                persistence, self.context, **self.params["modify"]["kwargs"]
+                copy.deepcopy(persistence), self.context, **self.params["modify"]["kwargs"]
             )
         return persistence
 
@@ -104,13 +112,13 @@ class TMDAlgo(AbstractAlgo):
         """
         # Ensure that reference is correctly assigned
         current_section.stop_criteria["TMD"].ref = self.metric_ref(current_section)
-        # Copy the values for the parent stop TMD to use
-        parent_tmd = copy.deepcopy(current_section.stop_criteria["TMD"])
+        # The values for the parent stop TMD to use (they are not modified)
+        parent_tmd = current_section.stop_criteria["TMD"]
         # Save the values of bifurcation for parent
         parent_bif_id = parent_tmd.bif_id
         parent_bif = parent_tmd.bif
         # Define the current criterion, inherited from parent
-        current_tmd = copy.deepcopy(current_section.stop_criteria["TMD"])
+        current_tmd = parent_tmd.copy()
 
         # The termination remains the same, so it is always True that
         # current_tmd.term <= parent_tmd.term
@@ -189,14 +197,21 @@ class TMDAlgo(AbstractAlgo):
         """
         self.barcode.remove_term(current_section.stop_criteria["TMD"].term_id)
 
-    def extend(self, current_section):
-        """Definition of stop criterion for the growth of the current section."""
-        criteria_tmd = copy.deepcopy(current_section.stop_criteria["TMD"])
-        maximum_target = current_section.stop_criteria["TMD"].term
-        reference = current_section.stop_criteria["TMD"].ref
+    def update_stop_criteria(self, current_section):
+        """Replace the bars of the stop criterion of the current section that were already used.
+
+        The bifurcation and termination bars of a section may have been consumed by other sections
+        of the same tree since the section was created, in which case new bars are selected.
+        """
+        # The criterion is only copied if it must be updated
+        current_tmd = current_section.stop_criteria["TMD"]
+        criteria_tmd = current_tmd
+        maximum_target = current_tmd.term
+        reference = current_tmd.ref
 
         # We check that the current bifurcation has not been used
         if criteria_tmd.bif_id not in self.barcode.bifs and not np.isinf(criteria_tmd.bif):
+            criteria_tmd = criteria_tmd.copy()
             criteria_tmd.update_bif(
                 *self.barcode.min_bif(bif_above=reference, bif_below=maximum_target)
             )
@@ -207,6 +222,8 @@ class TMDAlgo(AbstractAlgo):
             # Termination must be larger that bifurcation
             # unless if bifurcation is infinite
             reference = criteria_tmd.bif if not np.isinf(criteria_tmd.bif) else criteria_tmd.ref
+            if criteria_tmd is current_tmd:
+                criteria_tmd = criteria_tmd.copy()
             criteria_tmd.update_term(
                 *self.barcode.min_term(term_above=reference, term_below=maximum_target)
             )
@@ -214,6 +231,9 @@ class TMDAlgo(AbstractAlgo):
 
         current_section.stop_criteria["TMD"] = criteria_tmd
 
+    def extend(self, current_section):
+        """Definition of stop criterion for the growth of the current section."""
+        self.update_stop_criteria(current_section)
         return current_section.next()
 
 
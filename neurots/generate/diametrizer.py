@@ -15,13 +15,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
 import inspect
+import logging
+import warnings
+from collections import deque
+from functools import cached_property
+from functools import lru_cache
 
 import numpy as np
+from diameter_synthesis import build_diameters
 from morphio import SectionType
 
 from neurots.utils import NeuroTSError
 
+L = logging.getLogger(__name__)
+
 
 def section_filter(neuron, tree_type=None):
     """Filter all sections according to type."""
@@ -62,16 +71,21 @@ def section_lengths(section):
 def redefine_diameter_section(section, diam_ind, diam_new):
     """Hack to replace one diameter at index diam_ind with value diam_new.
 
+    This function is deprecated: the diametrizers now modify the diameters of a whole neurite at
+    once, so it is no longer used and will be removed.
+
     Args:
         section (morphio.mut.Section): The section whose diameter is updated.
         diam_ind (int): The index to replace.
         diam_new (float): The new diameter value.
     """
-    section.diameters = np.array(
-        section.diameters.tolist()[:diam_ind]
-        + [diam_new]
-        + section.diameters.tolist()[(diam_ind + 1) :]
+    warnings.warn(
+        "The 'redefine_diameter_section' function is deprecated and will be removed",
+        DeprecationWarning,
     )
+    diameters = np.array(section.diameters)
+    diameters[diam_ind] = diam_new
+    section.diameters = diameters
     if len(section.points) != len(section.diameters):
         raise NeuroTSError("Mismatch in dimensions of diameters.")
 
@@ -93,58 +107,101 @@ def bifurcator(initial_diam, num_children, rall_ratio, siblings_ratio):
     return initial_diam / reduction_factor
 
 
+def _merged_diameter(diameters_children, trunk_diam, rall_ratio):
+    """Returns the diameter of a parent computed from the diameters of its children."""
+    # pylint: disable=assignment-from-no-return
+    parent_d = np.power(
+        np.sum([np.power(d, rall_ratio) for d in diameters_children]), 1.0 / rall_ratio
+    )
+    return parent_d if parent_d <= trunk_diam else np.max(diameters_children)
+
+
 def merger(section, trunk_diam, rall_ratio):
     """Returns the computed bifurcation diameter.
 
+    This function is deprecated: the diametrizers now merge the diameters of a whole neurite at
+    once, so it is no longer used and will be removed.
+
     Args:
         section (morphio.mut.Section): The section whose diameter is updated.
         trunk_diam (float): The trunk diameter.
         rall_ratio (float): The rall ratio.
     """
-    # pylint: disable=assignment-from-no-return
+    warnings.warn("The 'merger' function is deprecated and will be removed", DeprecationWarning)
     # diameters[0] is the duplicate point
     diameters_children = [ch.diameters[1] for ch in section.children]
-    parent_d = np.power(
-        np.sum([np.power(d, rall_ratio) for d in diameters_children]), 1.0 / rall_ratio
-    )
+    diameters = np.array(section.diameters)
+    diameters[-1] = _merged_diameter(diameters_children, trunk_diam, rall_ratio)
+    section.diameters = diameters
 
-    diam_val = parent_d if parent_d <= trunk_diam else np.max(diameters_children)
-    redefine_diameter_section(section, len(section.diameters) - 1, diam_val)
 
+def _taper(initial_diam, steps, min_diam, max_diam):
+    """Returns the diameters obtained by subtracting the steps one after the other.
 
-def taper_section_diam_from_root(section, initial_diam, taper, min_diam=0.07, max_diam=100.0):
-    """Corrects the diameters of a section.
+    Each new diameter is clipped between ``min_diam`` and ``max_diam`` before the next step is
+    subtracted. Since all the steps have the same sign, only the first diameter can be clipped to
+    the bound opposite to the direction of the steps, so the diameters are computed with a
+    cumulative sum.
 
     Args:
-        section (morphio.mut.Section): The section whose diameters are updated.
         initial_diam (float): The initial diameter value.
-        taper (float): The taper value.
+        steps (numpy.ndarray): The values subtracted from the diameters (all with the same sign).
         min_diam (float): The min diameter value.
         max_diam (float): The max diameter value.
+
+    Returns:
+        numpy.ndarray: The initial diameter followed by one diameter per step.
     """
-    diams = [initial_diam]
+    diams = np.empty(len(steps) + 1, dtype=float)
+    diams[0] = initial_diam
+    if len(steps) == 0:
+        return diams
+
+    first = initial_diam - steps[0]
+    if first >= max_diam:
+        first = max_diam
+    elif first <= min_diam:
+        first = min_diam
+    diams[1] = first
+
+    others = first - np.cumsum(steps[1:])
+    diams[2:] = np.where(
+        others >= max_diam, max_diam, np.where(others <= min_diam, min_diam, others)
+    )
+    return diams
 
-    if section.is_root:
-        range_ = range(1, len(section.diameters))
-    else:
-        range_ = range(0, len(section.diameters) - 1)
 
-    # lengths of each segments will be used for scaling of tapering
-    lengths = [0] + section_lengths(section).tolist()
+def _taper_steps_from_root(lengths, taper, is_root):
+    """Returns the steps used to taper a section from its root.
+
+    The last segment of the non-root sections is not used, their second point gets the initial
+    diameter instead.
+    """
     taps = taper / np.sum(lengths)
+    if is_root:
+        return taps * lengths
+    return taps * np.concatenate([[0.0], lengths[:-1]])
 
-    for i in range_:
-        # Diameters decrease from root towards the tip
-        new_diam = diams[-1] - taps * lengths[i]
 
-        if new_diam >= max_diam:
-            diams.append(max_diam)
-        elif new_diam <= min_diam:
-            diams.append(min_diam)
-        else:
-            diams.append(new_diam)
+def _taper_steps_from_tips(lengths, taper):
+    """Returns the steps used to taper a section from its tip."""
+    taps = taper / np.sum(lengths)
+    return -taps * lengths[::-1]
+
 
-    section.diameters = np.array(diams, dtype=np.float32)
+def taper_section_diam_from_root(section, initial_diam, taper, min_diam=0.07, max_diam=100.0):
+    """Corrects the diameters of a section.
+
+    Args:
+        section (morphio.mut.Section): The section whose diameters are updated.
+        initial_diam (float): The initial diameter value.
+        taper (float): The taper value.
+        min_diam (float): The min diameter value.
+        max_diam (float): The max diameter value.
+    """
+    # lengths of each segments will be used for scaling of tapering
+    steps = _taper_steps_from_root(section_lengths(section).astype(float), taper, section.is_root)
+    section.diameters = _taper(initial_diam, steps, min_diam, max_diam).astype(np.float32)
 
 
 def taper_section_diam_from_tips(section, final_diam, taper, min_diam=0.07, max_diam=100.0):
@@ -157,24 +214,16 @@ def taper_section_diam_from_tips(section, final_diam, taper, min_diam=0.07, max_
         min_diam (float): The min diameter value.
         max_diam (float): The max diameter value.
     """
-    diams = [final_diam]
     # lengths of each segments will be used for scaling of tapering
-    lengths = section_lengths(section)
-    taps = taper / np.sum(lengths)
-
-    for i in range(len(section.diameters) - 1):
-        # Diameters increase from tip towards the root
-        new_diam = diams[-1] + taps * lengths[len(section.diameters) - 2 - i]
+    steps = _taper_steps_from_tips(section_lengths(section).astype(float), taper)
+    section.diameters = _taper(final_diam, steps, min_diam, max_diam)[::-1].astype(np.float32)
 
-        if new_diam >= max_diam:
-            diams.append(max_diam)
-        elif new_diam <= min_diam:
-            diams.append(min_diam)
-        else:
-            diams.append(new_diam)
 
-    diams.reverse()
-    section.diameters = np.array(diams, dtype=np.float32)
+def _mean_taper(diameters, lengths):
+    """Returns the mean tapering of a section."""
+    min_diam = np.min(diameters)
+    di_li = np.sum((diameters[:-1] + diameters[1:]) / 2.0 * lengths)
+    return (di_li - min_diam * np.sum(lengths)) / np.sum(lengths)
 
 
 def smooth_section_diam(section, min_diam=0.07):
@@ -184,36 +233,96 @@ def smooth_section_diam(section, min_diam=0.07):
         section (morphio.mut.Section): The section whose diameters are updated.
         min_diam (float): The min diameter value.
     """
-
-    def sec_mean_taper(sec):
-        """Returns the mean tapering of section."""
-        min_diam = min(sec.diameters)
-        lengths = [np.linalg.norm(i) for i in section.points[1:] - section.points[:-1]]
-        di_li = np.sum(
-            [
-                (sec.diameters[i] + sec.diameters[i + 1]) / 2.0 * lengths[i]
-                for i in range(len(sec.points) - 1)
-            ]
-        )
-        return (di_li - min_diam * np.sum(lengths)) / np.sum(lengths)
-
-    taper = sec_mean_taper(section)
+    diameters = section.diameters
+    taper = _mean_taper(diameters.astype(float), section_lengths(section).astype(float))
     taper_section_diam_from_root(
         section,
-        section.diameters[0],
+        diameters[0],
         taper,
         min_diam=min_diam,
-        max_diam=np.max(section.diameters),
+        max_diam=np.max(diameters),
     )
 
 
+class _NeuriteArrays:
+    """Flat arrays of the points and diameters of the sections of a neurite.
+
+    The sections are stored in the depth-first order of :meth:`morphio.mut.Section.iter`, so the
+    root section is the first one and each parent is stored before its children. The diameters
+    are modified in the arrays and written back to the sections with :meth:`write`.
+
+    Args:
+        root (morphio.mut.Section): The root section of the neurite.
+    """
+
+    def __init__(self, root):
+        self.sections = list(root.iter())
+        indices = {section.id: i for i, section in enumerate(self.sections)}
+        self.types = [section.type for section in self.sections]
+        self.parents = np.array(
+            [-1] + [indices[section.parent.id] for section in self.sections[1:]], dtype=int
+        )
+        self.children = [
+            [indices[child.id] for child in section.children] for section in self.sections
+        ]
+
+        diameters = [section.diameters for section in self.sections]
+        self.sizes = np.array([len(diams) for diams in diameters], dtype=int)
+        self.offsets = np.zeros(len(self.sections) + 1, dtype=int)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+        # Use the same precision as MorphIO
+        self.diameters = np.concatenate(diameters).astype(np.float32)
+
+    @cached_property
+    def lengths(self):
+        """The length of the segment ending at each point (0 for the first point of a section)."""
+        points = np.concatenate([section.points for section in self.sections])
+        lengths = np.zeros(len(points), dtype=float)
+        lengths[1:] = np.linalg.norm(points[1:] - points[:-1], axis=1)
+        lengths[self.offsets[:-1]] = 0
+        return lengths
+
+    def section_slice(self, section):
+        """Returns the slice of the points of a section in the arrays."""
+        return slice(self.offsets[section], self.offsets[section + 1])
+
+    def section_lengths(self, section):
+        """Returns the segment lengths of a section."""
+        return self.lengths[self.offsets[section] + 1 : self.offsets[section + 1]]
+
+    def taper_from_root(self, section, initial_diam, taper, min_diam, max_diam):
+        """Tapers the diameters of a section from its root."""
+        steps = _taper_steps_from_root(self.section_lengths(section), taper, section == 0)
+        self.diameters[self.section_slice(section)] = _taper(
+            initial_diam, steps, min_diam, max_diam
+        )
+
+    def taper_from_tips(self, section, final_diam, taper, min_diam, max_diam):
+        """Tapers the diameters of a section from its tip."""
+        steps = _taper_steps_from_tips(self.section_lengths(section), taper)
+        self.diameters[self.section_slice(section)] = _taper(final_diam, steps, min_diam, max_diam)[
+            ::-1
+        ]
+
+    def connect_children(self):
+        """Sets the first diameter of each child section to the last diameter of its parent."""
+        self.diameters[self.offsets[1:-1]] = self.diameters[self.offsets[self.parents[1:] + 1] - 1]
+
+    def write(self, sections=None):
+        """Writes the diameters to the sections (all of them by default)."""
+        if sections is None:
+            sections = range(len(self.sections))
+        for section in sections:
+            self.sections[section].diameters = self.diameters[self.section_slice(section)]
+
+
 def diametrize_from_root(
     neuron,
     neurite_type=None,
     *,
     model_params,
     random_generator=np.random,
-):  # pylint: disable=too-many-locals
+):
     """Corrects the diameters of a morphio-neuron according to the model.
 
     Starts from the root and moves towards the tips.
@@ -228,48 +337,47 @@ def diametrize_from_root(
         model = model_params[r.type.name]  # Selected by the root type.
         trunk_diam = sample(model["trunk"], random_generator)
         min_diam = np.min(model["term"])
-        status = {s.id: False for s in r.iter()}
+        neurite = _NeuriteArrays(r)
+        diameters = neurite.diameters
 
-        active = [r]
+        # The sections are processed in breadth-first order
+        active = deque([0])
 
         while active:
-            for section in list(active):
-                if section.is_root:
-                    taper = sample(model["trunk_taper"], random_generator)
-                    init_diam = trunk_diam
-                else:
-                    taper = sample(model["taper"], random_generator)
-                    init_diam = section.diameters[0]
-
-                taper_section_diam_from_root(
-                    section,
-                    init_diam,
-                    taper=taper,
-                    min_diam=min_diam,
-                    max_diam=trunk_diam,
-                )
-                status[section.id] = True  # Tapering of section complete.
-                active.remove(section)
+            section = active.popleft()
+            if section == 0:
+                taper = sample(model["trunk_taper"], random_generator)
+                init_diam = trunk_diam
+            else:
+                taper = sample(model["taper"], random_generator)
+                init_diam = diameters[neurite.offsets[section]]
+
+            neurite.taper_from_root(
+                section,
+                init_diam,
+                taper=taper,
+                min_diam=min_diam,
+                max_diam=trunk_diam,
+            )
 
-                children = np.array(section.children)
+            children = neurite.children[section]
 
-                if len(children) > 1:
-                    d1 = bifurcator(
-                        section.diameters[-1],
-                        len(children),
-                        rall_ratio=model["Rall_ratio"],
-                        siblings_ratio=model["siblings_ratio"],
-                    )
+            if len(children) > 1:
+                d1 = bifurcator(
+                    diameters[neurite.offsets[section + 1] - 1],
+                    len(children),
+                    rall_ratio=model["Rall_ratio"],
+                    siblings_ratio=model["siblings_ratio"],
+                )
 
-                    for i, ch in enumerate(children):
-                        new_diam = d1 if i == 0 else d1 * model["siblings_ratio"]
-                        redefine_diameter_section(ch, 0, new_diam)
-                        active.append(ch)
+                for i, ch in enumerate(children):
+                    new_diam = d1 if i == 0 else d1 * model["siblings_ratio"]
+                    diameters[neurite.offsets[ch]] = new_diam
+                    active.append(ch)
 
-        for section in r.iter():
-            if not section.is_root:  # if section is not root replace diameter with parent
-                # Ensures duplicate points consistency. First point will be removed while written.
-                redefine_diameter_section(section, 0, section.parent.diameters[-1])
+        # Ensures duplicate points consistency. First point will be removed while written.
+        neurite.connect_children()
+        neurite.write()
 
 
 def diametrize_from_tips(neuron, neurite_type=None, *, model_params, random_generator=np.random):
@@ -287,45 +395,50 @@ def diametrize_from_tips(neuron, neurite_type=None, *, model_params, random_gene
         model = model_params[r.type.name]  # Selected by the root type.
         trunk_diam = sample(model["trunk"], random_generator)
         min_diam = np.min(model["term"])
-        tips = [s for s in r.iter() if not s.children]
-        status = {s.id: False for s in r.iter()}
+        neurite = _NeuriteArrays(r)
+        diameters = neurite.diameters
+        # The number of children of each section whose tapering is not complete
+        pending = np.array([len(children) for children in neurite.children], dtype=int)
+        tips = np.flatnonzero(pending == 0).tolist()
 
         for tip in tips:
-            redefine_diameter_section(
-                tip, len(tip.diameters) - 1, sample(model["term"], random_generator)
-            )
+            diameters[neurite.offsets[tip + 1] - 1] = sample(model["term"], random_generator)
 
-        active = tips
+        # The sections are processed in the order their children are complete
+        active = deque(tips)
 
         while active:
-            for section in list(active):
-                taper = (
-                    sample(model["trunk_taper"], random_generator)
-                    if section.is_root
-                    else sample(model["taper"], random_generator)
-                )
+            section = active.popleft()
+            taper = (
+                sample(model["trunk_taper"], random_generator)
+                if section == 0
+                else sample(model["taper"], random_generator)
+            )
 
-                taper_section_diam_from_tips(
-                    section,
-                    section.diameters[-1],
-                    taper=taper,
-                    min_diam=min_diam,
-                    max_diam=trunk_diam,
-                )
-                status[section.id] = True  # Tapering of section complete.
-                active.remove(section)
+            neurite.taper_from_tips(
+                section,
+                diameters[neurite.offsets[section + 1] - 1],
+                taper=taper,
+                min_diam=min_diam,
+                max_diam=trunk_diam,
+            )
 
-                if not section.is_root:
-                    par = section.parent
-                    if np.all([status[ch.id] for ch in par.children]):
-                        # Assign a new diameter to the last point if section is not terminal
-                        merger(par, trunk_diam, model["Rall_ratio"])
-                        active.append(par)
+            if section != 0:
+                par = neurite.parents[section]
+                pending[par] -= 1
+                if pending[par] == 0:
+                    # Assign a new diameter to the last point if section is not terminal
+                    # (diameters[0] of the children is the duplicate point)
+                    diameters[neurite.offsets[par + 1] - 1] = _merged_diameter(
+                        diameters[neurite.offsets[neurite.children[par]] + 1],
+                        trunk_diam,
+                        model["Rall_ratio"],
+                    )
+                    active.append(par)
 
-        for section in r.iter():
-            if not section.is_root:  # if section is not root replace diameter with parent
-                # Ensures duplicate points consistency. First point will be removed while written.
-                redefine_diameter_section(section, 0, section.parent.diameters[-1])
+        # Ensures duplicate points consistency. First point will be removed while written.
+        neurite.connect_children()
+        neurite.write()
 
 
 def diametrize_constant_per_section(neuron, neurite_type=None):
@@ -335,9 +448,16 @@ def diametrize_constant_per_section(neuron, neurite_type=None):
         neuron (morphio.mut.Morphology): The morphology that will be diametrized.
         neurite_type (morphio.SectionType): Only the neurites of this type are diametrized.
     """
-    for sec in section_filter(neuron, neurite_type):
-        mean_diam = np.mean(sec.diameters)
-        sec.diameters = mean_diam * np.ones(len(sec.diameters))
+    for root in root_section_filter(neuron):
+        neurite = _NeuriteArrays(root)
+        selected = [
+            i for i, sec_type in enumerate(neurite.types) if neurite_type in (None, sec_type)
+        ]
+        if not selected:
+            continue
+        means = np.add.reduceat(neurite.diameters.astype(float), neurite.offsets[:-1])
+        neurite.diameters[:] = np.repeat(means / neurite.sizes, neurite.sizes)
+        neurite.write(selected)
 
 
 def diametrize_constant_per_neurite(neuron, neurite_type=None):
@@ -347,12 +467,10 @@ def diametrize_constant_per_neurite(neuron, neurite_type=None):
         neuron (morphio.mut.Morphology): The morphology that will be diametrized.
         neurite_type (morphio.SectionType): Only the neurites of this type are diametrized.
     """
-    roots = root_section_filter(neuron, neurite_type)
-
-    for root in roots:
-        mean_diam = np.mean(np.hstack([sec.diameters for sec in root.iter()]))
-        for sec in root.iter():
-            sec.diameters = mean_diam * np.ones(len(sec.diameters))
+    for root in root_section_filter(neuron, neurite_type):
+        neurite = _NeuriteArrays(root)
+        neurite.diameters[:] = np.mean(neurite.diameters)
+        neurite.write()
 
 
 def diametrize_uniform(neuron, neurite_type=None, *, diam_params):
@@ -366,11 +484,11 @@ def diametrize_uniform(neuron, neurite_type=None, *, diam_params):
     diameter = diam_params.get(neurite_type.name, None)
     if diameter is None:
         return
-    roots = root_section_filter(neuron, neurite_type)
 
-    for root in roots:
-        for sec in root.iter():
-            sec.diameters = diameter * np.ones(len(sec.diameters))
+    for root in root_section_filter(neuron, neurite_type):
+        neurite = _NeuriteArrays(root)
+        neurite.diameters[:] = diameter
+        neurite.write()
 
 
 def diametrize_smoothing(neuron, neurite_type=None):
@@ -380,8 +498,18 @@ def diametrize_smoothing(neuron, neurite_type=None):
         neuron (morphio.mut.Morphology): The morphology that will be diametrized.
         neurite_type (morphio.SectionType): Only the neurites of this type are diametrized.
     """
-    for sec in section_filter(neuron, neurite_type):
-        smooth_section_diam(sec)
+    for root in root_section_filter(neuron):
+        neurite = _NeuriteArrays(root)
+        selected = [
+            i for i, sec_type in enumerate(neurite.types) if neurite_type in (None, sec_type)
+        ]
+        for section in selected:
+            diameters = neurite.diameters[neurite.section_slice(section)].astype(float)
+            taper = _mean_taper(diameters, neurite.section_lengths(section))
+            neurite.taper_from_root(
+                section, diameters[0], taper, min_diam=0.07, max_diam=np.max(diameters)
+            )
+        neurite.write(selected)
 
 
 diam_methods = {
@@ -394,6 +522,97 @@ diam_methods = {
 }
 
 
+_OPTIONAL_ARGUMENTS = ("model_params", "diam_params", "random_generator")
+
+_BLOCK_SIZE = 1024
+
+
+class _BlockSampler:
+    """Sample values from sequences with blocks of random indices.
+
+    The indices are drawn in blocks with ``numpy.random.Generator.integers()`` for each length of
+    sequence, which is much faster than one call to ``numpy.random.Generator.choice()`` per value.
+    The values follow the same distribution, but the random stream is not the same as the one of
+    successive ``choice()`` calls, and the indices left in the blocks are discarded.
+
+    Args:
+        random_generator (numpy.random.Generator): The random number generator to use.
+        block_size (int): The number of indices drawn at once.
+    """
+
+    def __init__(self, random_generator, block_size=_BLOCK_SIZE):
+        self._rng = random_generator
+        self._block_size = block_size
+        self._indices = {}
+
+    def choice(self, data):
+        """Return a random element of the data."""
+        size = len(data)
+        if size == 0:
+            raise ValueError("a cannot be empty unless no samples are taken")
+        try:
+            index = next(self._indices[size])
+        except (KeyError, StopIteration):
+            self._indices[size] = iter(self._rng.integers(0, size, size=self._block_size).tolist())
+            index = next(self._indices[size])
+        return data[index]
+
+
+_BLOCK_SAMPLED_METHODS = (diametrize_from_root, diametrize_from_tips)
+"""The methods that only use the random generator through ``sample()``."""
+
+
+def _resolve_diam_method(diam_method):
+    """Return the diametrization function from its name or the given function."""
+    if isinstance(diam_method, str):
+        try:
+            return diam_methods[diam_method]
+        except KeyError as exc:
+            raise KeyError(
+                "The name of the diametrization method is unknown: "
+                f"'{diam_method}' is not in {list(diam_methods.keys())}"
+            ) from exc
+
+    if not hasattr(diam_method, "__call__"):
+        raise ValueError(f"Diameter method not understood, we got {diam_method}")
+    return diam_method
+
+
+def _resolve_neurite_types(neurite_types):
+    """Return the section types of the neurites that are diametrized."""
+    if neurite_types is None:
+        return [SectionType.apical_dendrite, SectionType.basal_dendrite]
+    return [
+        getattr(SectionType, tree_type) if isinstance(tree_type, str) else tree_type
+        for tree_type in neurite_types
+    ]
+
+
+@lru_cache(maxsize=128)
+def _cached_optional_arguments(diam_method):
+    parameters = inspect.signature(diam_method).parameters
+    return tuple(name for name in _OPTIONAL_ARGUMENTS if name in parameters)
+
+
+def _optional_arguments(diam_method):
+    """Return the names of the optional arguments of a diametrization method."""
+    try:
+        return _cached_optional_arguments(diam_method)
+    except TypeError:
+        # The method is not hashable
+        return _cached_optional_arguments.__wrapped__(diam_method)
+
+
+def _method_kwargs(diam_method, input_model, diam_params, random_generator):
+    """Return the optional arguments passed to a diametrization method."""
+    values = {
+        "model_params": input_model,
+        "diam_params": diam_params,
+        "random_generator": random_generator,
+    }
+    return {name: values[name] for name in _optional_arguments(diam_method)}
+
+
 def build(
     neuron,
     input_model=None,
@@ -425,30 +644,94 @@ def build(
 
     and should only update the neuron object.
     """
-    if neurite_types is None:
-        neurite_types = [SectionType.apical_dendrite, SectionType.basal_dendrite]
+    diam_method = _resolve_diam_method(diam_method)
+    kwargs = _method_kwargs(diam_method, input_model, diam_params, random_generator)
+    for tree_type in _resolve_neurite_types(neurite_types):
+        diam_method(neuron, tree_type, **kwargs)
 
-    if isinstance(diam_method, str):
-        try:
-            diam_method = diam_methods[diam_method]
-        except KeyError as exc:
-            raise KeyError(
-                "The name of the diametrization method is unknown: "
-                f"'{diam_method}' is not in {list(diam_methods.keys())}"
-            ) from exc
 
-    elif not hasattr(diam_method, "__call__"):
-        raise ValueError(f"Diameter method not understood, we got {diam_method}")
+def build_population(
+    morphologies,
+    input_model=None,
+    neurite_types=None,
+    diam_method=None,
+    diam_params=None,
+    random_generator=np.random,
+):
+    """Diametrize several morphologies according to the selected method.
+
+    The method and its arguments are resolved once for all the morphologies. When the
+    ``M4`` or ``M5`` method is used with a ``numpy.random.Generator``, the values of the
+    model are sampled with blocks of random indices. The diameters then follow the same
+    distributions as the ones given by ``build()`` called on each morphology in turn, but they
+    are not the same for a given generator.
+
+    Args:
+        morphologies (list[morphio.mut.Morphology]): The morphologies that will be diametrized.
+        input_model (dict): The model parameters.
+        neurite_types (list[str]): Only the neurites of these types are diametrized.
+        diam_method (str or callable): The name of the diametrization method.
+        diam_params (dict): The parameters passed to the diametrization method.
+        random_generator (numpy.random.Generator): The random number generator to use.
+
+    See ``build()`` for the details of the diametrization methods.
+    """
+    diam_method = _resolve_diam_method(diam_method)
+    neurite_types = _resolve_neurite_types(neurite_types)
+
+    sampler = None
+    if diam_method in _BLOCK_SAMPLED_METHODS and isinstance(random_generator, np.random.Generator):
+        sampler = _BlockSampler(random_generator)
+
+    kwargs = _method_kwargs(diam_method, input_model, diam_params, sampler or random_generator)
+    for neuron in morphologies:
+        for tree_type in neurite_types:
+            diam_method(neuron, tree_type, **kwargs)
+
+
+class DefaultDiameterModel:
+    """The ``default`` diameter model prepared once to diametrize several cells.
+
+    The diameters are computed with the ``simpler`` model of the ``diameter-synthesis`` package.
+    The model parameters, the configuration and the neurite types are copied and parsed once, so
+    the given inputs are never updated, and they are given to
+    :func:`diameter_synthesis.build_diameters.build` for each cell.
 
-    for tree_type in neurite_types:
-        if isinstance(tree_type, str):
-            tree_type = getattr(SectionType, tree_type)
-        param_signature = list(inspect.signature(diam_method).parameters.keys())
-        optional_kw = {}
-        if "model_params" in param_signature:
-            optional_kw["model_params"] = input_model
-        if "diam_params" in param_signature:
-            optional_kw["diam_params"] = diam_params
-        if "random_generator" in param_signature:
-            optional_kw["random_generator"] = random_generator
-        diam_method(neuron, tree_type, **optional_kw)
+    Args:
+        model_params (dict): The model parameters (the ``diameter`` entry of the distributions).
+        diam_params (dict): The configuration (the ``diameter_params`` entry of the parameters).
+        neurite_types (list[str]): The types of the neurites that are diametrized if they are not
+            given in ``diam_params``.
+    """
+
+    MODELS = ["simpler"]
+
+    def __init__(self, model_params, diam_params=None, neurite_types=None):
+        self.model_params = copy.deepcopy(model_params)
+        self.diam_params = copy.deepcopy(diam_params or {})
+        if self.diam_params.get("models", self.MODELS) != self.MODELS:
+            L.warning(
+                "The default diameter model only uses the %s models, so the %s models are ignored",
+                self.MODELS,
+                self.diam_params["models"],
+            )
+        self.diam_params["models"] = list(self.MODELS)
+        self.neurite_types = _resolve_neurite_types(
+            self.diam_params.get("neurite_types") or neurite_types
+        )
+
+    def __call__(self, neuron, apical_point_sec_ids=None, random_generator=np.random):
+        """Diametrize a cell.
+
+        Args:
+            neuron (morphio.mut.Morphology): The morphology that will be diametrized.
+            apical_point_sec_ids (list[int]): The IDs of the sections of the apical points.
+            random_generator (numpy.random.Generator): The random number generator to use.
+        """
+        model_params = self.model_params
+        if apical_point_sec_ids is not None:
+            model_params = {**model_params, "apical_point_sec_ids": apical_point_sec_ids}
+        for neurite_type in self.neurite_types:
+            build_diameters.build(
+                neuron, neurite_type, model_params, self.diam_params, random_generator
+            )
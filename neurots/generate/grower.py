@@ -20,7 +20,6 @@ import json
 import logging
 
 import numpy as np
-from diameter_synthesis import build_diameters
 from morphio import SomaType
 from morphio.mut import Morphology
 from numpy.random import BitGenerator
@@ -30,17 +29,20 @@ from numpy.random import SeedSequence
 
 from neurots.generate import diametrizer
 from neurots.generate import orientations as _oris
+from neurots.generate.algorithms.barcode import BarcodeTemplates
+from neurots.generate.morphology_builder import MorphologyBuilder
 from neurots.generate.orientations import OrientationManager
 from neurots.generate.orientations import check_3d_angles
 from neurots.generate.soma import Soma
 from neurots.generate.soma import SomaGrower
+from neurots.generate.statistics import NULL_STATISTICS
+from neurots.generate.statistics import GrowthStatistics
 from neurots.generate.tree import TreeGrower
 from neurots.morphmath import sample
 from neurots.morphmath.utils import normalize_vectors
 from neurots.preprocess import preprocess_inputs
 from neurots.utils import NeuroTSError
 from neurots.utils import convert_from_legacy_neurite_type
-from neurots.utils import point_to_section_segment
 
 L = logging.getLogger(__name__)
 
@@ -57,6 +59,52 @@ def _load_json(path_or_json):
     return convert_from_legacy_neurite_type(data)
 
 
+class CompiledSynthesisInputs:
+    """Synthesis inputs loaded, validated and preprocessed once to be shared by several growers.
+
+    Building a :class:`NeuronGrower` from raw inputs loads (or deep-copies) them, converts the
+    legacy neurite types and runs all the registered validators and preprocessors. This object
+    does all this work only once so the result can be given to any number of growers, which
+    consider it as read-only data. The barcodes of the persistence diagrams are also built once,
+    when the inputs are compiled, and copied for each new tree, and the distributions of the
+    soma size, of the number of trees and of the trunk angles are only built the first time they
+    are sampled (see :class:`neurots.morphmath.sample.DistrCache`).
+
+    Args:
+        input_parameters (dict or str): The user-defined parameters or a path to a JSON file.
+        input_distributions (dict or str): The distributions extracted from biological data or a
+            path to a JSON file.
+        skip_preprocessing (bool): If set to ``False``, the parameters and distributions are
+            preprocessed with registered validator and preprocessors.
+    """
+
+    def __init__(self, input_parameters, input_distributions, skip_preprocessing=False):
+        self.parameters = _load_json(input_parameters)
+        L.debug("Input Parameters: %s", self.parameters)
+        self.distributions = _load_json(input_distributions)
+
+        # Validate and preprocess parameters and distributions
+        if not skip_preprocessing:
+            self.parameters, self.distributions = preprocess_inputs(
+                self.parameters, self.distributions
+            )
+
+        self.distr_cache = sample.DistrCache()
+        self.barcode_templates = {
+            neurite_type: BarcodeTemplates(distributions["persistence_diagram"])
+            for neurite_type, distributions in self.distributions.items()
+            if isinstance(distributions, dict) and "persistence_diagram" in distributions
+        }
+
+        self.diameter_model = None
+        if self.distributions.get("diameter", {}).get("method") == "default":
+            self.diameter_model = diametrizer.DefaultDiameterModel(
+                self.distributions["diameter"],
+                self.parameters.get("diameter_params"),
+                neurite_types=self.parameters.get("grow_types"),
+            )
+
+
 class NeuronGrower:
     """The main class for growing algorithms of neurons.
 
@@ -65,7 +113,9 @@ class NeuronGrower:
     consumed by the algorithms and the user-selected parameters are also stored.
 
     Args:
-        input_parameters (dict): The user-defined parameters.
+        input_parameters (dict or CompiledSynthesisInputs): The user-defined parameters or the
+            compiled inputs (in this case the ``input_distributions`` and ``skip_preprocessing``
+            arguments are ignored).
         input_distributions (dict): Distributions extracted from biological data.
         context (Any): An object containing contextual information.
         external_diametrizer (Callable): Diametrizer function for external diametrizer module
@@ -77,20 +127,45 @@ class NeuronGrower:
         trunk_orientations_class (typing.Generic[OrientationManagerBase]): The class used to
             build the trunk orientation manager. This class should inherit from
             :class:`neurots.generate.orientations.OrientationManagerBase`.
+        random_block_size (int): If given, the random numbers used to grow the sections of each
+            tree are drawn by blocks of this size from a stream seeded by ``rng_or_seed`` (see
+            :class:`neurots.morphmath.sample.BlockSampler`). This is faster but the cells are not
+            the same as the ones grown when the numbers are drawn one by one (the default).
+        instrument (bool): If set to ``True``, the time spent in each phase of the growth and the
+            number of steps, sections, bifurcations, terminations and barcode lookups are recorded
+            in :attr:`statistics` (see :class:`neurots.generate.statistics.GrowthStatistics`).
+        origin (numpy.ndarray): If given, it replaces the ``origin`` parameter for this cell.
+        pia_direction (numpy.ndarray): If given, it replaces the ``pia_direction`` parameter for
+            this cell.
+        soma_radius (float): If given, this soma radius is used instead of a sampled one.
+        trunk_orientations (dict): If given, the trunks are grown from these orientations instead
+            of the ones of the trunk orientation manager. It must map each tree type of the
+            ``grow_types`` parameter to an array of shape ``(n_trees, 3)``, like the orientations
+            returned for each cell by the ``compute_population_orientations()`` method of the
+            trunk orientation managers.
     """
 
+    # pylint: disable-msg=too-many-arguments
     def __init__(
         self,
         input_parameters,
-        input_distributions,
+        input_distributions=None,
         context=None,
         external_diametrizer=None,
         skip_preprocessing=False,
         rng_or_seed=np.random,
         trunk_orientations_class=OrientationManager,
+        random_block_size=None,
+        instrument=False,
+        origin=None,
+        pia_direction=None,
+        soma_radius=None,
+        trunk_orientations=None,
     ):
         """Constructor of the NeuronGrower class."""
         self.neuron = Morphology()
+        # The sections are stored in the builder during the growth and added to the neuron after
+        self._morphology_builder = MorphologyBuilder()
         self.context = context
         if rng_or_seed is None or isinstance(
             rng_or_seed, (int, np.integer, SeedSequence, BitGenerator)
@@ -104,23 +179,36 @@ class NeuronGrower:
                 "following types: [int, SeedSequence, BitGenerator, RandomState, Generator]."
             )
 
-        self.input_parameters = _load_json(input_parameters)
-        L.debug("Input Parameters: %s", self.input_parameters)
-        self.input_distributions = _load_json(input_distributions)
-
-        # Validate and preprocess parameters and distributions
-        if not skip_preprocessing:
-            self.input_parameters, self.input_distributions = preprocess_inputs(
-                self.input_parameters, self.input_distributions
+        if not isinstance(input_parameters, CompiledSynthesisInputs):
+            input_parameters = CompiledSynthesisInputs(
+                input_parameters, input_distributions, skip_preprocessing=skip_preprocessing
             )
 
+        # The compiled inputs may be shared with other growers so they are never updated in place,
+        # only the top-level entries are copied so they can be replaced
+        self.input_parameters = dict(input_parameters.parameters)
+        self.input_distributions = dict(input_parameters.distributions)
+        self._barcode_templates = input_parameters.barcode_templates
+        self._diameter_model = input_parameters.diameter_model
+        self._distr_cache = input_parameters.distr_cache
+        if origin is not None:
+            self.input_parameters["origin"] = origin
+        if pia_direction is not None:
+            self.input_parameters["pia_direction"] = pia_direction
+
         # A list of trees with the corresponding orientations
         # and initial points on the soma surface will be initialized.
         self.active_neurites = []
         self.soma_grower = SomaGrower(
             Soma(
                 center=self.input_parameters["origin"],
-                radius=sample.soma_size(self.input_distributions, self._rng),
+                radius=(
+                    soma_radius
+                    if soma_radius is not None
+                    else sample.soma_size(
+                        self.input_distributions, self._rng, distr_cache=self._distr_cache
+                    )
+                ),
             ),
             context=context,
             rng=self._rng,
@@ -134,6 +222,9 @@ class NeuronGrower:
         self._init_diametrizer(external_diametrizer=external_diametrizer)
 
         self._trunk_orientations_class = trunk_orientations_class
+        self._trunk_orientations = trunk_orientations
+        self._random_block_size = random_block_size
+        self.statistics = GrowthStatistics() if instrument else NULL_STATISTICS
 
     def next(self):
         """Call the "next" method of each neurite grower."""
@@ -147,6 +238,9 @@ class NeuronGrower:
                     and grower.type == self.input_parameters["apical_dendrite"]["tree_type"]
                 ):
                     self.apical_sections.append(grower.growth_algo.apical_section)
+                barcode = getattr(grower.growth_algo, "barcode", None)
+                if barcode is not None:
+                    self.statistics.count("barcode_lookups", barcode.n_lookups)
                 self.active_neurites.remove(grower)
             else:
                 grower.next_point()
@@ -164,25 +258,33 @@ class NeuronGrower:
         self._grow_soma()
         while self.active_neurites:
             self.next()  # pylint: disable=E1102
-        self._post_grow()
-        self._diametrize()
+        self._finish_growth()
         return self.neuron
 
+    def _finish_growth(self):
+        """Build the morphology from the grown sections, then post-process and diametrize it."""
+        with self.statistics.timer("build_morphology"):
+            self._build_morphology()
+        self.statistics.count("sections", len(self._morphology_builder))
+        self.statistics.count("points", len(self._morphology_builder.points))
+        with self.statistics.timer("post_grow"):
+            self._post_grow()
+        with self.statistics.timer("diametrization"):
+            self._diametrize()
+
+    def _build_morphology(self):
+        """Add the grown sections to the neuron.
+
+        The section IDs of the neuron are consistent with the MorphIO loaders.
+        """
+        self._morphology_builder.to_morphology(self.neuron)
+
     def _post_grow(self):
         """Actions after the morphology has been grown and before its diametrization."""
-        # ensures section.id are consistent with morphio loader
-        apical_points = [
-            self.neuron.sections[apical_section].points[-1] if apical_section is not None else None
-            for apical_section in self.apical_sections
-        ]
-
-        self.neuron = Morphology(self.neuron)
-
+        final_ids = self._morphology_builder.final_section_ids
         self.apical_sections = [
-            point_to_section_segment(self.neuron, apical_point)[0]
-            if apical_point is not None
-            else None
-            for apical_point in apical_points
+            int(final_ids[apical_section]) if apical_section is not None else None
+            for apical_section in self.apical_sections
         ]
 
     def _init_diametrizer(self, external_diametrizer=None):
@@ -196,18 +298,29 @@ class NeuronGrower:
         if self.input_distributions["diameter"]["method"] == "no_diameters":
             self._diametrize = lambda: None
             L.warning("No diametrizer provided, so neurons will have default diameters.")
+        elif self.input_distributions["diameter"]["method"] == "default":
+
+            def _diametrize_default():
+                """Diametrizer function using the default diameter model."""
+                self._diameter_model(
+                    self.neuron,
+                    apical_point_sec_ids=self.apical_sections,
+                    random_generator=self._rng,
+                )
+
+            self._diametrize = _diametrize_default
         else:
             if self.input_distributions["diameter"]["method"] == "external":
                 diam_method = external_diametrizer
-            elif self.input_distributions["diameter"]["method"] == "default":
-                self.input_parameters["diameter_params"]["models"] = ["simpler"]
-                diam_method = build_diameters.build
             else:
                 diam_method = self.input_distributions["diameter"]["method"]
 
             def _diametrize():
                 """Diametrizer function."""
-                self.input_distributions["diameter"]["apical_point_sec_ids"] = self.apical_sections
+                self.input_distributions["diameter"] = {
+                    **self.input_distributions["diameter"],
+                    "apical_point_sec_ids": self.apical_sections,
+                }
                 neurite_types = self.input_parameters.get("diameter_params", {}).get(
                     "neurite_types", None
                 )
@@ -246,8 +359,12 @@ class NeuronGrower:
                     orientation /= np.linalg.norm(orientation)
 
                     # Pick random absolute angles
-                    trunk_absolute_angles = sample.trunk_absolute_angles(distr, n_trees, self._rng)
-                    z_angles = sample.azimuth_angles(distr, n_trees, self._rng)
+                    trunk_absolute_angles = sample.trunk_absolute_angles(
+                        distr, n_trees, self._rng, distr_cache=self._distr_cache
+                    )
+                    z_angles = sample.azimuth_angles(
+                        distr, n_trees, self._rng, distr_cache=self._distr_cache
+                    )
 
                     phis, thetas = _oris.trunk_absolute_orientation_to_spherical_angles(
                         orientation, trunk_absolute_angles, z_angles
@@ -277,8 +394,10 @@ class NeuronGrower:
             orientations_i = []
             for phi_interval, i_n_trees in zip(phi_intervals, interval_n_trees):
                 phis, thetas = _oris.trunk_to_spherical_angles(
-                    sample.trunk_angles(distr, i_n_trees, self._rng),
-                    sample.azimuth_angles(distr, i_n_trees, self._rng),
+                    sample.trunk_angles(distr, i_n_trees, self._rng, distr_cache=self._distr_cache),
+                    sample.azimuth_angles(
+                        distr, i_n_trees, self._rng, distr_cache=self._distr_cache
+                    ),
                     phi_interval,
                 )
                 orientations_i.append(_oris.spherical_angles_to_orientations(phis, thetas))
@@ -312,6 +431,7 @@ class NeuronGrower:
                 distributions=self.input_distributions,
                 context=self.context,
                 rng=self._rng,
+                distr_cache=self._distr_cache,
             )
 
         for type_of_tree in tree_types:
@@ -319,7 +439,9 @@ class NeuronGrower:
             distr = self.input_distributions[type_of_tree]
 
             if legacy_mode:
-                n_trees = sample.n_neurites(distr["num_trees"], random_generator=self._rng)
+                n_trees = sample.n_neurites(
+                    distr["num_trees"], random_generator=self._rng, distr_cache=self._distr_cache
+                )
 
                 if type_of_tree == "basal_dendrite" and n_trees < 2:
                     raise NeuroTSError(
@@ -342,20 +464,7 @@ class NeuronGrower:
 
                 points = self.soma_grower.add_points_from_orientations(orientations)
 
-            # Iterate over all initial points on the soma and create new trees
-            # with a direction and initial_point
-            for p in points:
-                self.active_neurites.append(
-                    TreeGrower(
-                        self.neuron,
-                        initial_direction=self.soma_grower.soma.orientation_from_point(p),
-                        initial_point=p,
-                        parameters=params,
-                        distributions=distr,
-                        context=self.context,
-                        random_generator=self._rng,
-                    )
-                )
+            self._add_trees(type_of_tree, points)
 
     def _3d_angles_grow_trunks(self):
         """Grow trunk with 3d_angles method via :func:`.orientation.OrientationManager` class.
@@ -369,31 +478,70 @@ class NeuronGrower:
             distributions=self.input_distributions,
             context=self.context,
             rng=self._rng,
+            distr_cache=self._distr_cache,
         )
         for neurite_type in self.input_parameters["grow_types"]:
             orientations = trunk_orientations_manager.compute_tree_type_orientations(neurite_type)
+            self._add_trees(
+                neurite_type, self.soma_grower.add_points_from_orientations(orientations)
+            )
 
-            for p in self.soma_grower.add_points_from_orientations(orientations):
-                self.active_neurites.append(
-                    TreeGrower(
-                        self.neuron,
-                        initial_direction=self.soma_grower.soma.orientation_from_point(p),
-                        initial_point=p,
-                        parameters=self.input_parameters[neurite_type],
-                        distributions=self.input_distributions[neurite_type],
-                        context=self.context,
-                        random_generator=self._rng,
-                    )
+    def _predefined_grow_trunks(self):
+        """Grow the trunks from the orientations given to the constructor.
+
+        As in :meth:`_simple_grow_trunks`, there must be at least 2 basal dendrites when the
+        trunks are not grown from 3d angles.
+        """
+        for neurite_type in self.input_parameters["grow_types"]:
+            if neurite_type not in self._trunk_orientations:
+                raise NeuroTSError(
+                    f"The trunk orientations of the '{neurite_type}' trees are missing"
+                )
+            orientations = self._trunk_orientations[neurite_type]
+
+            if (
+                neurite_type == "basal_dendrite"
+                and len(orientations) < 2
+                and not check_3d_angles(self.input_parameters)
+            ):
+                raise NeuroTSError(
+                    f"There should be at least 2 basal dendrites (got {len(orientations)})"
                 )
 
+            self._add_trees(
+                neurite_type, self.soma_grower.add_points_from_orientations(orientations)
+            )
+
+    def _add_trees(self, tree_type, points):
+        """Create a tree of the given type starting at each of the given points on the soma."""
+        for p in points:
+            self.active_neurites.append(
+                TreeGrower(
+                    self._morphology_builder,
+                    initial_direction=self.soma_grower.soma.orientation_from_point(p),
+                    initial_point=p,
+                    parameters=self.input_parameters[tree_type],
+                    distributions=self.input_distributions[tree_type],
+                    context=self.context,
+                    random_generator=self._rng,
+                    random_block_size=self._random_block_size,
+                    statistics=self.statistics,
+                    barcode_templates=self._barcode_templates.get(tree_type),
+                )
+            )
+
     def _grow_trunks(self):
         """Grow the trunks.
 
         Two methods are available, depending on the data present in the `input_parameters`.
         If no `3d_angles` entry is present, we grow trunks with :func:`_simple_grow_trunks` else
-        we fit the raw binned 3d angle data and apply :func:`_3d_angles_grow_trunks`.
+        we fit the raw binned 3d angle data and apply :func:`_3d_angles_grow_trunks`. If trunk
+        orientations were given to the constructor, they are used with
+        :func:`_predefined_grow_trunks` instead.
         """
-        if check_3d_angles(self.input_parameters):
+        if self._trunk_orientations is not None:
+            self._predefined_grow_trunks()
+        elif check_3d_angles(self.input_parameters):
             self._3d_angles_grow_trunks()
         else:
             self._simple_grow_trunks()
@@ -403,9 +551,11 @@ class NeuronGrower:
 
         The coordinates of the soma contour are retrieved from the trunks.
         """
-        self._grow_trunks()
+        with self.statistics.timer("trunk_orientation"):
+            self._grow_trunks()
 
-        points, diameters = self.soma_grower.build(soma_type)
+        with self.statistics.timer("soma"):
+            points, diameters = self.soma_grower.build(soma_type)
         self.neuron.soma.points = points
         self.neuron.soma.diameters = diameters
 
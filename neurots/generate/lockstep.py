@@ -0,0 +1,593 @@
+"""NeuroTS lockstep engine: grow the sections of many neurons together."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from time import perf_counter
+
+import numpy as np
+from morphio import SectionType
+
+from neurots.generate.algorithms.basicgrower import AxonAlgo
+from neurots.generate.algorithms.basicgrower import TrunkAlgo
+from neurots.generate.algorithms.tmdgrower import TMDAlgo
+from neurots.generate.algorithms.tmdgrower import TMDApicalAlgo
+from neurots.generate.algorithms.tmdgrower import TMDGradientAlgo
+from neurots.generate.section import DISTANCE_MIN
+from neurots.generate.section import MEMORY
+from neurots.generate.section import WEIGHTS
+from neurots.generate.section import SectionGrower
+from neurots.generate.section import SectionGrowerPath
+from neurots.generate.section import SectionGrowerTMD
+from neurots.utils import NeuroTSError
+
+L = logging.getLogger(__name__)
+
+# The stop criterion used by each section grower class
+_NUM_SEG = 0
+_PATH = 1
+_RADIAL = 2
+_SECTION_KINDS = {
+    SectionGrower: _NUM_SEG,
+    SectionGrowerPath: _PATH,
+    SectionGrowerTMD: _RADIAL,
+}
+
+# The growth algorithms supported by the engine and the implementations of their methods that
+# are reproduced or called by the engine
+_GROWTH_ALGOS = (TMDAlgo, TMDApicalAlgo, TMDGradientAlgo, TrunkAlgo, AxonAlgo)
+_GROWTH_ALGO_METHODS = {
+    name: {getattr(algo, name) for algo in _GROWTH_ALGOS}
+    for name in ["extend", "bifurcate", "terminate"]
+}
+
+
+class LockstepGrower:
+    """Grow several neurons in lockstep.
+
+    The :meth:`neurots.generate.grower.NeuronGrower.grow` method grows the sections one point at a
+    time. Instead, this engine stores the state of all the active sections of all the given growers
+    in arrays and adds one point to each of them at each step using vectorized operations. Only the
+    sections that bifurcate or terminate are then processed one by one by the growth algorithms of
+    their trees.
+
+    As in :meth:`neurots.generate.tree.TreeGrower.next_point`, when a section bifurcates one point
+    is added to the other active sections of its tree. The random numbers are not drawn in the same
+    order as in :meth:`neurots.generate.grower.NeuronGrower.grow`, so the morphologies are not
+    identical to the ones grown by this method, though they are drawn from the same
+    distributions. Each neuron only
+    uses the random number generator of its grower, so a neuron does not depend on the other
+    neurons grown in the same batch.
+
+    The growers that are instrumented record their statistics as in
+    :meth:`neurots.generate.grower.NeuronGrower.grow`, except that the time of each vectorized step
+    is shared among the neurons in proportion to their number of active sections.
+
+    .. note::
+        Only the growth algorithms and section growers of
+        :mod:`neurots.generate.tree` are supported, so astrocytes can not be grown with this engine.
+        The subclasses of these growth algorithms are only supported if they do not override their
+        ``extend()``, ``bifurcate()`` and ``terminate()`` methods.
+
+    Args:
+        growers (list[neurots.generate.grower.NeuronGrower]): The growers of the neurons (each
+            grower can only be used once).
+    """
+
+    def __init__(self, growers):
+        """Constructor of the LockstepGrower class."""
+        self.growers = list(growers)
+        self._statistics = [
+            grower.statistics if grower.statistics.enabled else None for grower in self.growers
+        ]
+        self._instrumented = any(statistics is not None for statistics in self._statistics)
+        self._size = 0
+        self._free_slots = []
+        self._sections = []
+        self._trees = []
+        self._tree_neurons = []
+        self._local_counters = [0] * len(self.growers)
+        self._finished = [[] for _ in self.growers]
+        self._n_uids = 0
+        self._n_rows = 0
+        self._allocate(64, 1024)
+
+    def _allocate(self, n_slots, n_rows):
+        """Allocate the arrays of the section states and of the points."""
+        self._neuron = np.zeros(n_slots, dtype=np.int64)
+        self._tree = np.zeros(n_slots, dtype=np.int64)
+        self._order = np.zeros(n_slots, dtype=np.int64)
+        self._uid = np.zeros(n_slots, dtype=np.int64)
+        self._kind = np.zeros(n_slots, dtype=np.int8)
+        self._active = np.zeros(n_slots, dtype=bool)
+        self._last_point = np.zeros((n_slots, 3))
+        self._direction = np.zeros((n_slots, 3))
+        self._history = np.zeros((n_slots, MEMORY, 3))
+        self._n_directions = np.zeros(n_slots, dtype=np.int64)
+        self._n_points = np.zeros(n_slots, dtype=np.int64)
+        self._pathlength = np.zeros(n_slots)
+        self._num_seg = np.zeros(n_slots, dtype=np.int64)
+        self._bif = np.zeros(n_slots)
+        self._term = np.zeros(n_slots)
+        self._ref = np.zeros((n_slots, 3))
+        self._params = np.zeros((n_slots, 4))  # targeting, randomness, history, scale_prob
+        self._children = np.zeros(n_slots)
+        self._points = np.zeros((n_rows, 3))
+        self._owner = np.zeros(n_rows, dtype=np.int64)
+
+    def _grow_slots(self):
+        """Double the number of slots available for the sections."""
+        for name in [
+            "_neuron",
+            "_tree",
+            "_order",
+            "_uid",
+            "_kind",
+            "_active",
+            "_last_point",
+            "_direction",
+            "_history",
+            "_n_directions",
+            "_n_points",
+            "_pathlength",
+            "_num_seg",
+            "_bif",
+            "_term",
+            "_ref",
+            "_params",
+            "_children",
+        ]:
+            array = getattr(self, name)
+            new_array = np.zeros((2 * len(array),) + array.shape[1:], dtype=array.dtype)
+            new_array[: len(array)] = array
+            setattr(self, name, new_array)
+
+    def _add_points(self, points, owners):
+        """Store new points and the unique IDs of the sections they belong to."""
+        n_new = len(points)
+        if self._n_rows + n_new > len(self._points):
+            capacity = max(2 * len(self._points), self._n_rows + n_new)
+            self._points = np.resize(self._points, (capacity, 3))
+            self._owner = np.resize(self._owner, capacity)
+        self._points[self._n_rows : self._n_rows + n_new] = points
+        self._owner[self._n_rows : self._n_rows + n_new] = owners
+        self._n_rows += n_new
+
+    def _register(self, section, neuron_id, tree_id):
+        """Copy the state of a section grower into a free slot."""
+        kind = _SECTION_KINDS.get(type(section))
+        if kind is None:
+            raise NeuroTSError(
+                f"The section grower {type(section).__name__} is not supported by the lockstep "
+                "engine."
+            )
+        algo_type = type(self._trees[tree_id].growth_algo)
+        for name, methods in _GROWTH_ALGO_METHODS.items():
+            if getattr(algo_type, name) not in methods:
+                raise NeuroTSError(
+                    f"The growth algorithm {algo_type.__name__} is not supported by the lockstep "
+                    f"engine because it overrides the {name}() method."
+                )
+        if section.params.analytic_stop:
+            raise NeuroTSError(
+                "The analytic sampling of the stops is not supported by the lockstep engine."
+            )
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = self._size
+            self._size += 1
+            if slot >= len(self._active):
+                self._grow_slots()
+            self._sections.append(None)
+
+        self._sections[slot] = section
+        self._neuron[slot] = neuron_id
+        self._tree[slot] = tree_id
+        self._order[slot] = self._local_counters[neuron_id]
+        self._local_counters[neuron_id] += 1
+        self._uid[slot] = self._n_uids
+        self._n_uids += 1
+        self._kind[slot] = kind
+        self._active[slot] = True
+
+        self._last_point[slot] = section.last_point
+        self._direction[slot] = section.direction
+        n_directions = len(section.latest_directions)
+        self._history[slot] = 0
+        if n_directions > 0:
+            self._history[slot, MEMORY - n_directions :] = list(section.latest_directions)
+        self._n_directions[slot] = n_directions
+        self._n_points[slot] = len(section.points)
+        self._pathlength[slot] = section.pathlength
+        self._params[slot] = (
+            section.params.targeting,
+            section.params.randomness,
+            section.params.history,
+            section.params.scale_prob,
+        )
+        self._children[slot] = section.children
+        if kind == _NUM_SEG:
+            self._num_seg[slot] = section.stop_criteria["num_seg"]
+            self._bif[slot] = 0
+        else:
+            self._refresh_criteria(slot)
+
+        self._add_points(section.points.data, self._uid[slot])
+
+    def _refresh_criteria(self, slot):
+        """Copy the TMD stop criterion of a section grower into its slot."""
+        section = self._sections[slot]
+        tree = self._trees[self._tree[slot]]
+        criteria = section.stop_criteria["TMD"]
+        self._bif[slot] = criteria.bif
+        if section.process == "major" and "major_termination_length" in tree.params:
+            self._term[slot] = tree.params["major_termination_length"]
+        else:
+            self._term[slot] = criteria.term
+        self._ref[slot] = criteria.ref
+
+    def _update_criteria(self, slot):
+        """Update the stop criterion of a section after the barcode of its tree changed.
+
+        Returns:
+            bool: True if the bifurcation or the termination of the section changed.
+        """
+        section = self._sections[slot]
+        tree = self._trees[self._tree[slot]]
+        barcode = tree.growth_algo.barcode
+        criteria = section.stop_criteria["TMD"]
+        if (criteria.bif_id in barcode.bifs or np.isinf(criteria.bif)) and (
+            criteria.term_id in barcode.terms
+        ):
+            # The bars of the criterion were not used by another section
+            return False
+        previous = (criteria.bif_id, criteria.term_id)
+
+        # Same early termination of the major branches as in TreeGrower.next_point()
+        if section.process == "major" and "major_termination_length" in tree.params:
+            _term = criteria.term
+            criteria.term = tree.params["major_termination_length"]
+        else:
+            _term = None
+
+        tree.growth_algo.update_stop_criteria(section)
+
+        criteria = section.stop_criteria["TMD"]
+        if _term is not None:
+            criteria.term = _term
+
+        self._refresh_criteria(slot)
+        return (criteria.bif_id, criteria.term_id) != previous
+
+    def _update_trees_criteria(self, tree_ids):
+        """Update the stop criteria of all the active sections of the given trees."""
+        if not tree_ids:
+            return
+        slots = np.flatnonzero(
+            self._active[: self._size]
+            & np.isin(self._tree[: self._size], list(tree_ids))
+            & (self._kind[: self._size] != _NUM_SEG)
+        )
+        for slot in slots:
+            self._update_criteria(slot)
+
+    def _draw_random_numbers(self, slots, n_uniforms=2):
+        """Draw the random numbers of one step using the random generator of each neuron.
+
+        The given slots must be sorted by neuron.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The random unit vectors, the
+            segment lengths and ``n_uniforms`` uniform numbers used to check the stop criteria.
+        """
+        n_slots = len(slots)
+        phi = np.empty(n_slots)
+        cos_theta = np.empty(n_slots)
+        seg_lengths = np.empty(n_slots)
+        uniforms = np.empty((n_uniforms, n_slots))
+
+        neurons = self._neuron[slots]
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(neurons)) + 1, [n_slots]])
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            # pylint: disable=protected-access
+            rng = self.growers[neurons[start]]._rng
+            n_draws = end - start
+            phi[start:end] = rng.uniform(0.0, 2.0 * np.pi, size=n_draws)
+            cos_theta[start:end] = rng.uniform(-1.0, 1.0, size=n_draws)
+            trees = self._tree[slots[start:end]]
+            for tree_id in np.unique(trees):
+                mask = trees == tree_id
+                seg_lengths[start:end][mask] = self._trees[tree_id].seg_length_distr.draw_positive(
+                    np.count_nonzero(mask)
+                )
+            uniforms[:, start:end] = rng.random(size=(n_uniforms, n_draws))
+
+        theta = np.arccos(cos_theta)
+        sn_theta = np.sin(theta)
+        random_points = np.column_stack(
+            [np.cos(phi) * sn_theta, np.sin(phi) * sn_theta, np.cos(theta)]
+        )
+        return random_points, seg_lengths, uniforms
+
+    def _check(self, crit, values, scale_prob, uniforms):
+        """Vectorized version of SectionGrowerExponentialProba._check()."""
+        x = crit - values
+        with np.errstate(invalid="ignore"):
+            proba = np.exp(-np.maximum(x, 0) * scale_prob)
+        return (x < 0) | (uniforms < proba)
+
+    def _advance(self, slots, n_uniforms=2):
+        """Add one point to the given sections, which must be sorted by neuron.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: The new points and ``n_uniforms`` uniform numbers
+            per section used to check the stop criteria.
+        """
+        random_points, seg_lengths, uniforms = self._draw_random_numbers(slots, n_uniforms)
+
+        history = np.einsum("k,nkj->nj", WEIGHTS, self._history[slots])
+        distances = np.linalg.norm(history, axis=1)
+        large = distances > DISTANCE_MIN
+        history[large] /= distances[large, np.newaxis]
+
+        params = self._params[slots]
+        directions = (
+            params[:, [0]] * self._direction[slots]
+            + params[:, [1]] * random_points
+            + params[:, [2]] * history
+        )
+        directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        points = self._last_point[slots] + seg_lengths[:, np.newaxis] * directions
+
+        self._last_point[slots] = points
+        self._pathlength[slots] += seg_lengths
+        self._history[slots, :-1] = self._history[slots, 1:]
+        self._history[slots, -1] = directions
+        self._n_directions[slots] = np.minimum(self._n_directions[slots] + 1, MEMORY)
+        self._n_points[slots] += 1
+        self._add_points(points, self._uid[slots])
+        return points, uniforms
+
+    def _step(self):
+        """Add one point to all the active sections.
+
+        Returns:
+            numpy.ndarray: The slots of the sections that must bifurcate or terminate.
+        """
+        slots = np.flatnonzero(self._active[: self._size])
+        slots = slots[np.lexsort((self._order[slots], self._neuron[slots]))]
+        points, uniforms = self._advance(slots)
+
+        # Check the stop criteria
+        params = self._params[slots]
+        kinds = self._kind[slots]
+        stop = np.zeros(len(slots), dtype=bool)
+
+        num_seg = kinds == _NUM_SEG
+        stop[num_seg] = self._n_points[slots[num_seg]] >= self._num_seg[slots[num_seg]]
+
+        proba = ~num_seg
+        proba_slots = slots[proba]
+        values = np.where(
+            kinds[proba] == _PATH,
+            self._pathlength[proba_slots],
+            np.linalg.norm(points[proba] - self._ref[proba_slots], axis=1),
+        )
+        scale_prob = params[proba, 3]
+        bifurcate = self._check(self._bif[proba_slots], values, scale_prob, uniforms[0, proba])
+        terminate = ~bifurcate & self._check(
+            self._term[proba_slots], values, scale_prob, uniforms[1, proba]
+        )
+        self._children[proba_slots[bifurcate]] = 2.0
+        self._children[proba_slots[terminate]] = 0.0
+        stop[proba] = bifurcate | terminate
+
+        return slots[stop]
+
+    def _instrumented_step(self, modified_trees):
+        """Run one step and record its time and its number of steps in each instrumented neuron.
+
+        The stop criteria are updated and one point is added to all the active sections.
+
+        Returns:
+            numpy.ndarray: The slots of the sections that must bifurcate or terminate.
+        """
+        n_steps = np.bincount(
+            self._neuron[: self._size][self._active[: self._size]], minlength=len(self.growers)
+        )
+        start = perf_counter()
+        self._update_trees_criteria(modified_trees)
+        stops = self._step()
+        duration = (perf_counter() - start) / n_steps.sum()
+        for statistics, n_neuron_steps in zip(self._statistics, n_steps):
+            if statistics is not None and n_neuron_steps > 0:
+                statistics.add_time("section_stepping", duration * n_neuron_steps)
+                statistics.count("steps", n_neuron_steps)
+        return stops
+
+    def _step_other_sections(self, slot):
+        """Add one point to the other active sections of the tree of a bifurcating section.
+
+        As in :meth:`neurots.generate.tree.TreeGrower.next_point`, the points are added in the order
+        in which the sections were created and their stop criteria are not checked.
+        """
+        others = np.flatnonzero(
+            self._active[: self._size] & (self._tree[: self._size] == self._tree[slot])
+        )
+        others = others[others != slot]
+        if len(others) > 0:
+            self._advance(others[np.argsort(self._order[others])], n_uniforms=0)
+
+    def _sync_section(self, slot):
+        """Copy the state of a slot back to its section grower.
+
+        Only the last point is appended to the points of the section grower, the other points are
+        stored by the engine.
+        """
+        section = self._sections[slot]
+        section.points.append(self._last_point[slot].copy())
+        section.pathlength = self._pathlength[slot]
+        n_directions = self._n_directions[slot]
+        section.latest_directions = self._history[slot, MEMORY - n_directions :]
+        section.children = self._children[slot]
+
+    def _finish_section(self, slot):
+        """Record a finished section and return its ID in its neuron.
+
+        The sections are appended to the morphology builders in the same order at the end of the
+        growth, so this ID is the one given by the builder.
+        """
+        section = self._sections[slot]
+        tree = self._trees[self._tree[slot]]
+        finished = self._finished[self._neuron[slot]]
+        finished.append((self._uid[slot], section.parent, int(SectionType(tree.type))))
+        return len(finished) - 1
+
+    def _finish_tree(self, tree_id):
+        """Remove a tree from the active trees of its neuron."""
+        tree = self._trees[tree_id]
+        grower = self.growers[self._tree_neurons[tree_id]]
+        if (
+            "apical_dendrite" in grower.input_parameters["grow_types"]
+            and tree.type == grower.input_parameters["apical_dendrite"]["tree_type"]
+        ):
+            grower.apical_sections.append(tree.growth_algo.apical_section)
+        barcode = getattr(tree.growth_algo, "barcode", None)
+        if barcode is not None:
+            grower.statistics.count("barcode_lookups", barcode.n_lookups)
+        grower.active_neurites.remove(tree)
+
+    def _stop_section(self, slot):
+        """Terminate a section or create its children, and remove it from the active sections."""
+        section = self._sections[slot]
+        tree_id = self._tree[slot]
+        tree = self._trees[tree_id]
+        if section.children == 0:
+            tree.growth_algo.terminate(section)
+        else:
+            latest = section.latest_directions[-1]
+            for child_section in tree.growth_algo.bifurcate(section):
+                child = tree.add_section(
+                    parent=section.id, pathlength=section.pathlength, **child_section
+                )
+                child.latest_directions.append(latest)
+                child.first_point()
+                self._register(child, self._neuron[slot], tree_id)
+        tree.active_sections.remove(section)
+
+    def _process_stops(self, slots):
+        """Bifurcate or terminate the given sections.
+
+        The sections are processed in the same order as in
+        :meth:`neurots.generate.tree.TreeGrower.next_point`. When a section stops after the barcode
+        of its tree was modified during the same step, its stop criterion is updated first and if it
+        changed the section continues to grow.
+
+        Returns:
+            set[int]: The IDs of the trees whose barcode was modified.
+        """
+        slots = slots[
+            np.lexsort(
+                (self._order[slots], self._bif[slots], self._tree[slots], self._neuron[slots])
+            )
+        ]
+        modified_trees = set()
+        for slot in slots:
+            tree_id = self._tree[slot]
+            tree = self._trees[tree_id]
+            if tree_id in modified_trees and self._update_criteria(slot):
+                continue
+
+            self._sync_section(slot)
+            section = self._sections[slot]
+            section.id = self._finish_section(slot)
+
+            statistics = self._statistics[self._neuron[slot]]
+            if statistics is None:
+                if section.children != 0:
+                    self._step_other_sections(slot)
+                self._stop_section(slot)
+            elif section.children == 0:
+                with statistics.timer("termination"):
+                    self._stop_section(slot)
+                statistics.count("terminations")
+            else:
+                with statistics.timer("section_stepping"):
+                    self._step_other_sections(slot)
+                with statistics.timer("bifurcation"):
+                    self._stop_section(slot)
+                statistics.count("bifurcations")
+
+            self._sections[slot] = None
+            self._active[slot] = False
+            self._free_slots.append(slot)
+
+            if isinstance(tree.growth_algo, TMDAlgo):
+                modified_trees.add(tree_id)
+            if tree.end():
+                self._finish_tree(tree_id)
+
+        return modified_trees
+
+    def _build_neurites(self):
+        """Append the finished sections to the morphology builders of the growers."""
+        rows = np.argsort(self._owner[: self._n_rows], kind="stable")
+        bounds = np.searchsorted(self._owner[rows], np.arange(self._n_uids + 1))
+
+        for grower, finished in zip(self.growers, self._finished):
+            with grower.statistics.timer("build_morphology"):
+                for uid, parent, section_type in finished:
+                    # pylint: disable=protected-access
+                    grower._morphology_builder.append_section(
+                        self._points[rows[bounds[uid] : bounds[uid + 1]]],
+                        section_type,
+                        parent=parent,
+                    )
+
+    def grow(self):
+        """Grow all the neurons.
+
+        Returns:
+            list[morphio.mut.Morphology]: The grown neurons.
+        """
+        for neuron_id, grower in enumerate(self.growers):
+            # pylint: disable=protected-access
+            grower._grow_soma()
+            for tree in list(grower.active_neurites):
+                tree_id = len(self._trees)
+                self._trees.append(tree)
+                self._tree_neurons.append(neuron_id)
+                for section in tree.active_sections:
+                    self._register(section, neuron_id, tree_id)
+                if tree.end():
+                    self._finish_tree(tree_id)
+
+        modified_trees = set()
+        while self._active[: self._size].any():
+            if self._instrumented:
+                stops = self._instrumented_step(modified_trees)
+            else:
+                self._update_trees_criteria(modified_trees)
+                stops = self._step()
+            modified_trees = self._process_stops(stops)
+
+        self._build_neurites()
+        for grower in self.growers:
+            grower._finish_growth()  # pylint: disable=protected-access
+
+        return [grower.neuron for grower in self.growers]
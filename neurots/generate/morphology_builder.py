@@ -0,0 +1,155 @@
+"""NeuroTS class: Morphology builder."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+from morphio import PointLevel
+from morphio import SectionType
+from morphio.mut import Morphology
+
+from neurots.generate.tree import DEFAULT_DIAMETER
+
+
+def _grow_array(array, min_size):
+    """Return a copy of the array whose first dimension is at least twice as large."""
+    new_array = np.empty((max(2 * len(array), min_size),) + array.shape[1:], dtype=array.dtype)
+    new_array[: len(array)] = array
+    return new_array
+
+
+class MorphologyBuilder:
+    """Store the sections of a morphology in flat arrays while it is grown.
+
+    The points of all the sections are stored in one array and each section is described by the
+    offset of its first point, the ID of its parent (``-1`` for root sections) and its type. The
+    sections get their IDs in the order they are appended, and the MorphIO morphology is only built
+    at the end of the growth. The IDs given to the sections in this morphology are then recorded in
+    :attr:`final_section_ids`.
+
+    Args:
+        initial_capacity (int): The initial number of points that can be stored.
+    """
+
+    def __init__(self, initial_capacity=1000):
+        self._points = np.empty((initial_capacity, 3))
+        self._n_points = 0
+        self._offsets = np.zeros(initial_capacity // 10 + 1, dtype=np.int64)
+        self._parents = np.zeros(len(self._offsets), dtype=np.int64)
+        self._types = np.zeros(len(self._offsets), dtype=np.int32)
+        self._n_sections = 0
+        self._final_ids = None
+
+    def __len__(self):
+        """Return the number of sections."""
+        return self._n_sections
+
+    @property
+    def points(self):
+        """Return the points of all the sections."""
+        return self._points[: self._n_points]
+
+    @property
+    def parents(self):
+        """Return the parent ID of each section."""
+        return self._parents[: self._n_sections]
+
+    @property
+    def types(self):
+        """Return the type of each section."""
+        return self._types[: self._n_sections]
+
+    @property
+    def final_section_ids(self):
+        """Return the ID of each section in the morphology built by :meth:`to_morphology`.
+
+        The array is indexed by the IDs returned by :meth:`append_section` and is ``None`` if the
+        morphology has not been built yet.
+        """
+        return self._final_ids
+
+    def section_points(self, section_id):
+        """Return the points of a section."""
+        end = self._offsets[section_id + 1] if section_id + 1 < self._n_sections else self._n_points
+        return self._points[self._offsets[section_id] : end]
+
+    def append_section(self, points, section_type, parent=None):
+        """Append a section.
+
+        Args:
+            points (numpy.ndarray): The points of the section.
+            section_type (int): The type of the section.
+            parent (int): The ID of the parent section (``None`` for a root section).
+
+        Returns:
+            int: The ID of the new section.
+        """
+        points = np.asarray(points)
+        n_points = len(points)
+        if self._n_points + n_points > len(self._points):
+            self._points = _grow_array(self._points, self._n_points + n_points)
+        if self._n_sections == len(self._offsets):
+            self._offsets = _grow_array(self._offsets, 1)
+            self._parents = _grow_array(self._parents, 1)
+            self._types = _grow_array(self._types, 1)
+
+        section_id = self._n_sections
+        self._points[self._n_points : self._n_points + n_points] = points[:, :3]
+        self._offsets[section_id] = self._n_points
+        self._parents[section_id] = -1 if parent is None else parent
+        self._types[section_id] = section_type
+        self._n_points += n_points
+        self._n_sections += 1
+        return section_id
+
+    def to_morphology(self, morphology=None):
+        """Add the sections to a MorphIO morphology.
+
+        The sections are appended in depth-first order, so their IDs are the same as the ones
+        given by the MorphIO loaders.
+
+        Args:
+            morphology (morphio.mut.Morphology): The morphology to which the sections are added (a
+                new one is created if ``None`` is given).
+
+        Returns:
+            morphio.mut.Morphology: The morphology.
+        """
+        if morphology is None:
+            morphology = Morphology()
+
+        # Children of each section (the roots are the children of the section -1), in the order
+        # they were appended
+        parents = self.parents
+        order = np.argsort(parents, kind="stable")
+        starts = np.searchsorted(parents[order], np.arange(-1, self._n_sections + 1))
+
+        sections = [None] * self._n_sections
+        stack = order[starts[0] : starts[1]][::-1].tolist()
+        while stack:
+            section_id = stack.pop()
+            points = self.section_points(section_id)
+            parent = parents[section_id]
+            append_fun = (
+                morphology.append_root_section if parent < 0 else sections[parent].append_section
+            )
+            sections[section_id] = append_fun(
+                PointLevel(points.tolist(), [DEFAULT_DIAMETER] * len(points)),
+                SectionType(self._types[section_id]),
+            )
+            stack.extend(order[starts[section_id + 1] : starts[section_id + 2]][::-1].tolist())
+
+        self._final_ids = np.array([section.id for section in sections], dtype=np.int64)
+        return morphology
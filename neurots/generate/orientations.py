@@ -15,7 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import inspect
+import json
+import logging
+import os
+import tempfile
 import warnings
 from copy import deepcopy
 
@@ -30,6 +35,8 @@ from neurots.morphmath.utils import normalize_vectors
 from neurots.utils import PIA_DIRECTION
 from neurots.utils import NeuroTSError
 
+L = logging.getLogger(__name__)
+
 _TWOPI = 2.0 * np.pi
 FIT_3D_ANGLES_BOUNDS = {
     "double_step": ([0, 0.1, -np.pi, 0.1], [np.pi, 10, 0, 10]),
@@ -45,6 +52,10 @@ _3D_ANGLES_MAPPING = {
 }
 _3D_ANGLES_MODES = {"apical_constraint", "pia_constraint", "normal_pia_constraint"}
 
+# The environment variable giving the directory in which the fits of the 3d angles are cached
+FIT_3D_ANGLES_CACHE_DIR_VAR = "NEUROTS_FIT_3D_ANGLES_CACHE_DIR"
+_FIT_3D_ANGLES_CACHE = {}
+
 
 class OrientationManagerBase:
     """Base class that automatically registers orientation modes.
@@ -55,6 +66,7 @@ class OrientationManagerBase:
         distributions (dict): The distributions used to compute the orientations.
         context (any): An object containing contextual information.
         rng (numpy.random.Generator): The random number generator to use.
+        distr_cache (neurots.morphmath.sample.DistrCache): The cache of the built distributions.
 
     .. note::
         To register an orientation mode, derive from this base class and
@@ -63,30 +75,38 @@ class OrientationManagerBase:
         .. code-block:: python
 
             def _mode_{name}(self, values_dict, tree_type)
+
+        A mode can also compute the orientations of several cells at once in
+        :meth:`compute_population_orientations` with a method with the following signature, which
+        returns the orientations of each cell:
+
+        .. code-block:: python
+
+            def _population_mode_{name}(self, values_dict, tree_type, population)
     """
 
-    def __init__(self, soma, parameters, distributions, context, rng):
+    def __init__(self, soma, parameters, distributions, context, rng, distr_cache=None):
         self._soma = soma
         self._parameters = parameters
         self._distributions = distributions
         self._context = context
         self._rng = rng
+        self._distr_cache = distr_cache
+        self._soma_factory = None
+        self._pia_directions = None
 
         self._orientations = {}
         self._modes = self._collect_mode_methods()
+        self._population_modes = self._collect_mode_methods(prefix="_population_mode_")
 
-    def _collect_mode_methods(self):
-        """Collects and stores in self._modes the methods, the name of which starts with '_mode_'.
+    def _collect_mode_methods(self, prefix="_mode_"):
+        """Collects the methods, the name of which starts with the given prefix.
 
         Returns:
-            dict: A dictionary mapping mode names without the '_modes_' prefix to the methods.
+            dict: A dictionary mapping mode names without the prefix to the methods.
         """
         methods = inspect.getmembers(self, predicate=inspect.ismethod)
-        return {
-            name.replace("_mode_", ""): method
-            for name, method in methods
-            if name.startswith("_mode_")
-        }
+        return {name[len(prefix) :]: method for name, method in methods if name.startswith(prefix)}
 
     @property
     def mode_names(self):
@@ -129,6 +149,99 @@ class OrientationManagerBase:
 
         return self._modes[mode_name], params["values"]
 
+    def compute_population_orientations(
+        self, n_cells, rng=None, soma_factory=None, pia_directions=None
+    ):
+        """Computes the soma radii and the trunk orientations of several cells at once.
+
+        The orientations of the tree types are computed in the order of the ``grow_types``
+        parameter. The modes that have a ``_population_mode_{name}`` method compute the
+        orientations of all the cells in one call (see
+        :class:`neurots.generate.population_orientations.PopulationOrientationManager`), the others
+        are computed cell by cell. The random numbers are drawn for all the cells at once, so the
+        results are not the same as the ones of :meth:`compute_tree_type_orientations` called for
+        each cell.
+
+        Args:
+            n_cells (int): The number of cells.
+            rng (numpy.random.Generator): The random number generator to use (the one of the
+                manager by default).
+            soma_factory (callable): Builds the soma of a cell from its center, radius and points
+                (the class of the soma of the manager by default).
+            pia_directions (numpy.ndarray): The pia direction of each cell, as an array of shape
+                ``(n_cells, 3)``, used by the modes constrained by the pia direction instead of the
+                ``pia_direction`` parameter.
+
+        Returns:
+            tuple[numpy.ndarray, list[dict]]: The soma radius of each cell and, for each cell, a
+            dictionary with the orientations of each tree type.
+        """
+        if pia_directions is not None:
+            pia_directions = np.asarray(pia_directions, dtype=np.float64)
+            if pia_directions.shape != (n_cells, 3):
+                raise NeuroTSError(
+                    f"The pia directions must be an array of shape ({n_cells}, 3) "
+                    f"(got {pia_directions.shape})"
+                )
+        default_rng = self._rng
+        if rng is not None:
+            self._rng = rng
+        if soma_factory is None and self._soma is not None:
+            soma_factory = type(self._soma)
+        self._soma_factory = soma_factory
+        self._pia_directions = pia_directions
+        try:
+            radii = sample.soma_size(
+                self._distributions, self._rng, size=n_cells, distr_cache=self._distr_cache
+            )
+            population = [{} for _ in range(n_cells)]
+
+            for tree_type in self._parameters["grow_types"]:
+                mode_method, values_dict = self._tree_type_method_values(tree_type)
+                population_method = self._population_modes.get(
+                    self._parameters[tree_type]["orientation"]["mode"]
+                )
+                if population_method is not None:
+                    cell_orientations = population_method(values_dict, tree_type, population)
+                else:
+                    cell_orientations = self._compute_cells_orientations(
+                        mode_method, values_dict, tree_type, radii, population
+                    )
+                for orientations, oris in zip(population, cell_orientations):
+                    orientations[tree_type] = oris
+        finally:
+            self._rng, self._soma_factory, self._pia_directions = default_rng, None, None
+
+        return radii, population
+
+    def _compute_cells_orientations(self, mode_method, values_dict, tree_type, radii, population):
+        """Computes the orientations of a tree type cell by cell."""
+        if self._soma_factory is None:
+            raise NeuroTSError("A soma factory is needed to compute the orientations cell by cell")
+        soma, orientations = self._soma, self._orientations
+        cell_orientations = []
+        try:
+            for radius, orientations_of_cell in zip(radii, population):
+                self._orientations = orientations_of_cell
+                self._soma = self._soma_factory(
+                    np.zeros(3),
+                    radius,
+                    [radius * ori for oris in orientations_of_cell.values() for ori in oris],
+                )
+                cell_orientations.append(mode_method(values_dict, tree_type))
+        finally:
+            self._soma, self._orientations = soma, orientations
+        return cell_orientations
+
+    def _n_trees(self, tree_type, size=None):
+        """Returns the sampled number of trees of the given type (for ``size`` cells if given)."""
+        num_trees = self._distributions[tree_type]["num_trees"]
+        return sample.n_neurites(num_trees, self._rng, size=size, distr_cache=self._distr_cache)
+
+    def _sample_angles(self, sampler, tree_type_distrs, n_angles):
+        """Returns the angles drawn with the given :mod:`neurots.morphmath.sample` helper."""
+        return sampler(tree_type_distrs, n_angles, self._rng, distr_cache=self._distr_cache)
+
 
 class OrientationManager(OrientationManagerBase):
     """Class to generate the tree orientations starting from the soma of the cell.
@@ -139,6 +252,7 @@ class OrientationManager(OrientationManagerBase):
         distributions (dict): The distributions used to compute the orientations.
         context (any): An object containing contextual information.
         rng (numpy.random.Generator): The random number generator to use.
+        distr_cache (neurots.morphmath.sample.DistrCache): The cache of the built distributions.
 
     .. note::
         All orientation mode dicts:
@@ -163,23 +277,22 @@ class OrientationManager(OrientationManagerBase):
     def _mode_use_predefined(self, values_dict, tree_type):
         """Returns predefined orientations."""
         assert "orientations" in values_dict, "'orientations' key is missing"
-        tree_type_distrs = self._distributions[tree_type]
 
         # the reason of this sampling is to maintain the pseudorandom
         # sequence of the legacy implementation. Otherwise the functional tests
         # will break because the sequence will be slightly different.
-        sample.n_neurites(tree_type_distrs["num_trees"], self._rng)
+        self._n_trees(tree_type)
         return normalize_vectors(np.asarray(values_dict["orientations"], dtype=np.float64))
 
     def _mode_sample_around_primary_orientation(self, values_dict, tree_type):
         """Sample orientations around a primary direction."""
         tree_type_distrs = self._distributions[tree_type]
-        n_orientations = sample.n_neurites(tree_type_distrs["num_trees"], self._rng)
+        n_orientations = self._n_trees(tree_type)
 
-        trunk_absolute_angles = sample.trunk_absolute_angles(
-            tree_type_distrs, n_orientations, self._rng
+        trunk_absolute_angles = self._sample_angles(
+            sample.trunk_absolute_angles, tree_type_distrs, n_orientations
         )
-        z_angles = sample.azimuth_angles(tree_type_distrs, n_orientations, self._rng)
+        z_angles = self._sample_angles(sample.azimuth_angles, tree_type_distrs, n_orientations)
 
         primary_orientation = np.asarray(values_dict["primary_orientation"], dtype=np.float64)
         primary_orientation /= np.linalg.norm(primary_orientation)
@@ -196,7 +309,7 @@ class OrientationManager(OrientationManagerBase):
         """Returns sampled orientations."""
         tree_type_distrs = self._distributions[tree_type]
 
-        n_orientations = sample.n_neurites(tree_type_distrs["num_trees"], self._rng)
+        n_orientations = self._n_trees(tree_type)
 
         phi_intervals, interval_n_trees = compute_interval_n_tree(
             self._soma,
@@ -208,8 +321,8 @@ class OrientationManager(OrientationManagerBase):
         orientations_i = []
         for phi_interval, i_n_trees in zip(phi_intervals, interval_n_trees):
             phis, thetas = trunk_to_spherical_angles(
-                sample.trunk_angles(tree_type_distrs, i_n_trees, self._rng),
-                sample.azimuth_angles(tree_type_distrs, i_n_trees, self._rng),
+                self._sample_angles(sample.trunk_angles, tree_type_distrs, i_n_trees),
+                self._sample_angles(sample.azimuth_angles, tree_type_distrs, i_n_trees),
                 phi_interval,
             )
             orientations_i.append(spherical_angles_to_orientations(phis, thetas))
@@ -217,10 +330,9 @@ class OrientationManager(OrientationManagerBase):
 
     def _mode_uniform(self, _, tree_type):
         """Uniformly sample angles on the sphere."""
-        n_orientations = sample.n_neurites(self._distributions[tree_type]["num_trees"], self._rng)
-        return np.asarray(
-            [sample.sample_spherical_unit_vectors(rng=self._rng) for _ in range(n_orientations)]
-        )
+        n_orientations = self._n_trees(tree_type)
+        # Same numbers as n_orientations calls to sample.sample_spherical_unit_vectors()
+        return normalize_vectors(self._rng.normal(0, 1, (n_orientations, 3)))
 
     def _mode_normal_pia_constraint(self, values_dict, tree_type):
         """Returns orientations using normal/exp distribution along a direction.
@@ -234,7 +346,7 @@ class OrientationManager(OrientationManagerBase):
 
         Pia direction can be overwritten by the parameter 'pia_direction' value.
         """
-        n_orientations = sample.n_neurites(self._distributions[tree_type]["num_trees"], self._rng)
+        n_orientations = self._n_trees(tree_type)
         if (
             isinstance(values_dict["direction"]["mean"], list)
             and len(values_dict["direction"]["mean"]) == n_orientations
@@ -264,13 +376,19 @@ class OrientationManager(OrientationManagerBase):
             ).tolist()
         return np.array(angles)
 
-    def _mode_pia_constraint(self, _, tree_type):
+    def _mode_pia_constraint(self, values_dict, tree_type):
         """Create trunks from distribution of angles with pia (`[0 , 1, 0]`) direction.
 
-        See :func:`_sample_trunk_from_3d_angle` for more details on the algorithm.
+        See :func:`_sample_trunk_from_3d_angle` for more details on the algorithm. If the
+        `sampling` value is `batch`, all the trunks are sampled at once with
+        :func:`_sample_trunks_from_3d_angle`.
         """
-        n_orientations = sample.n_neurites(self._distributions[tree_type]["num_trees"], self._rng)
+        n_orientations = self._n_trees(tree_type)
         pia_direction = self._parameters.get("pia_direction", PIA_DIRECTION)
+        if values_dict.get("sampling") == "batch":
+            return _sample_trunks_from_3d_angle(
+                self._parameters, self._rng, tree_type, pia_direction, n_orientations
+            )
         return np.asarray(
             [
                 _sample_trunk_from_3d_angle(self._parameters, self._rng, tree_type, pia_direction)
@@ -278,13 +396,19 @@ class OrientationManager(OrientationManagerBase):
             ]
         )
 
-    def _mode_apical_constraint(self, _, tree_type):
+    def _mode_apical_constraint(self, values_dict, tree_type):
         """Create trunks from distribution of angles with apical direction.
 
-        See :func:`_sample_trunk_from_3d_angle` for more details on the algorithm.
+        See :func:`_sample_trunk_from_3d_angle` for more details on the algorithm. If the
+        `sampling` value is `batch`, all the trunks are sampled at once with
+        :func:`_sample_trunks_from_3d_angle`.
         """
-        n_orientations = sample.n_neurites(self._distributions[tree_type]["num_trees"], self._rng)
+        n_orientations = self._n_trees(tree_type)
         ref_dir = self._orientations["apical_dendrite"][0]
+        if values_dict.get("sampling") == "batch":
+            return _sample_trunks_from_3d_angle(
+                self._parameters, self._rng, tree_type, ref_dir, n_orientations
+            )
         return np.asarray(
             [
                 _sample_trunk_from_3d_angle(self._parameters, self._rng, tree_type, ref_dir)
@@ -425,17 +549,15 @@ def compute_interval_n_tree(soma, n_trees, rng=np.random):
     """
     if soma and len(soma.points) > 0:
         # Get angles of existing trunk origins
-        phis = []
-        for pt in soma.points:
-            pt_orientation = soma.orientation_from_point(pt)
-            phi, _ = rotation.spherical_from_vector(pt_orientation)
-            phis.append(phi)
-
-        phis = sorted(phis)
+        points = np.asarray(soma.points, dtype=np.float64)
+        if np.any(np.all(np.isclose(points, soma.center, rtol=0), axis=1)):
+            raise ValueError("Point overlaps with soma center.")
+        pt_orientations = points_to_orientations(soma.center, points)
+        phis = np.sort(np.arctan2(pt_orientations[:, 1], pt_orientations[:, 0]))
 
         # The last interval goes beyond 2 * pi but the function
         # self.soma.add_points_from_trunk_angles can deal with it.
-        phis += [phis[0] + _TWOPI]
+        phis = np.append(phis, phis[0] + _TWOPI)
         phi_intervals = np.column_stack((phis[:-1], phis[1:]))
 
         # Compute the number of trunks to create in each interval: each interval is weighted by
@@ -544,6 +666,10 @@ def get_probability_function(form="step", with_density=True):
 def _fit_single_3d_angles(data, neurite_type, morph_class, fit_params=None):
     """Fit function to distribution of 3d angles for a `neurite_type`.
 
+    The fits are cached in memory, using a hash of the data and of the fit parameters as key. If
+    the environment variable `NEUROTS_FIT_3D_ANGLES_CACHE_DIR` is set, they are also cached in
+    this directory so they can be shared between processes.
+
     Args:
         data (dict): bins and weights data from input_distribution
         neurite_type (str): neurite_type to consider
@@ -557,6 +683,31 @@ def _fit_single_3d_angles(data, neurite_type, morph_class, fit_params=None):
         _fit_params[morph_class][neurite_type].update(fit_params)
 
     form = _fit_params[morph_class][neurite_type]["form"]
+    bounds = _fit_params[morph_class][neurite_type]["bounds"] if form != "flat" else []
+
+    # The fits are cached in memory and on disk (if the cache directory is set) because they
+    # are the same for all the cells grown from the same inputs
+    key = hashlib.sha256(
+        json.dumps(
+            {
+                "bins": np.asarray(data["bins"], dtype=float).tolist(),
+                "weights": np.asarray(data["weights"], dtype=float).tolist(),
+                "form": form,
+                "bounds": np.asarray(bounds, dtype=float).tolist(),
+            },
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+    fit = _FIT_3D_ANGLES_CACHE.get(key) or _load_cached_fit(key)
+    if fit is None:
+        fit = _fit_3d_angles_data(data, form, bounds)
+        _save_cached_fit(key, fit)
+    _FIT_3D_ANGLES_CACHE[key] = fit
+    return deepcopy(fit)
+
+
+def _fit_3d_angles_data(data, form, bounds):
+    """Fit function of the given form to distribution of 3d angles."""
     if form != "flat":
         function = get_probability_function(form, with_density=True)
 
@@ -565,7 +716,7 @@ def _fit_single_3d_angles(data, neurite_type, morph_class, fit_params=None):
                 function,
                 data["bins"],
                 data["weights"],
-                bounds=_fit_params[morph_class][neurite_type]["bounds"],
+                bounds=bounds,
             )[0].tolist()
         except RuntimeError:  # pragma: no cover
             warnings.warn("Cannot fit some trunk angles, we fallback to flat distribution")
@@ -576,6 +727,39 @@ def _fit_single_3d_angles(data, neurite_type, morph_class, fit_params=None):
     return {"form": form, "params": popt}
 
 
+def _load_cached_fit(key):
+    """Load a fit of 3d angles from the cache directory if it exists."""
+    cache_dir = os.environ.get(FIT_3D_ANGLES_CACHE_DIR_VAR)
+    if not cache_dir:
+        return None
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached_fit(key, fit):
+    """Save a fit of 3d angles in the cache directory if it is set."""
+    cache_dir = os.environ.get(FIT_3D_ANGLES_CACHE_DIR_VAR)
+    if not cache_dir:
+        return
+    tmp_name = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write in a temporary file first so other processes never read a partial file
+        with tempfile.NamedTemporaryFile(
+            "w", dir=cache_dir, suffix=".tmp", delete=False, encoding="utf-8"
+        ) as f:
+            tmp_name = f.name
+            json.dump(fit, f)
+        os.replace(tmp_name, os.path.join(cache_dir, f"{key}.json"))
+    except OSError as exc:
+        L.warning("Could not save the fit of the 3d angles in %s: %s", cache_dir, exc)
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
 def _get_fit_params_from_input_parameters(parameters):
     """Get parameter dict for fits from `tmd_parameters`."""
     values = parameters["orientation"].get("values")
@@ -624,22 +808,18 @@ def fit_3d_angles(tmd_parameters, tmd_distributions):
             continue
 
         mode = orientation["mode"]
-        make_fit = False
-        if mode in _3D_ANGLES_MAPPING:
-            if orientation.get("values") is None:
-                make_fit = True
-            else:
-                val = orientation["values"]
-                if "params" not in val and "direction" not in val:
-                    make_fit = True
-
-        if make_fit:
-            tmd_parameters[neurite_type]["orientation"]["values"] = _fit_single_3d_angles(
-                tmd_distributions[neurite_type]["trunk"][_3D_ANGLES_MAPPING[mode]]["data"],
-                neurite_type,
-                morph_class,
-                fit_params=_get_fit_params_from_input_parameters(tmd_parameters[neurite_type]),
-            )
+        values = orientation.get("values") or {}
+        if mode in _3D_ANGLES_MAPPING and "params" not in values and "direction" not in values:
+            # The other values given by the user (like the sampling) are kept with the fit
+            orientation["values"] = {
+                **values,
+                **_fit_single_3d_angles(
+                    tmd_distributions[neurite_type]["trunk"][_3D_ANGLES_MAPPING[mode]]["data"],
+                    neurite_type,
+                    morph_class,
+                    fit_params=_get_fit_params_from_input_parameters(tmd_parameters[neurite_type]),
+                ),
+            }
 
     return tmd_parameters
 
@@ -669,3 +849,39 @@ def _sample_trunk_from_3d_angle(parameters, rng, tree_type, ref_dir, max_tries=1
                     Consider checking the given probability distribution."""
     )
     return sample.sample_spherical_unit_vectors(rng)
+
+
+def _sample_trunks_from_3d_angle(parameters, rng, tree_type, ref_dir, n_trunks, max_tries=100):
+    """Sample several trunk directions at once from fit of distribution of `3d_angles`.
+
+    This is the same accept-reject algorithm as :func:`_sample_trunk_from_3d_angle`, except that
+    the directions are proposed and accepted by blocks, so the results are not the same for a
+    given random number generator. After ``n_trunks * max_tries`` proposals, the missing trunks
+    are replaced by random directions and a warning is issued.
+    """
+    values = parameters[tree_type]["orientation"]["values"]
+    prob = get_probability_function(form=values["form"], with_density=False)
+    params = values["params"]
+    ref_dir = np.asarray(ref_dir, dtype=np.float64)
+    ref_dir = ref_dir / np.linalg.norm(ref_dir)
+
+    accepted = [np.empty((0, 3))]
+    n_accepted = n_proposals = 0
+    max_proposals = n_trunks * max_tries
+    while n_accepted < n_trunks and n_proposals < max_proposals:
+        # Propose a few more directions than missing ones to avoid too many iterations
+        n_new = min(max(4 * (n_trunks - n_accepted), 16), max_proposals - n_proposals)
+        proposals = normalize_vectors(rng.normal(0, 1, (n_new, 3)))
+        angles = np.arccos(np.clip(proposals.dot(ref_dir), -1.0, 1.0))
+        proposals = proposals[rng.random(n_new) < prob(angles, *params)]
+        accepted.append(proposals)
+        n_accepted += len(proposals)
+        n_proposals += n_new
+
+    if n_accepted < n_trunks:
+        warnings.warn(
+            """We could not sample from distribution, so we take random points.
+                    Consider checking the given probability distribution."""
+        )
+        accepted.append(normalize_vectors(rng.normal(0, 1, (n_trunks - n_accepted, 3))))
+    return np.concatenate(accepted)[:n_trunks]
@@ -0,0 +1,622 @@
+"""NeuroTS population: grow many neurons from the same inputs and export them."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from itertools import repeat
+
+import h5py
+import numpy as np
+from morphio import Morphology as ImmutableMorphology
+from morphio import PointLevel
+from morphio import SectionType
+from morphio import SomaType
+from morphio.mut import Morphology
+from numpy.random import SeedSequence
+
+from neurots.generate.grower import CompiledSynthesisInputs
+from neurots.generate.grower import NeuronGrower
+from neurots.generate.population_orientations import PopulationOrientationManager
+from neurots.generate.soma import Soma
+from neurots.utils import NeuroTSError
+
+L = logging.getLogger(__name__)
+
+# Inputs shared by all the cells grown in a worker process, set by _init_worker()
+_WORKER_INPUTS = {}
+
+
+def morphology_to_arrays(neuron):
+    """Convert a morphology into a dictionary of flat arrays.
+
+    The arrays follow the layout of the H5 morphology format: one row per point in ``points`` and
+    ``diameters`` and one row per section in ``structure`` containing the offset of its first point,
+    its type and the index of its parent section (``-1`` for root sections). The soma is stored
+    separately.
+
+    Args:
+        neuron (morphio.mut.Morphology): The morphology to convert.
+
+    Returns:
+        dict: The arrays describing the morphology.
+    """
+    morph = ImmutableMorphology(neuron)
+    parents = np.fromiter(
+        (-1 if sec.is_root else sec.parent.id for sec in morph.iter()),
+        dtype=np.int32,
+        count=len(morph.sections),
+    )
+    return {
+        "points": morph.points,
+        "diameters": morph.diameters,
+        "structure": np.column_stack(
+            (morph.section_offsets[:-1], morph.section_types, parents)
+        ).astype(np.int32),
+        "soma_points": morph.soma.points,
+        "soma_diameters": morph.soma.diameters,
+        "soma_type": int(morph.soma_type),
+    }
+
+
+def arrays_to_morphology(data):
+    """Build a morphology from the arrays created by :func:`morphology_to_arrays`.
+
+    Args:
+        data (dict): The arrays describing the morphology.
+
+    Returns:
+        morphio.mut.Morphology: The morphology.
+    """
+    neuron = Morphology()
+    neuron.soma.points = data["soma_points"]
+    neuron.soma.diameters = data["soma_diameters"]
+    neuron.soma.type = SomaType(data["soma_type"])
+
+    structure = data["structure"]
+    offsets = np.append(structure[:, 0], len(data["points"]))
+    sections = []
+    for (start, section_type, parent), end in zip(structure, offsets[1:]):
+        point_level = PointLevel(data["points"][start:end], data["diameters"][start:end])
+        if parent < 0:
+            sections.append(neuron.append_root_section(point_level, SectionType(section_type)))
+        else:
+            sections.append(sections[parent].append_section(point_level, SectionType(section_type)))
+    return neuron
+
+
+def _init_worker(inputs, grower_kwargs):
+    """Store the inputs shared by all the cells grown in the current worker process."""
+    _WORKER_INPUTS["inputs"] = inputs
+    _WORKER_INPUTS["grower_kwargs"] = grower_kwargs
+
+
+def _grow_cell(task, inputs, grower_kwargs):
+    """Grow one cell with its own random number generator at its own position."""
+    seed, origin, pia_direction, soma_radius, trunk_orientations = task
+    return NeuronGrower(
+        inputs,
+        rng_or_seed=seed,
+        origin=origin,
+        pia_direction=pia_direction,
+        soma_radius=soma_radius,
+        trunk_orientations=trunk_orientations,
+        **grower_kwargs,
+    ).grow()
+
+
+def _grow_cells_in_worker(tasks):
+    """Grow cells in a worker process and return them as arrays so they can be pickled."""
+    return [morphology_to_arrays(_grow_cell(task, **_WORKER_INPUTS)) for task in tasks]
+
+
+def _seed_sequence(seed, n_children_spawned=0):
+    """Return a copy of the given seed sequence or a new sequence built from the given seed.
+
+    A given seed sequence is copied so it gives the same children each time it is used. The copy
+    keeps its number of spawned children, so it does not spawn the children already spawned from
+    it, and ``n_children_spawned`` more children are skipped.
+    """
+    if not isinstance(seed, SeedSequence):
+        seed = SeedSequence(seed)
+    return SeedSequence(
+        seed.entropy,
+        spawn_key=seed.spawn_key,
+        pool_size=seed.pool_size,
+        n_children_spawned=seed.n_children_spawned + n_children_spawned,
+    )
+
+
+def _cell_seeds(seed, n_cells):
+    """Spawn the seeds of the cells one by one so they are not all kept in memory.
+
+    The seeds are the same as the ones given by ``seed.spawn(n_cells)`` (see
+    :func:`_seed_sequence`) but the given seed sequence is not modified.
+    """
+    seed = _seed_sequence(seed)
+    for _ in range(n_cells):
+        yield seed.spawn(1)[0]
+
+
+def _check_placements(origins, pia_directions):
+    """Check the origins and the pia directions of the cells and return them as arrays.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: The origins and the pia directions of the cells, as
+        arrays of shape ``(n_cells, 3)`` (the pia directions are ``None`` if not given).
+    """
+    origins = np.asarray(origins, dtype=np.float64)
+    if origins.ndim != 2 or origins.shape[1] != 3:
+        raise NeuroTSError(
+            f"The origins must be an array of shape (n_cells, 3), got {origins.shape}"
+        )
+    if not np.isfinite(origins).all():
+        raise NeuroTSError("The origins must be finite")
+
+    if pia_directions is None:
+        return origins, None
+
+    pia_directions = np.asarray(pia_directions, dtype=np.float64)
+    try:
+        pia_directions = np.broadcast_to(pia_directions, origins.shape)
+    except ValueError as exc:
+        raise NeuroTSError(
+            f"The pia directions must be an array of shape (3,) or {origins.shape}, got "
+            f"{pia_directions.shape}"
+        ) from exc
+    if not (np.linalg.norm(pia_directions, axis=1) > 0).all():
+        raise NeuroTSError("The pia directions must be non-zero vectors")
+    return origins, pia_directions
+
+
+def _placed_orientations(inputs, pia_directions, seed, n_cells, grower_kwargs):
+    """Compute the soma radii and the trunk orientations of all the placed cells at once.
+
+    They are computed by the ``compute_population_orientations()`` method of the trunk orientation
+    manager of the growers (a
+    :class:`neurots.generate.population_orientations.PopulationOrientationManager` by default),
+    with a random number generator seeded by the child of rank ``n_cells`` of the seed sequence
+    (the previous ones are used by the cells). The legacy orientation parameters are not handled
+    by the trunk orientation managers, so in this case the soma and the trunks are computed by the
+    grower of each cell.
+
+    Returns:
+        iterable[tuple]: The soma radius and the trunk orientations of each cell.
+    """
+    parameters = inputs.parameters
+    if not isinstance(parameters[parameters["grow_types"][0]]["orientation"], dict):
+        return repeat((None, None))
+
+    manager = grower_kwargs.get("trunk_orientations_class", PopulationOrientationManager)(
+        soma=None,
+        parameters=parameters,
+        distributions=inputs.distributions,
+        context=grower_kwargs.get("context"),
+        rng=np.random.default_rng(_seed_sequence(seed, n_cells).spawn(1)[0]),
+        distr_cache=inputs.distr_cache,
+    )
+    radii, population = manager.compute_population_orientations(
+        n_cells, soma_factory=Soma, pia_directions=pia_directions
+    )
+    return zip(radii, population)
+
+
+def _iter_cell_arrays(inputs, cell_tasks, n_workers, chunksize, grower_kwargs):
+    """Grow the cells in worker processes and yield them as arrays, ordered by cell index.
+
+    Only a few chunks of cells are submitted in advance so the memory usage does not depend on
+    the number of cells.
+    """
+    chunks = iter(lambda: list(islice(cell_tasks, chunksize)), [])
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_worker,
+        initargs=(inputs, grower_kwargs),
+    ) as executor:
+        pending = deque(
+            executor.submit(_grow_cells_in_worker, chunk) for chunk in islice(chunks, 2 * n_workers)
+        )
+        while pending:
+            results = pending.popleft().result()
+            for chunk in islice(chunks, 1):
+                pending.append(executor.submit(_grow_cells_in_worker, chunk))
+            yield from results
+
+
+def _iter_population(
+    input_parameters,
+    input_distributions,
+    n_cells,
+    seed,
+    n_workers,
+    skip_preprocessing,
+    chunksize,
+    grower_kwargs,
+    as_arrays,
+    placements=None,
+):
+    """Yield the cells of a population either as morphologies or as arrays.
+
+    If given, ``placements`` is a tuple of the origins and the pia directions of the cells, as
+    returned by :func:`_check_placements`. Then the soma radii and the trunk orientations of all
+    the cells are computed at once by :func:`_placed_orientations`.
+    """
+    if isinstance(input_parameters, CompiledSynthesisInputs):
+        inputs = input_parameters
+    else:
+        inputs = CompiledSynthesisInputs(
+            input_parameters, input_distributions, skip_preprocessing=skip_preprocessing
+        )
+
+    # A single sequence is used so the cells and the placed orientations share the same entropy
+    seed = _seed_sequence(seed)
+    if placements is None:
+        cell_placements = repeat((None, None, None, None))
+    else:
+        origins, pia_directions = placements
+        cell_placements = (
+            (origin, pia_direction, soma_radius, trunk_orientations)
+            for origin, pia_direction, (soma_radius, trunk_orientations) in zip(
+                origins,
+                repeat(None) if pia_directions is None else pia_directions,
+                _placed_orientations(inputs, pia_directions, seed, n_cells, grower_kwargs),
+            )
+        )
+    cell_tasks = (
+        (cell_seed,) + cell_placement
+        for cell_seed, cell_placement in zip(_cell_seeds(seed, n_cells), cell_placements)
+    )
+
+    if n_workers is None or n_workers <= 1:
+        for cell_task in cell_tasks:
+            neuron = _grow_cell(cell_task, inputs, grower_kwargs)
+            yield morphology_to_arrays(neuron) if as_arrays else neuron
+        return
+
+    L.debug("Synthesize %s cells using %s processes", n_cells, n_workers)
+    for data in _iter_cell_arrays(inputs, cell_tasks, n_workers, chunksize, grower_kwargs):
+        yield data if as_arrays else arrays_to_morphology(data)
+
+
+def iter_population(
+    input_parameters,
+    input_distributions,
+    n_cells,
+    seed=None,
+    n_workers=1,
+    skip_preprocessing=False,
+    chunksize=1,
+    **grower_kwargs,
+):
+    """Synthesize a population of neurons sharing the same inputs and yield them one by one.
+
+    The inputs are loaded and preprocessed only once (see
+    :class:`neurots.generate.grower.CompiledSynthesisInputs`). Each cell is grown by a
+    :class:`neurots.generate.grower.NeuronGrower` using its own random number generator, built
+    from the child of rank ``i`` of ``numpy.random.SeedSequence(seed)``. If ``seed`` is a
+    ``numpy.random.SeedSequence`` that already spawned children, the ranks start after them, so the
+    seeds of the cells are the ones that ``seed.spawn(n_cells)`` would give. The population is thus
+    identical whatever the number of workers.
+
+    The cells are yielded as soon as they are ready (but always ordered by cell index) and only a
+    few of them are grown in advance, so the memory usage does not depend on the number of cells.
+
+    Args:
+        input_parameters (dict or str or CompiledSynthesisInputs): The user-defined parameters, a
+            path to a JSON file or the compiled inputs (in this case the ``input_distributions``
+            and ``skip_preprocessing`` arguments are ignored).
+        input_distributions (dict or str): The distributions extracted from biological data or a
+            path to a JSON file.
+        n_cells (int): The number of cells to synthesize.
+        seed (None, int or numpy.random.SeedSequence): The seed from which the seeds of all the
+            cells are spawned.
+        n_workers (int): The number of processes used to grow the cells. If ``n_workers <= 1``,
+            the cells are grown in the current process.
+        skip_preprocessing (bool): If set to ``False``, the parameters and distributions are
+            preprocessed with registered validator and preprocessors.
+        chunksize (int): The number of cells sent at once to each worker.
+        **grower_kwargs: Other keyword arguments passed to
+            :class:`neurots.generate.grower.NeuronGrower` (they must be picklable if
+            ``n_workers > 1``).
+
+    Yields:
+        morphio.mut.Morphology: The synthesized neurons, ordered by cell index.
+    """
+    yield from _iter_population(
+        input_parameters,
+        input_distributions,
+        n_cells,
+        seed,
+        n_workers,
+        skip_preprocessing,
+        chunksize,
+        grower_kwargs,
+        as_arrays=False,
+    )
+
+
+def synthesize_population(
+    input_parameters,
+    input_distributions,
+    n_cells,
+    seed=None,
+    n_workers=1,
+    skip_preprocessing=False,
+    chunksize=1,
+    **grower_kwargs,
+):
+    """Synthesize a population of neurons sharing the same inputs.
+
+    See :func:`iter_population` for details, this function just returns all the cells at once.
+
+    Returns:
+        list[morphio.mut.Morphology]: The synthesized neurons, ordered by cell index.
+    """
+    return list(
+        iter_population(
+            input_parameters,
+            input_distributions,
+            n_cells,
+            seed=seed,
+            n_workers=n_workers,
+            skip_preprocessing=skip_preprocessing,
+            chunksize=chunksize,
+            **grower_kwargs,
+        )
+    )
+
+
+def iter_placed_population(
+    input_parameters,
+    input_distributions,
+    origins,
+    pia_directions=None,
+    seed=None,
+    n_workers=1,
+    skip_preprocessing=False,
+    chunksize=1,
+    **grower_kwargs,
+):
+    """Synthesize neurons at the given positions and yield them one by one.
+
+    One cell is grown at each origin, with the given pia direction if any. The origins and the
+    pia directions are checked as arrays and passed directly to the growers of the cells, so the
+    inputs are neither copied nor modified for each cell.
+
+    The soma radii and the trunk orientations of all the cells are computed at once by the
+    ``compute_population_orientations()`` method of the trunk orientation manager, in the pia
+    frame of each cell, from the child of rank ``n_cells`` of ``numpy.random.SeedSequence(seed)``.
+    They are given to the growers of the cells, which then grow the neurites as in
+    :func:`iter_population`, from the child of rank ``i`` for the cell of index ``i``. The
+    population is thus identical whatever the number of workers. With the legacy orientation
+    parameters, the soma and the trunks are computed by the grower of each cell.
+
+    The soma radii and the trunk orientations of all the cells are kept in memory until the cells
+    are grown.
+
+    Args:
+        input_parameters (dict or str or CompiledSynthesisInputs): The user-defined parameters, a
+            path to a JSON file or the compiled inputs (in this case the ``input_distributions``
+            and ``skip_preprocessing`` arguments are ignored).
+        input_distributions (dict or str): The distributions extracted from biological data or a
+            path to a JSON file.
+        origins (numpy.ndarray): The origins of the cells, as an array of shape ``(n_cells, 3)``.
+        pia_directions (numpy.ndarray): The pia directions of the cells, as an array of shape
+            ``(n_cells, 3)`` or ``(3,)`` to use the same direction for all the cells. If not
+            given, the ``pia_direction`` parameter is used.
+        seed (None, int or numpy.random.SeedSequence): The seed from which the seeds of all the
+            cells are spawned.
+        n_workers (int): The number of processes used to grow the cells. If ``n_workers <= 1``,
+            the cells are grown in the current process.
+        skip_preprocessing (bool): If set to ``False``, the parameters and distributions are
+            preprocessed with registered validator and preprocessors.
+        chunksize (int): The number of cells sent at once to each worker.
+        **grower_kwargs: Other keyword arguments passed to
+            :class:`neurots.generate.grower.NeuronGrower` (they must be picklable if
+            ``n_workers > 1``).
+
+    Yields:
+        morphio.mut.Morphology: The synthesized neurons, ordered by cell index.
+    """
+    placements = _check_placements(origins, pia_directions)
+    yield from _iter_population(
+        input_parameters,
+        input_distributions,
+        len(placements[0]),
+        seed,
+        n_workers,
+        skip_preprocessing,
+        chunksize,
+        grower_kwargs,
+        as_arrays=False,
+        placements=placements,
+    )
+
+
+def synthesize_placed_population(
+    input_parameters,
+    input_distributions,
+    origins,
+    pia_directions=None,
+    seed=None,
+    n_workers=1,
+    skip_preprocessing=False,
+    chunksize=1,
+    **grower_kwargs,
+):
+    """Synthesize neurons at the given positions.
+
+    See :func:`iter_placed_population` for details, this function just returns all the cells at
+    once.
+
+    Returns:
+        list[morphio.mut.Morphology]: The synthesized neurons, ordered by cell index.
+    """
+    return list(
+        iter_placed_population(
+            input_parameters,
+            input_distributions,
+            origins,
+            pia_directions=pia_directions,
+            seed=seed,
+            n_workers=n_workers,
+            skip_preprocessing=skip_preprocessing,
+            chunksize=chunksize,
+            **grower_kwargs,
+        )
+    )
+
+
+class MorphologyContainerWriter:
+    """Write morphologies into a single HDF5 morphology container.
+
+    Each morphology is stored in its own group of the container, using the layout of the H5
+    morphology format (the container can be read with :class:`morphio.Collection`). The
+    morphologies are buffered in memory and the buffered ones are written and flushed to the file
+    each time ``buffer_size`` of them are waiting.
+
+    Args:
+        path (str): The path to the container file.
+        buffer_size (int): The number of morphologies buffered before they are written.
+        mode (str): The mode used to open the file (see :class:`h5py.File`).
+
+    .. code-block:: python
+
+        with MorphologyContainerWriter("population.h5") as writer:
+            for i, neuron in enumerate(iter_population(params, distrs, n_cells=1000)):
+                writer.write(f"cell_{i}", neuron)
+    """
+
+    def __init__(self, path, buffer_size=100, mode="w"):
+        self._file = h5py.File(path, mode)
+        self._buffer_size = buffer_size
+        self._buffer = []
+
+    def __enter__(self):
+        """Open the writer context."""
+        return self
+
+    def __exit__(self, *args):
+        """Write the buffered morphologies and close the file."""
+        self.close()
+
+    def write(self, name, neuron):
+        """Add a morphology to the container.
+
+        Args:
+            name (str): The name of the morphology in the container.
+            neuron (morphio.mut.Morphology or dict): The morphology or its arrays, as created by
+                :func:`morphology_to_arrays`.
+        """
+        if not isinstance(neuron, dict):
+            neuron = morphology_to_arrays(neuron)
+        self._buffer.append((name, _arrays_to_h5_layout(neuron)))
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all the buffered morphologies into the container."""
+        for name, (points, structure) in self._buffer:
+            group = self._file.create_group(name)
+            group.create_dataset("points", data=points)
+            group.create_dataset("structure", data=structure)
+            metadata = group.create_group("metadata")
+            metadata.attrs["cell_family"] = np.array([0], dtype=np.uint32)
+            metadata.attrs["version"] = np.array([1, 3], dtype=np.uint32)
+        self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        """Write the buffered morphologies and close the file."""
+        if self._file:
+            self.flush()
+            self._file.close()
+
+
+def _arrays_to_h5_layout(data):
+    """Build the points and structure arrays of the H5 morphology format."""
+    soma_points = np.asarray(data["soma_points"]).reshape(-1, 3)
+    n_soma_points = len(soma_points)
+    points = np.empty((n_soma_points + len(data["points"]), 4), dtype=np.float32)
+    points[:n_soma_points, :3] = soma_points
+    points[:n_soma_points, 3] = data["soma_diameters"]
+    points[n_soma_points:, :3] = data["points"]
+    points[n_soma_points:, 3] = data["diameters"]
+
+    # The soma is the first section and the other section IDs are shifted accordingly
+    structure = np.empty((len(data["structure"]) + 1, 3), dtype=np.int32)
+    structure[0] = (0, int(SectionType.soma), -1)
+    structure[1:, 0] = data["structure"][:, 0] + n_soma_points
+    structure[1:, 1] = data["structure"][:, 1]
+    structure[1:, 2] = data["structure"][:, 2] + 1
+    return points, structure
+
+
+def synthesize_population_to_container(
+    path,
+    input_parameters,
+    input_distributions,
+    n_cells,
+    seed=None,
+    n_workers=1,
+    skip_preprocessing=False,
+    chunksize=1,
+    buffer_size=100,
+    name_format="cell_{}",
+    **grower_kwargs,
+):
+    """Synthesize a population of neurons and stream them into a single HDF5 container.
+
+    The cells are grown with :func:`iter_population` and written with a
+    :class:`MorphologyContainerWriter`, so the memory usage does not depend on the number of cells.
+
+    Args:
+        path (str): The path to the container file.
+        input_parameters (dict or str or CompiledSynthesisInputs): The user-defined parameters, a
+            path to a JSON file or the compiled inputs.
+        input_distributions (dict or str): The distributions extracted from biological data or a
+            path to a JSON file.
+        n_cells (int): The number of cells to synthesize.
+        seed (None, int or numpy.random.SeedSequence): The seed from which the seeds of all the
+            cells are spawned.
+        n_workers (int): The number of processes used to grow the cells.
+        skip_preprocessing (bool): If set to ``False``, the parameters and distributions are
+            preprocessed with registered validator and preprocessors.
+        chunksize (int): The number of cells sent at once to each worker.
+        buffer_size (int): The number of morphologies buffered before they are written.
+        name_format (str): The format used to build the name of each cell from its index.
+        **grower_kwargs: Other keyword arguments passed to
+            :class:`neurots.generate.grower.NeuronGrower`.
+
+    The cell of index ``i`` is stored in the group named ``name_format.format(i)``.
+    """
+    with MorphologyContainerWriter(path, buffer_size=buffer_size) as writer:
+        for i, data in enumerate(
+            _iter_population(
+                input_parameters,
+                input_distributions,
+                n_cells,
+                seed,
+                n_workers,
+                skip_preprocessing,
+                chunksize,
+                grower_kwargs,
+                as_arrays=True,
+            )
+        ):
+            writer.write(name_format.format(i), data)
@@ -0,0 +1,201 @@
+"""Module for computing the trunk orientations of several cells at once."""
+
+# Copyright (C) 2021  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from neurots.generate.orientations import OrientationManager
+from neurots.generate.orientations import _sample_trunks_from_3d_angle
+from neurots.generate.orientations import spherical_angles_to_orientations
+from neurots.generate.orientations import spherical_angles_to_pia_orientations
+from neurots.morphmath import rotation
+from neurots.morphmath import sample
+from neurots.morphmath.utils import normalize_vectors
+from neurots.utils import PIA_DIRECTION
+
+_TWOPI = 2.0 * np.pi
+
+
+class PopulationOrientationManager(OrientationManager):
+    """Class to generate the tree orientations of all the cells of a population at once.
+
+    The modes of :class:`neurots.generate.orientations.OrientationManager` get a
+    ``_population_mode_{name}`` method, used by
+    :meth:`~neurots.generate.orientations.OrientationManagerBase.compute_population_orientations`
+    to draw the random numbers of all the cells at once. The orientations of a single cell are
+    computed as with :class:`neurots.generate.orientations.OrientationManager`.
+
+    Args:
+        soma (Soma): The soma on which the trees should be attached.
+        parameters (dict): The parameters used to compute the orientations.
+        distributions (dict): The distributions used to compute the orientations.
+        context (any): An object containing contextual information.
+        rng (numpy.random.Generator): The random number generator to use.
+        distr_cache (neurots.morphmath.sample.DistrCache): The cache of the built distributions.
+    """
+
+    def _rotate_to_cell_pia(self, orientations, n_trees):
+        """Rotates orientations sampled around `[0, 1, 0]` to the pia direction of their cell.
+
+        The orientations of each cell are consecutive and ``n_trees`` gives their number.
+        """
+        rotations = rotation.rotation_matrix_from_vectors(
+            np.broadcast_to(PIA_DIRECTION, self._pia_directions.shape), self._pia_directions
+        )
+        return np.einsum("nij,nj->ni", np.repeat(rotations, n_trees, axis=0), orientations)
+
+    def _population_mode_use_predefined(self, values_dict, tree_type, population):
+        """Returns the predefined orientations for each cell."""
+        # pylint: disable=unused-argument
+        assert "orientations" in values_dict, "'orientations' key is missing"
+        orientations = normalize_vectors(np.asarray(values_dict["orientations"], dtype=np.float64))
+        return [orientations.copy() for _ in population]
+
+    def _population_mode_uniform(self, _, tree_type, population):
+        """Uniformly sample the angles on the sphere for each cell."""
+        n_trees = self._n_trees(tree_type, size=len(population))
+        orientations = normalize_vectors(self._rng.normal(0, 1, (n_trees.sum(), 3)))
+        return np.split(orientations, np.cumsum(n_trees)[:-1])
+
+    def _population_mode_sample_around_primary_orientation(
+        self, values_dict, tree_type, population
+    ):
+        """Sample the orientations around a primary direction for each cell."""
+        tree_type_distrs = self._distributions[tree_type]
+        n_trees = self._n_trees(tree_type, size=len(population))
+        cell_ids = np.repeat(np.arange(len(population)), n_trees)
+
+        trunk_absolute_angles = np.asarray(
+            self._sample_angles(sample.trunk_absolute_angles, tree_type_distrs, len(cell_ids))
+        )
+        z_angles = self._sample_angles(sample.azimuth_angles, tree_type_distrs, len(cell_ids))
+
+        # Sort the angles of each cell
+        sort_ids = np.lexsort((trunk_absolute_angles, cell_ids))
+
+        primary_orientation = np.asarray(values_dict["primary_orientation"], dtype=np.float64)
+        phi, theta = rotation.spherical_from_vector(primary_orientation)
+        orientations = spherical_angles_to_orientations(
+            phi + trunk_absolute_angles[sort_ids] - 0.5 * np.pi,
+            theta + z_angles[sort_ids] - 0.5 * np.pi,
+        )
+        return np.split(orientations, np.cumsum(n_trees)[:-1])
+
+    def _population_mode_sample_pairwise_angles(self, values_dict, tree_type, population):
+        """Returns the sampled orientations for each cell.
+
+        The orientations of the cells that already have trunks are computed cell by cell.
+        """
+        if any(any(len(oris) > 0 for oris in cell.values()) for cell in population):
+            radii = [1.0] * len(population)
+            return self._compute_cells_orientations(
+                self._mode_sample_pairwise_angles, values_dict, tree_type, radii, population
+            )
+
+        tree_type_distrs = self._distributions[tree_type]
+        # The cells that get no trunk get an empty array of orientations
+        n_trees = self._n_trees(tree_type, size=len(population))
+        cell_ids = np.repeat(np.arange(len(population)), n_trees)
+        offsets = np.concatenate([[0], np.cumsum(n_trees)])
+        has_trees = n_trees > 0
+
+        # As in sample.trunk_angles(), the deviations of each cell are completed with their sum
+        deviations = np.empty(len(cell_ids))
+        is_last = np.zeros(len(cell_ids), dtype=bool)
+        is_last[offsets[1:][has_trees] - 1] = True
+        deviations[~is_last] = sample.get_distr(
+            tree_type_distrs["trunk"]["orientation_deviation"], self._rng, self._distr_cache
+        ).draw(len(cell_ids) - np.count_nonzero(has_trees))
+        if len(cell_ids) > 0:
+            deviations[is_last] = 0
+            deviations[is_last] = np.add.reduceat(deviations, offsets[:-1][has_trees])
+        z_angles = self._sample_angles(sample.azimuth_angles, tree_type_distrs, len(cell_ids))
+
+        # The trunks of each cell are distributed around the soma from the sorted deviations
+        sort_ids = np.lexsort((deviations, cell_ids))
+        ranks = np.arange(1, len(cell_ids) + 1) - offsets[cell_ids]
+        phis = ranks * (_TWOPI / n_trees[cell_ids]) + deviations[sort_ids]
+        orientations = spherical_angles_to_orientations(phis, z_angles[sort_ids])
+        return np.split(orientations, offsets[1:-1])
+
+    def _population_mode_normal_pia_constraint(self, values_dict, tree_type, population):
+        """Returns the orientations using a normal/exp distribution along a direction for each cell.
+
+        See :meth:`_mode_normal_pia_constraint` for more details. The angles are taken with the pia
+        direction of each cell if the pia directions are given.
+        """
+        means = values_dict["direction"]["mean"]
+        n_trees = self._n_trees(tree_type, size=len(population))
+        if isinstance(means, list):
+            # To force the direction of possibly 2 apicals, otherwise it is for basals
+            n_trees[n_trees == len(means)] = 1
+        means = np.atleast_1d(means)
+        stds = np.atleast_1d(values_dict["direction"]["std"])
+        n_angles = n_trees.sum()
+
+        thetas = np.zeros((n_angles, len(means)))
+        for i, (mean, std) in enumerate(zip(means, stds)):
+            if mean == 0:
+                if std > 0:
+                    thetas[:, i] = np.clip(self._rng.exponential(std, n_angles), 0, np.pi)
+            else:
+                thetas[:, i] = np.clip(self._rng.normal(mean, std, n_angles), 0, np.pi)
+        phis = self._rng.uniform(0, 2 * np.pi, (n_angles, len(means)))
+
+        if self._pia_directions is None:
+            orientations = spherical_angles_to_pia_orientations(
+                phis.ravel(), thetas.ravel(), self._parameters.get("pia_direction", None)
+            )
+        else:
+            orientations = self._rotate_to_cell_pia(
+                spherical_angles_to_pia_orientations(phis.ravel(), thetas.ravel()),
+                n_trees * len(means),
+            )
+        return np.split(orientations, np.cumsum(n_trees * len(means))[:-1])
+
+    def _population_mode_pia_constraint(self, values_dict, tree_type, population):
+        """Create the trunks of each cell from a distribution of angles with the pia direction.
+
+        All the trunks are sampled at once with :func:`_sample_trunks_from_3d_angle`. If the pia
+        directions are given, the trunks are sampled around `[0, 1, 0]` and rotated to the pia
+        direction of their cell.
+        """
+        # pylint: disable=unused-argument
+        n_trees = self._n_trees(tree_type, size=len(population))
+        if self._pia_directions is None:
+            pia_direction = self._parameters.get("pia_direction", PIA_DIRECTION)
+        else:
+            pia_direction = PIA_DIRECTION
+        orientations = _sample_trunks_from_3d_angle(
+            self._parameters, self._rng, tree_type, pia_direction, n_trees.sum()
+        )
+        if self._pia_directions is not None:
+            orientations = self._rotate_to_cell_pia(orientations, n_trees)
+        return np.split(orientations, np.cumsum(n_trees)[:-1])
+
+    def _population_mode_apical_constraint(self, values_dict, tree_type, population):
+        """Create the trunks of each cell from a distribution of angles with its apical direction.
+
+        The trunks of each cell are sampled at once with :func:`_sample_trunks_from_3d_angle`.
+        """
+        # pylint: disable=unused-argument
+        n_trees = self._n_trees(tree_type, size=len(population))
+        return [
+            _sample_trunks_from_3d_angle(
+                self._parameters, self._rng, tree_type, cell["apical_dendrite"][0], cell_n_trees
+            )
+            for cell, cell_n_trees in zip(population, n_trees)
+        ]
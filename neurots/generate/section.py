@@ -15,13 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import math
 from collections import deque
+from itertools import accumulate
 
 import numpy as np
 from numpy.linalg import norm as vectorial_norm  # vectorial_norm used for array of vectors
 
-from neurots.morphmath.utils import get_random_point  # norm used for single vectors
-from neurots.morphmath.utils import norm
+from neurots.morphmath.point_array import DynamicPointArray
+from neurots.morphmath.sample import DirectSampler
+from neurots.morphmath.utils import norm  # norm used for single vectors
+from neurots.utils import NeuroTSError
 
 MEMORY = 5
 DISTANCE_MIN = 1e-8
@@ -29,6 +33,71 @@ DISTANCE_MIN = 1e-8
 # Memory decreases with distance from current point
 WEIGHTS = np.exp(np.arange(1, MEMORY + 1) - MEMORY)
 
+# Ratio between the weights of two consecutive directions and weight of the oldest direction
+_WEIGHT_DECAY = float(np.exp(-1.0))
+_OLDEST_WEIGHT = float(WEIGHTS[0])
+
+
+class DirectionHistory:
+    """The latest directions of a section.
+
+    It behaves like a ``deque(maxlen=MEMORY)`` of directions and also keeps their sum weighted by
+    ``WEIGHTS``, which is updated each time a direction is appended instead of being recomputed.
+    The sum is stored as Python floats because the overhead of NumPy is large for 3D vectors.
+
+    Args:
+        directions (list[numpy.ndarray]): The initial directions (only the ``MEMORY`` last ones are
+            kept).
+    """
+
+    __slots__ = ("_directions", "_sum")
+
+    def __init__(self, directions=()):
+        self._directions = deque(maxlen=MEMORY)
+        self._sum = (0.0, 0.0, 0.0)
+        for direction in directions:
+            self.append(direction)
+
+    def __len__(self):
+        """Return the number of directions."""
+        return len(self._directions)
+
+    def __getitem__(self, index):
+        """Return a direction, the first one being the oldest."""
+        return np.array(self._directions[index])
+
+    def copy(self):
+        """Return a copy of the history."""
+        # pylint: disable=protected-access
+        new_history = DirectionHistory()
+        new_history._directions.extend(self._directions)
+        new_history._sum = self._sum
+        return new_history
+
+    def append(self, direction):
+        """Append a direction and remove the oldest one if the history is full."""
+        self.append_floats(*np.asarray(direction, dtype=float).tolist())
+
+    def append_floats(self, x, y, z):
+        """Append a direction given as three Python floats."""
+        sum_x, sum_y, sum_z = self._sum
+        if len(self._directions) == MEMORY:
+            old_x, old_y, old_z = self._directions[0]
+            sum_x -= _OLDEST_WEIGHT * old_x
+            sum_y -= _OLDEST_WEIGHT * old_y
+            sum_z -= _OLDEST_WEIGHT * old_z
+        self._sum = (
+            sum_x * _WEIGHT_DECAY + x,
+            sum_y * _WEIGHT_DECAY + y,
+            sum_z * _WEIGHT_DECAY + z,
+        )
+        self._directions.append((x, y, z))
+
+    @property
+    def weighted_sum(self):
+        """Return the weighted sum of the directions as a tuple of floats."""
+        return self._sum
+
 
 class SectionGrower:
     """Class for the section growth.
@@ -37,7 +106,7 @@ class SectionGrower:
     other. This process generates a tubular morphology that resembles a random walk.
 
     Args:
-        parent (morphio.Section): The parent of the section.
+        parent (int): The ID of the parent of the section.
         children (int): The number of children.
         first_point (list[float]): The first point of the section.
         direction (list[float]): The first point of the section.
@@ -48,8 +117,29 @@ class SectionGrower:
         pathlength (float): The path length of the section.
         context (Any): The context used for the section.
         random_generator (numpy.random.Generator): The random number generator to use.
+        sampler (neurots.morphmath.sample.DirectSampler): The object giving the random directions,
+            step lengths and uniform numbers used to grow the section (by default a
+            :class:`neurots.morphmath.sample.DirectSampler` using ``step_size_distribution`` and
+            ``random_generator``).
     """
 
+    __slots__ = (
+        "parent",
+        "id",
+        "direction",
+        "children",
+        "points",
+        "params",
+        "stop_criteria",
+        "process",
+        "_latest_directions",
+        "context",
+        "_rng",
+        "step_size_distribution",
+        "pathlength",
+        "sampler",
+    )
+
     # pylint: disable-msg=too-many-arguments
     def __init__(
         self,
@@ -64,29 +154,45 @@ class SectionGrower:
         pathlength,
         context=None,
         random_generator=np.random,
+        sampler=None,
     ):
         self.parent = parent
         self.id = None
         assert not np.isclose(vectorial_norm(direction), 0.0), "Nan direction not recognized"
         self.direction = direction / vectorial_norm(direction)
         self.children = children
-        self.points = [np.array(first_point[:3])]
+        self.points = DynamicPointArray(initial_capacity=32, dtype=float)
+        self.points.append(first_point[:3])
 
         self.params = parameters
 
         self.stop_criteria = stop_criteria
         self.process = process
-        self.latest_directions = deque(maxlen=MEMORY)
+        self.latest_directions = DirectionHistory()
         self.context = context
         self._rng = random_generator
         self.step_size_distribution = step_size_distribution
         self.pathlength = 0 if parent is None else pathlength
+        if sampler is None:
+            sampler = DirectSampler(step_size_distribution, random_generator)
+        self.sampler = sampler
 
     @property
     def last_point(self):
         """Returns the last point of the section."""
         return self.points[-1]
 
+    @property
+    def latest_directions(self):
+        """Returns the latest directions of the section."""
+        return self._latest_directions
+
+    @latest_directions.setter
+    def latest_directions(self, directions):
+        if not isinstance(directions, DirectionHistory):
+            directions = DirectionHistory(directions)
+        self._latest_directions = directions
+
     def update_pathlength(self, length):
         """Increases the path distance."""
         self.pathlength += length
@@ -95,12 +201,12 @@ class SectionGrower:
         """Returns the next point depending on the growth method and the previous point."""
         direction = (
             self.params.targeting * self.direction
-            + self.params.randomness * get_random_point(random_generator=self._rng)
+            + self.params.randomness * self.sampler.random_direction()
             + self.params.history * self.history()
         )
 
         direction = direction / vectorial_norm(direction)
-        seg_length = self.step_size_distribution.draw_positive()
+        seg_length = self.sampler.step_length()
         next_point = current_point + seg_length * direction
         self.update_pathlength(seg_length)
         return next_point, direction
@@ -118,7 +224,7 @@ class SectionGrower:
         direction = self.params.targeting * self.direction + self.params.history * self.history()
 
         direction = direction / vectorial_norm(direction)
-        seg_length = self.step_size_distribution.draw_positive()
+        seg_length = self.sampler.step_length()
         point = self.last_point + seg_length * direction
         self.update_pathlength(seg_length)
 
@@ -135,18 +241,16 @@ class SectionGrower:
 
     def history(self):
         """Returns a combination of the sections history."""
-        n_points = len(self.latest_directions)
-
-        if n_points == 0:
+        if len(self._latest_directions) == 0:
             return np.zeros(3)
 
-        history = np.dot(WEIGHTS[MEMORY - n_points :], self.latest_directions)
+        x, y, z = self._latest_directions.weighted_sum
 
-        distance = vectorial_norm(history)
+        distance = math.sqrt(x * x + y * y + z * z)
         if distance > DISTANCE_MIN:
-            history /= distance
+            return np.array((x / distance, y / distance, z / distance))
 
-        return history
+        return np.array((x, y, z))
 
     def next(self):
         """Creates one point and returns the next state: bifurcate, terminate or continue."""
@@ -164,17 +268,243 @@ class SectionGrower:
 
         return "bifurcate"
 
+    def next_all(self):
+        """Creates all the remaining points of the section and returns the next state.
+
+        This is equivalent to calling :meth:`next` until the ``num_seg`` stop criterion is
+        fulfilled but the random numbers of the whole section are drawn at once and only the
+        history of the directions is computed point by point. The sampler must be able to draw
+        several numbers at once, like :class:`neurots.morphmath.sample.BlockSampler`, and
+        :meth:`post_next_point` is not called.
+        """
+        n_points = max(self.stop_criteria["num_seg"] - len(self.points), 1)
+        directions, seg_lengths = self._random_walk(n_points, self._latest_directions)
+        for seg_length in seg_lengths.tolist():
+            self.pathlength += seg_length
+
+        steps = seg_lengths[:, np.newaxis] * directions
+        steps[0] += self.last_point
+        self.points.extend(np.cumsum(steps, axis=0))
+
+        if self.children == 0:
+            return "terminate"
+
+        return "bifurcate"
+
+    def _random_walk(self, n_points, latest_directions):  # pylint: disable=too-many-locals
+        """Compute the directions of the next points from random numbers drawn at once.
+
+        The directions are the same as the ones computed by :meth:`next_point` from the same random
+        numbers. They are computed point by point because each of them depends on the history of
+        the previous ones, which is updated in ``latest_directions``.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: The directions and the lengths of the steps.
+        """
+        random_directions = self.params.randomness * self.sampler.random_directions(n_points)
+        seg_lengths = self.sampler.step_lengths(n_points)
+        target_x, target_y, target_z = (self.params.targeting * self.direction).tolist()
+        history_weight = float(self.params.history)
+
+        directions = np.empty((n_points, 3))
+        for i, (rand_x, rand_y, rand_z) in enumerate(random_directions.tolist()):
+            # Same computation as in self.history() and self.next_point()
+            hist_x, hist_y, hist_z = latest_directions.weighted_sum
+            distance = math.sqrt(hist_x * hist_x + hist_y * hist_y + hist_z * hist_z)
+            if distance > DISTANCE_MIN:
+                hist_x, hist_y, hist_z = hist_x / distance, hist_y / distance, hist_z / distance
+            x = target_x + rand_x + history_weight * hist_x
+            y = target_y + rand_y + history_weight * hist_y
+            z = target_z + rand_z + history_weight * hist_z
+            distance = math.sqrt(x * x + y * y + z * z)
+            x, y, z = x / distance, y / distance, z / distance
+
+            latest_directions.append_floats(x, y, z)
+            directions[i] = (x, y, z)
+
+        return directions, seg_lengths
+
     def post_next_point(self):
         """A method to perform actions after `self.next_point()` has been called."""
 
 
+class _StopEvent:
+    """The threshold and the cumulative hazard of the bifurcation or the termination of a section.
+
+    The hazards are stored for the points grown ahead of the section, from the index ``start``:
+    ``cumulative[k]`` is the hazard accumulated until the point ``start + k`` (included) and
+    ``base`` is the hazard accumulated before the point ``start``. The event occurs at the point
+    ``step``, which is the first point at which the cumulative hazard exceeds the threshold, or
+    ``None`` if the step must be sampled again.
+    """
+
+    __slots__ = ("threshold", "crit", "start", "base", "cumulative", "step")
+
+    def __init__(self):
+        self.threshold = None
+        self.crit = None
+        self.start = 0
+        self.base = 0.0
+        self.cumulative = np.empty(0)
+        self.step = None
+
+    def hazard_before(self, index):
+        """Return the hazard accumulated before the given point."""
+        if self.step is None or index <= self.start:
+            return self.base
+        return self.cumulative[index - self.start - 1]
+
+    def rebase(self, index):
+        """Keep the hazard accumulated before the given point and discard the next ones."""
+        self.base = self.hazard_before(index)
+        self.start = index
+        self.step = None
+
+    def reset(self, index):
+        """Discard the threshold and the hazard once the event occurred at the given point."""
+        self.threshold = None
+        self.base = 0.0
+        self.start = index + 1
+        self.step = None
+
+
+class _StopSchedule:
+    """The points grown ahead of a section and its stop events."""
+
+    __slots__ = ("points", "directions", "pathlengths", "values", "index", "criteria", "events")
+
+    def __init__(self):
+        self.points = np.empty((0, 3))
+        self.directions = []
+        self.pathlengths = []
+        self.values = None
+        self.index = 0
+        self.criteria = None
+        self.events = {"bif": _StopEvent(), "term": _StopEvent()}
+
+
 class SectionGrowerExponentialProba(SectionGrower):
     """Abstract class for exponentially decreasing bifurcation and termination probabilities.
 
     The parameter lambda defines the slope of the exponential.
     The parameter that follows the exponential must be defined in the derived class.
+
+    By default, a uniform number is drawn at each step and compared to the probability. If the
+    ``analytic_stop`` parameter is set, the stop steps are sampled directly: the points of the
+    section are grown ahead by blocks, a threshold following the exponential distribution is
+    drawn for the bifurcation and for the termination and the step at which the cumulative hazard
+    ``-sum(log(1 - probability))`` of the block exceeds each threshold is found at once. The
+    survival probability after each step is the same as with the per-step draws, so the two modes
+    give the same distributions, but the random numbers are not the same.
+
+    The points grown ahead are still added one by one by :meth:`next`, because the tree grower
+    extends its sections in turn and the bars of the barcode used by a section may be consumed by
+    another one. When the stop criteria change, the stop step is sampled again from the hazard
+    accumulated so far, which gives the same distribution because the process is memoryless.
     """
 
+    __slots__ = ("_schedule",)
+
+    # The number of points grown ahead at once (it is doubled each time the section gets longer)
+    _MIN_AHEAD = 16
+    _MAX_AHEAD = 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._schedule = None
+        if getattr(self.params, "analytic_stop", False):
+            # The points grown ahead are computed as in SectionGrower.next_point()
+            if (
+                type(self).next_point is not SectionGrower.next_point
+                or type(self).post_next_point is not SectionGrower.post_next_point
+            ):
+                raise NeuroTSError(
+                    f"The analytic sampling of the stops is not supported by {type(self).__name__}."
+                )
+            self._schedule = _StopSchedule()
+
+    def next(self):
+        """Creates one point and returns the next state: bifurcate, terminate or continue."""
+        schedule = self._schedule
+        if schedule is None:
+            return super().next()
+
+        if schedule.index == len(schedule.pathlengths):
+            self._grow_ahead()
+        index = schedule.index
+        schedule.index += 1
+        self.latest_directions.append_floats(*schedule.directions[index])
+        self.points.append(schedule.points[index])
+        self.pathlength = schedule.pathlengths[index]
+        return self._scheduled_state(index)
+
+    def _grow_ahead(self):
+        """Grow the next block of points of the section without adding them to the section."""
+        schedule = self._schedule
+        n_points = min(max(2 * len(schedule.pathlengths), self._MIN_AHEAD), self._MAX_AHEAD)
+        directions, seg_lengths = self._random_walk(n_points, self.latest_directions.copy())
+        steps = seg_lengths[:, np.newaxis] * directions
+        steps[0] += self.last_point
+
+        for event in schedule.events.values():
+            event.rebase(len(schedule.pathlengths))
+            event.start = 0
+        schedule.points = np.cumsum(steps, axis=0)
+        schedule.directions = directions.tolist()
+        schedule.pathlengths = list(accumulate(seg_lengths.tolist(), initial=self.pathlength))[1:]
+        schedule.values = None
+        schedule.index = 0
+
+    def _scheduled_state(self, index):
+        """Return the state of the section after the given point grown ahead."""
+        schedule = self._schedule
+        tmd = self.stop_criteria["TMD"]
+        if tmd is not schedule.criteria:
+            if schedule.criteria is None or not np.array_equal(tmd.ref, schedule.criteria.ref):
+                schedule.values = None
+            schedule.criteria = tmd
+        if schedule.values is None:
+            schedule.values = self.get_values(schedule.points, schedule.pathlengths)
+            for event in schedule.events.values():
+                event.rebase(index)
+
+        bif, term = schedule.events["bif"], schedule.events["term"]
+        if bif.step is None or bif.crit != tmd.bif:
+            self._sample_stop_step(bif, tmd.bif, index)
+        if index == bif.step:
+            bif.reset(index)
+            # The termination is not checked at the point where the section bifurcates
+            term.rebase(index)
+            self.children = 2.0
+            return "bifurcate"
+
+        if term.step is None or term.crit != tmd.term:
+            self._sample_stop_step(term, tmd.term, index)
+        if index == term.step:
+            term.reset(index)
+            self.children = 0.0
+            return "terminate"
+
+        return "continue"
+
+    def _sample_stop_step(self, event, crit, index):
+        """Find the first point from the given one at which the event occurs."""
+        scale_prob = self.params.scale_prob
+        assert scale_prob > 0
+        event.rebase(index)
+        if event.threshold is None:
+            event.threshold = -math.log(1.0 - self.sampler.uniform())
+        with np.errstate(over="ignore"):
+            proba = np.exp(-(crit - self._schedule.values[index:]) * scale_prob)
+
+        # The event always occurs when the value reaches the criterion
+        hazards = np.full(len(proba), np.inf)
+        possible = proba < 1.0
+        hazards[possible] = -np.log1p(-proba[possible])
+        event.cumulative = event.base + np.cumsum(hazards)
+        event.crit = crit
+        event.step = index + int(np.searchsorted(event.cumulative, event.threshold, side="right"))
+
     def _check(self, value, which):
         crit = getattr(self.stop_criteria["TMD"], which)
         scale_prob = self.params.scale_prob
@@ -184,7 +514,7 @@ class SectionGrowerExponentialProba(SectionGrower):
             # no need to exponentiate, the comparison below automatically resolves to `True`
             return True
         # Check if close enough to exp( distance * scale_prob)
-        return self._rng.random() < np.exp(-x * scale_prob)
+        return self.sampler.uniform() < np.exp(-x * scale_prob)
 
     def check_stop(self):
         """Probabilities of bifurcating and stopping are proportional `exp(-distance * lambda)`."""
@@ -207,18 +537,34 @@ class SectionGrowerExponentialProba(SectionGrower):
         """Placeholder for any function."""
         raise NotImplementedError("Attempt to use abstract class")
 
+    def get_values(self, points, pathlengths):
+        """Placeholder for the vectorized version of :meth:`get_val` used for the given points."""
+        raise NotImplementedError("Attempt to use abstract class")
+
 
 class SectionGrowerTMD(SectionGrowerExponentialProba):
     """Class for the TMD section growth."""
 
+    __slots__ = ()
+
     def get_val(self):
         """Returns radial distance."""
         return norm(np.subtract(self.last_point, self.stop_criteria["TMD"].ref))
 
+    def get_values(self, points, pathlengths):
+        """Returns the radial distances of the given points."""
+        return vectorial_norm(np.subtract(points, self.stop_criteria["TMD"].ref), axis=1)
+
 
 class SectionGrowerPath(SectionGrowerExponentialProba):
     """Class for the TMD path based section growth."""
 
+    __slots__ = ()
+
     def get_val(self):
         """Returns path distance."""
         return self.pathlength
+
+    def get_values(self, points, pathlengths):
+        """Returns the path distances of the given points."""
+        return np.asarray(pathlengths)
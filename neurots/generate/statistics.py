@@ -0,0 +1,105 @@
+"""NeuroTS class: Growth statistics."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from contextlib import nullcontext
+from time import perf_counter
+
+
+class GrowthStatistics:
+    """Record the time spent in each phase of the growth of a cell and count its events.
+
+    The following phases are timed by the growers (in seconds):
+
+    * ``trunk_orientation``: computation of the trunk orientations and creation of the trees.
+    * ``soma``: build of the soma.
+    * ``section_stepping``: extension of the sections.
+    * ``bifurcation``: creation of the children sections.
+    * ``termination``: termination of the sections.
+    * ``build_morphology``: creation of the MorphIO morphology from the grown sections.
+    * ``post_grow``: actions performed after the growth.
+    * ``diametrization``: computation of the diameters.
+
+    And the following events are counted:
+
+    * ``steps``: calls to the ``extend()`` method of the growth algorithms.
+    * ``points``: points of the grown sections.
+    * ``sections``: grown sections.
+    * ``bifurcations``: bifurcations of the sections.
+    * ``terminations``: terminations of the sections.
+    * ``barcode_lookups``: searches of bars in the barcodes of the trees.
+
+    The growers only call the timers and the counters of the statistics that are ``enabled``, so
+    the growth of the cells that are not instrumented has no overhead.
+    """
+
+    __slots__ = ("timings", "counts")
+
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    @contextmanager
+    def timer(self, phase):
+        """Context manager adding the time spent in its block to the given phase."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, perf_counter() - start)
+
+    def add_time(self, phase, duration):
+        """Add a duration (in seconds) to the given phase."""
+        self.timings[phase] = self.timings.get(phase, 0.0) + duration
+
+    def count(self, event, number=1):
+        """Add a number of occurrences to the given event."""
+        self.counts[event] = self.counts.get(event, 0) + number
+
+    def to_dict(self):
+        """Return the timings and the counts as a dictionary."""
+        return {"timings": dict(self.timings), "counts": dict(self.counts)}
+
+
+class NullStatistics:
+    """Statistics that record nothing, used when the growers are not instrumented."""
+
+    __slots__ = ()
+
+    enabled = False
+
+    _CONTEXT = nullcontext()
+
+    def timer(self, phase):  # pylint: disable=unused-argument
+        """Return a context manager that does nothing."""
+        return self._CONTEXT
+
+    def add_time(self, phase, duration):
+        """Do nothing."""
+
+    def count(self, event, number=1):
+        """Do nothing."""
+
+    def to_dict(self):
+        """Return empty timings and counts."""
+        return {"timings": {}, "counts": {}}
+
+
+NULL_STATISTICS = NullStatistics()
+"""The statistics used by the growers that are not instrumented."""
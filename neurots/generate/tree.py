@@ -15,17 +15,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import copy
 import json
 import logging
+import warnings
 from collections import namedtuple
 
 import numpy as np
 from morphio import PointLevel
 from morphio import SectionType
+from morphio.mut import Morphology
 
 from neurots.generate.algorithms import basicgrower
 from neurots.generate.algorithms import tmdgrower
+from neurots.generate.algorithms.common import copy_stop_criteria
 from neurots.generate.section import SectionGrower
 from neurots.generate.section import SectionGrowerPath
 from neurots.generate.section import SectionGrowerTMD
@@ -57,7 +59,9 @@ section_growers = {
 
 # Section grower parameters
 SectionParameters = namedtuple(
-    "SectionParameters", ["randomness", "targeting", "scale_prob", "history"]
+    "SectionParameters",
+    ["randomness", "targeting", "scale_prob", "history", "analytic_stop"],
+    defaults=(False,),
 )
 
 
@@ -65,7 +69,8 @@ def _create_section_parameters(input_dict):
     """Create section parameters from input dictionary.
 
     Args:
-        input_dict (dict): Input dictionary with ``randomness`` and ``targeting`` entries.
+        input_dict (dict): Input dictionary with ``randomness`` and ``targeting`` entries (and
+            optionally a ``stop_sampling`` entry).
 
     Returns:
         SectionParameters: The section parameters.
@@ -75,7 +80,11 @@ def _create_section_parameters(input_dict):
     history = np.clip(1.0 - randomness - targeting, 0.0, 1.0)
 
     parameters = SectionParameters(
-        randomness=randomness, targeting=targeting, scale_prob=LAMBDA, history=history
+        randomness=randomness,
+        targeting=targeting,
+        scale_prob=LAMBDA,
+        history=history,
+        analytic_stop=input_dict.get("stop_sampling", "per_step") == "analytic",
     )
 
     try:
@@ -89,11 +98,45 @@ def _create_section_parameters(input_dict):
         raise NeuroTSError(msg) from err
 
 
+class _MorphologyAppender:
+    """Append the sections directly to a MorphIO morphology, as done before the builders existed.
+
+    Args:
+        morphology (morphio.mut.Morphology): The morphology to which the sections are appended.
+    """
+
+    def __init__(self, morphology):
+        self.morphology = morphology
+        self._sections = []
+
+    def append_section(self, points, section_type, parent=None):
+        """Append a section and return its ID.
+
+        See :meth:`neurots.generate.morphology_builder.MorphologyBuilder.append_section`.
+        """
+        points = np.asarray(points)
+        if parent is None:
+            append_fun = self.morphology.append_root_section
+        else:
+            append_fun = self._sections[parent].append_section
+        self._sections.append(
+            append_fun(
+                PointLevel(points[:, :3].tolist(), [DEFAULT_DIAMETER] * len(points)),
+                SectionType(section_type),
+            )
+        )
+        return len(self._sections) - 1
+
+
 class TreeGrower:
     """Tree class.
 
     Args:
-        neuron (morphio.mut.Morphology): The morphology in which groups and points are stored.
+        builder (neurots.generate.morphology_builder.MorphologyBuilder): The builder in which the
+            sections are stored during the growth (the morphology is built from it at the end of
+            the growth by :class:`neurots.generate.grower.NeuronGrower`). Passing a
+            ``morphio.mut.Morphology`` is deprecated: its sections are then appended directly to
+            it.
         initial_direction (list[float]): 3D vector that defines the starting direction of the tree.
         initial_point (list[float]): 3D vector that defines the starting point of the tree.
         parameters (dict): A dictionary with ``tree_type``, ``radius``, ``randomness`` and
@@ -101,20 +144,38 @@ class TreeGrower:
         distributions (dict): The distributions used.
         context (Any): The context used for the tree.
         random_generator (numpy.random.Generator): The random number generator to use.
+        random_block_size (int): If given, the random numbers used to grow the sections are drawn
+            by blocks of this size with a :class:`neurots.morphmath.sample.BlockSampler`, otherwise
+            they are drawn one by one from ``random_generator``.
+        statistics (neurots.generate.statistics.GrowthStatistics): The object in which the timings
+            and the counts of the growth are recorded (nothing is recorded by default).
+        barcode_templates (neurots.generate.algorithms.barcode.BarcodeTemplates): The barcode
+            templates of the persistence diagrams of the distributions, given to the growth
+            algorithm.
     """
 
     def __init__(
         self,
-        neuron,
+        builder,
         initial_direction,
         initial_point,
         parameters,
         distributions,
         context=None,
         random_generator=np.random,
+        random_block_size=None,
+        statistics=None,
+        barcode_templates=None,
     ):
         """Constructor of TreeGrower object."""
-        self.neuron = neuron
+        if isinstance(builder, Morphology):
+            warnings.warn(
+                "Passing a morphio.mut.Morphology to TreeGrower is deprecated, please pass a "
+                "neurots.generate.morphology_builder.MorphologyBuilder instead",
+                DeprecationWarning,
+            )
+            builder = _MorphologyAppender(builder)
+        self.builder = builder
         self.direction = initial_direction
         self.point = initial_point
         self.type = parameters["tree_type"]  # 2: axon, 3: basal, 4: apical, 5: other
@@ -123,10 +184,19 @@ class TreeGrower:
         self.active_sections = []
         self.context = context
         self._rng = random_generator
+        # The statistics are only kept if they record something, to skip them while stepping
+        self._statistics = statistics if statistics is not None and statistics.enabled else None
+        self._barcode_templates = barcode_templates
 
         # Creates the distribution from which the segment lengths
         # To sample a new seg_len call self.seg_len.draw()
         self.seg_length_distr = sample.Distr(self.params["step_size"], random_generator=self._rng)
+        if random_block_size is None:
+            self._sampler = sample.DirectSampler(self.seg_length_distr, self._rng)
+        else:
+            self._sampler = sample.BlockSampler(
+                self.params["step_size"], self._rng, block_size=random_block_size
+            )
         self._section_parameters = _create_section_parameters(parameters)
         self.growth_algo = self._initialize_algorithm()
 
@@ -140,6 +210,7 @@ class TreeGrower:
             start_point=self.point,
             context=self.context,
             random_generator=self._rng,
+            barcode_templates=self._barcode_templates,
         )
 
         stop, num_sec = growth_algo.initialize()
@@ -148,7 +219,7 @@ class TreeGrower:
             parent=None,
             direction=self.direction,
             first_point=list(self.point),
-            stop=copy.deepcopy(stop),
+            stop=stop,
             process="major",
             pathlength=0.0,
             children=2 if num_sec > 1 else 0,
@@ -166,7 +237,7 @@ class TreeGrower:
         The section is added to the neuron.sections and activated.
 
         Args:
-            parent (morphio.Section): The parent of the section.
+            parent (int): The ID of the parent of the section.
             direction (list[float]): The direction of the section.
             first_point (list[float]): The first point of the section.
             stop (dict):The stop criteria used for this section.
@@ -183,11 +254,12 @@ class TreeGrower:
             parameters=self._section_parameters,
             children=children,
             process=process,
-            stop_criteria=copy.deepcopy(stop),
+            stop_criteria=copy_stop_criteria(stop),
             step_size_distribution=self.seg_length_distr,
             pathlength=pathlength,
             context=self.context,
             random_generator=self._rng,
+            sampler=self._sampler,
         )
 
         self.active_sections.append(sec_grower)
@@ -209,33 +281,24 @@ class TreeGrower:
         return np.copy(secs)[ordered_list]
 
     def append_section(self, section):
-        """Append section to the MorphIO neuron.
+        """Append section to the morphology builder.
 
         Args:
             section (SectionGrowerPath): The section that is going to be appended.
 
         Returns:
-            section (morphio.Section): The new appended section.
+            int: The ID of the new appended section.
         """
-        if section.parent:
-            append_fun = section.parent.append_section
-        else:
-            append_fun = self.neuron.append_root_section
-
         if L.level == logging.DEBUG:  # pragma: no cover
             data = {
-                "parent": section.parent.id if section.parent else None,
-                "coord": np.vstack(section.points).tolist(),
+                "parent": section.parent,
+                "coord": section.points.data.tolist(),
                 "type": int(SectionType(self.params["tree_type"])),
             }
             L.debug("appended_data=%s", json.dumps(data))
 
-        return append_fun(
-            PointLevel(
-                np.array(section.points).tolist(),
-                [DEFAULT_DIAMETER] * len(section.points),
-            ),
-            SectionType(self.params["tree_type"]),
+        return self.builder.append_section(
+            section.points.data, int(SectionType(self.params["tree_type"])), parent=section.parent
         )
 
     def next_point(self):
@@ -247,6 +310,7 @@ class TreeGrower:
             # possible to order per bifurcation
             ordered_sections = np.copy(self.active_sections)
 
+        statistics = self._statistics
         for section_grower in ordered_sections:
             # the current section_grower is generated
             # In here the stop criterion can be modified accordingly
@@ -260,40 +324,75 @@ class TreeGrower:
             else:
                 _term = None
 
-            state = self.growth_algo.extend(section_grower)
+            if statistics is None:
+                state = self.growth_algo.extend(section_grower)
+            else:
+                with statistics.timer("section_stepping"):
+                    state = self.growth_algo.extend(section_grower)
+                statistics.count("steps")
 
             if _term is not None:
                 section_grower.stop_criteria["TMD"].term = _term
 
             if state != "continue":
-                section = self.append_section(section_grower)
-
-                if state == "bifurcate":
-                    # Save the final normed direction of parent
-                    latest = section_grower.latest_directions[-1]
-                    section_grower.id = section.id
-
-                    # we need this so that the path length matches due to the child.first_point()
-                    for other_section in self.active_sections:
-                        if other_section != section_grower:
-                            other_section.next()
-
-                    # the current section_grower bifurcates
-                    # Returns two section_grower dictionaries: (S1, S2)
-                    for child_section in self.growth_algo.bifurcate(section_grower):
-                        child = self.add_section(
-                            parent=section, pathlength=section_grower.pathlength, **child_section
-                        )
-                        # Copy the final normed direction of parent to all children
-                        child.latest_directions.append(latest)
-                        # Generate the first point of the section
-                        child.first_point()
-                    self.active_sections.remove(section_grower)
-
-                elif state == "terminate":
-                    # the current section_grower terminates
-                    self.growth_algo.terminate(section_grower)
-                    self.active_sections.remove(section_grower)
-
-                else:
-                    raise NeuroTSError(f"Unknown state during growth: {state}")  # pragma: no cover
+                self._stop_section(section_grower, state, statistics)
+
+    def _stop_section(self, section_grower, state, statistics):
+        """Bifurcate or terminate a section according to its state."""
+        section_id = self.append_section(section_grower)
+
+        if state == "bifurcate":
+            # Save the final normed direction of parent
+            latest = section_grower.latest_directions[-1]
+            section_grower.id = section_id
+
+            # we need this so that the path length matches due to the
+            # child.first_point()
+            if statistics is None:
+                self._step_other_sections(section_grower)
+                self._bifurcate(section_grower, section_id, latest)
+            else:
+                with statistics.timer("section_stepping"):
+                    self._step_other_sections(section_grower)
+                with statistics.timer("bifurcation"):
+                    self._bifurcate(section_grower, section_id, latest)
+                statistics.count("bifurcations")
+
+        elif state == "terminate":
+            if statistics is None:
+                self._terminate(section_grower)
+            else:
+                with statistics.timer("termination"):
+                    self._terminate(section_grower)
+                statistics.count("terminations")
+
+        else:
+            raise NeuroTSError(f"Unknown state during growth: {state}")  # pragma: no cover
+
+    def _step_other_sections(self, section_grower):
+        """Call the "next" method of the active sections other than the given one."""
+        for other_section in self.active_sections:
+            if other_section != section_grower:
+                other_section.next()
+
+    def _bifurcate(self, section_grower, section_id, latest):
+        """Create the children of a section and remove it from the active sections."""
+        # the current section_grower bifurcates
+        # Returns two section_grower dictionaries: (S1, S2)
+        for child_section in self.growth_algo.bifurcate(section_grower):
+            child = self.add_section(
+                parent=section_id,
+                pathlength=section_grower.pathlength,
+                **child_section,
+            )
+            # Copy the final normed direction of parent to all children
+            child.latest_directions.append(latest)
+            # Generate the first point of the section
+            child.first_point()
+        self.active_sections.remove(section_grower)
+
+    def _terminate(self, section_grower):
+        """Terminate a section and remove it from the active sections."""
+        # the current section_grower terminates
+        self.growth_algo.terminate(section_grower)
+        self.active_sections.remove(section_grower)
@@ -32,12 +32,23 @@ def random(random_generator=np.random):
     return (np.array(dir1), np.array(dir2))
 
 
+def _bif_angles(angles):
+    """Return the last dimension of the angles as numpy arrays (or scalars)."""
+    angles = np.asarray(angles)
+    return angles[..., 0], angles[..., 1], angles[..., 2], angles[..., 3]
+
+
 def symmetric(direction, angles):
-    """Get 3-d coordinates for two new directions at a selected angle."""
+    """Get 3-d coordinates for two new directions at a selected angle.
+
+    The direction can also be a (n, 3) stack of directions and the angles a (n, 4) stack of angles,
+    in which case the two (n, 3) stacks of new directions are returned.
+    """
     # phi0 = angles[0] #not used
     # theta0 = angles[1] #not used
-    phi1 = angles[2] / 2.0
-    theta1 = angles[3] / 2.0
+    _, _, phi1, theta1 = _bif_angles(angles)
+    phi1 = phi1 / 2.0
+    theta1 = theta1 / 2.0
 
     dir1 = rt.rotate_vector(direction, [0, 0, 1], phi1)
     dir1 = rt.rotate_vector(dir1, [1, 0, 0], theta1)
@@ -48,11 +59,12 @@ def symmetric(direction, angles):
 
 
 def bio_oriented(direction, angles):
-    """Input: init_phi, init_theta, dphi, dtheta."""
-    phi0 = angles[0]
-    theta0 = angles[1]
-    phi1 = angles[2]
-    theta1 = angles[3]
+    """Input: init_phi, init_theta, dphi, dtheta.
+
+    The direction can also be a (n, 3) stack of directions and the angles a (n, 4) stack of angles,
+    in which case the two (n, 3) stacks of new directions are returned.
+    """
+    phi0, theta0, phi1, theta1 = _bif_angles(angles)
 
     dir1 = rt.rotate_vector(direction, [0, 0, 1], phi0)
     dir1 = rt.rotate_vector(dir1, [1, 0, 0], theta0)
@@ -63,11 +75,14 @@ def bio_oriented(direction, angles):
 
 
 def directional(direction, angles):
-    """Input: init_phi, init_theta, dphi, dtheta."""
+    """Input: init_phi, init_theta, dphi, dtheta.
+
+    The direction can also be a (n, 3) stack of directions and the angles a (n, 4) stack of angles,
+    in which case the two (n, 3) stacks of new directions are returned.
+    """
     # phi0 = angles[0] #not used
     # theta0 = angles[1] #not used
-    phi1 = angles[2]
-    theta1 = angles[3]
+    _, _, phi1, theta1 = _bif_angles(angles)
 
     dir2 = rt.rotate_vector(direction, [0, 0, 1], phi1)
     dir2 = rt.rotate_vector(dir2, [1, 0, 0], theta1)
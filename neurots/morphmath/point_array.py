@@ -27,18 +27,29 @@ class DynamicPointArray:
     Args:
         initial_capacity (int): The initial capacity of the array.
         resize_factor (float): The factor used to increase the capacity of the array.
+        dtype (numpy.dtype): The type of the coordinates.
     """
 
-    def __init__(self, initial_capacity=100000, resize_factor=2.0):
+    __slots__ = ("_size", "_capacity", "_resize_factor", "_data")
+
+    def __init__(self, initial_capacity=100000, resize_factor=2.0, dtype=np.float32):
         self._size = 0
         self._capacity = initial_capacity
         self._resize_factor = resize_factor
-        self._data = np.empty((initial_capacity, 3), dtype=np.float32)
+        self._data = np.empty((initial_capacity, 3), dtype=dtype)
 
     def __len__(self):
         """Return the length of the array."""
         return self._size
 
+    def __getitem__(self, index):
+        """Return the point(s) at the given index."""
+        return self._data[: self._size][index]
+
+    def __setitem__(self, index, value):
+        """Set the point(s) at the given index."""
+        self._data[: self._size][index] = value
+
     @property
     def capacity(self):
         """Returns the current capacity of the array."""
@@ -61,3 +72,13 @@ class DynamicPointArray:
 
         self._data[self._size] = point
         self._size += 1
+
+    def extend(self, points):
+        """Append several points to the array."""
+        new_size = self._size + len(points)
+        if new_size > self._capacity:
+            self._capacity = max(int(self._resize_factor * self._capacity), new_size)
+            self._data = np.resize(self._data, (self._capacity, 3))
+
+        self._data[self._size : new_size] = points
+        self._size = new_size
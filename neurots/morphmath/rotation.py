@@ -41,8 +41,44 @@ def vector_from_spherical(phi, theta):
     return x, y, z
 
 
+def _is_batch(*vectors, angle=None):
+    """Check if some vectors are given as a (n, 3) stack or the angle as an array."""
+    return any(np.ndim(vect) > 1 for vect in vectors) or np.ndim(angle) > 0
+
+
+def _skew_matrices(vect):
+    """Return the skew-symmetric matrices of the cross products with a stack of vectors."""
+    x, y, z = vect[..., 0], vect[..., 1], vect[..., 2]
+    skew = np.zeros(vect.shape + (3,), dtype=float)
+    skew[..., 0, 1] = -z
+    skew[..., 0, 2] = y
+    skew[..., 1, 0] = z
+    skew[..., 1, 2] = -x
+    skew[..., 2, 0] = -y
+    skew[..., 2, 1] = x
+    return skew
+
+
+def _half_turn_matrices(vect):
+    """Return the rotation matrices of a half turn around an axis orthogonal to each vector."""
+    basis = np.eye(3)[np.argmin(np.abs(vect), axis=-1)]
+    axis = np.cross(vect, basis)
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    return 2 * axis[..., :, np.newaxis] * axis[..., np.newaxis, :] - np.eye(3)
+
+
 def rotation_around_axis(axis, angle):
-    """Return a normalized vector rotated around the selected axis by an angle."""
+    """Return a normalized vector rotated around the selected axis by an angle.
+
+    The axis can also be a (n, 3) stack of axes and/or the angle an array of n angles, in which
+    case a (n, 3, 3) stack of rotation matrices is returned.
+    """
+    if _is_batch(axis, angle=angle):
+        axis = np.asarray(axis, dtype=float)
+        skew = _skew_matrices(axis / np.linalg.norm(axis, axis=-1, keepdims=True))
+        angle = np.asarray(angle, dtype=float)[..., np.newaxis, np.newaxis]
+        return np.eye(3, dtype=float) + np.sin(angle) * skew + (1.0 - np.cos(angle)) * (skew @ skew)
+
     d = np.array(axis, dtype=float) / np.linalg.norm(axis)
 
     sn = np.sin(angle)
@@ -59,15 +95,30 @@ def rotation_around_axis(axis, angle):
 
 
 def angle3D(v1, v2):
-    """Return the angle between v1, v2."""
+    """Return the angle between v1, v2.
+
+    If v1 and/or v2 are (n, 3) stacks of vectors, the array of the n angles is returned.
+    """
     v1 = np.array(v1)
     v2 = np.array(v2)
 
+    if _is_batch(v1, v2):
+        return np.arccos(
+            np.einsum("...i,...i->...", v1, v2)
+            / (np.linalg.norm(v1, axis=-1) * np.linalg.norm(v2, axis=-1))
+        )
+
     return math.acos(v1.dot(v2) / (np.linalg.norm(v1) * np.linalg.norm(v2)))
 
 
 def rotate_vector(vec, axis, angle):
-    """Rotate the input vector vec by a selected angle around a specific axis."""
+    """Rotate the input vector vec by a selected angle around a specific axis.
+
+    The vector and the axis can also be (n, 3) stacks and the angle an array of n angles, in which
+    case the (n, 3) stack of the rotated vectors is returned.
+    """
+    if _is_batch(vec, axis, angle=angle):
+        return np.einsum("...ij,...j->...i", rotation_around_axis(axis, angle), vec)
     return np.dot(rotation_around_axis(axis, angle), vec)
 
 
@@ -78,18 +129,37 @@ def rotation_matrix_from_vectors(vec1, vec2):
     Picked from: https://stackoverflow.com/a/59204638/3868743
 
     Args:
-        vec1: A 3d "source" vector
-        vec2: A 3d "destination" vector
+        vec1: A 3d "source" vector (or a (n, 3) stack of vectors)
+        vec2: A 3d "destination" vector (or a (n, 3) stack of vectors)
 
     Returns:
-        A transform matrix (3x3) which when applied to vec1, aligns it with vec2.
+        A transform matrix (3x3) which when applied to vec1, aligns it with vec2 (or a (n, 3, 3)
+        stack of matrices). If the vectors are opposite, it is a half turn around an axis
+        orthogonal to them.
     """
+    if _is_batch(vec1, vec2):
+        vec1 = np.asarray(vec1, dtype=float)
+        vec2 = np.asarray(vec2, dtype=float)
+        vec1 = vec1 / np.linalg.norm(vec1, axis=-1, keepdims=True)
+        vec2 = vec2 / np.linalg.norm(vec2, axis=-1, keepdims=True)
+        v_cross = np.cross(vec1, vec2)
+        v_cross_norm_2 = np.einsum("...i,...i->...", v_cross, v_cross)
+        v_dot = np.einsum("...i,...i->...", vec1, vec2)
+        kmat = _skew_matrices(v_cross)
+        aligned = v_cross_norm_2 == 0
+        factor = (1 - v_dot) / np.where(aligned, 1, v_cross_norm_2)
+        rotations = np.eye(3) + kmat + (kmat @ kmat) * factor[..., np.newaxis, np.newaxis]
+        rotations[aligned] = np.eye(3)
+        opposite = aligned & (v_dot < 0)
+        rotations[opposite] = _half_turn_matrices(np.broadcast_to(vec1, v_cross.shape)[opposite])
+        return rotations
+
     vec1, vec2 = vec1 / np.linalg.norm(vec1), vec2 / np.linalg.norm(vec2)
 
     v_cross = np.cross(vec1, vec2)
     v_cross_norm = np.linalg.norm(v_cross)
     if v_cross_norm == 0:
-        return np.eye(3)
+        return np.eye(3) if np.dot(vec1, vec2) > 0 else _half_turn_matrices(vec1)
 
     kmat = np.array(
         [
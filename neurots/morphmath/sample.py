@@ -15,7 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
+
 import numpy as np
+from scipy.special import ndtr
+from scipy.special import ndtri
+
+from neurots.morphmath.utils import get_random_point
+
+# Below this probability of drawing a positive number, draw_positive() samples the truncated
+# distribution directly instead of rejecting the non-positive numbers
+MIN_ACCEPTANCE_RATE = 0.01
 
 
 class Distr:
@@ -53,29 +63,116 @@ class Distr:
         """Return a statistical distribution according to input parameters."""
         # If distribution is a statistical distribution
         if self.type != "data":
-            name, self.loc, self.scale = getattr(self, self.type)(params)
-            self.distribution = getattr(self._rng, name)
+            self._distribution_name, self.loc, self.scale = getattr(self, self.type)(params)
+            self.distribution = getattr(self._rng, self._distribution_name)
+            self._acceptance_rate = self._positive_probability()
         # If distribution consists of data we reformat input
         else:
             w = np.array(params["weights"], dtype=float)
             b = np.array(params["bins"])
             self.distribution = {"bins": b, "weights": w / np.sum(w)}
 
-    def draw(self):
-        """Return a sampled number."""
+            # Precompute the CDFs of the full and positive supports
+            positives = b > 0
+            self._cdf = self._compute_cdf(self.distribution["weights"])
+            self._positive_bins = b[positives]
+            self._positive_cdf = self._compute_cdf(self.distribution["weights"][positives])
+
+    def with_generator(self, random_generator):
+        """Return a copy of the distribution drawing its numbers from another generator.
+
+        The parameters and the precomputed CDFs are shared with the copy, so this is much cheaper
+        than building a new distribution.
+        """
+        distr = copy.copy(self)
+        distr._rng = random_generator  # pylint: disable=protected-access
+        if self.type != "data":
+            distr.distribution = getattr(random_generator, self._distribution_name)
+        return distr
+
+    @staticmethod
+    def _compute_cdf(weights):
+        """Compute the normalized CDF of the weights like :meth:`numpy.random.Generator.choice`."""
+        if len(weights) == 0:
+            return None
+        cdf = weights.cumsum()
+        cdf /= cdf[-1]
+        return cdf
+
+    def _draw_data(self, bins, cdf, size=None):
+        """Draw from the bins using the precomputed CDF.
+
+        The results are the same as the ones of ``choice(bins, size=size, p=weights)``.
+        """
+        if cdf is None:
+            raise ValueError("Can not draw from a 'data' distribution with no bin")
+        return bins[cdf.searchsorted(self._rng.random(size), side="right")]
+
+    def _positive_probability(self):
+        """Return the probability of drawing a positive number (only for positive scales)."""
+        if self.scale <= 0:
+            return 1.0
+        if self.type == "norm":
+            return float(ndtr(self.loc / self.scale))
+        if self.type == "expon":
+            return min(1.0, float(np.exp(self.loc / self.scale)))
+        return float(np.clip(1.0 + self.loc / self.scale, 0.0, 1.0))
+
+    def draw(self, size=None):
+        """Return a sampled number.
+
+        Args:
+            size (int): If given, an array of ``size`` numbers is returned. These numbers are the
+                same as the ones returned by ``size`` calls without size.
+        """
         if self.type == "data":
-            return self._rng.choice(self.distribution["bins"], p=self.distribution["weights"])
+            return self._draw_data(self.distribution["bins"], self._cdf, size)
 
+        if size is not None:
+            return self.loc + self.scale * self.distribution(size=size)
         return self.loc + self.scale * self.distribution()
 
-    def draw_positive(self):
-        """Return a positive sampled number."""
+    def _draw_truncated(self, size=None):
+        """Draw from the distribution truncated to its positive values.
+
+        The numbers are drawn by inverse transform sampling, so one uniform number is consumed per
+        returned number.
+        """
+        if self._acceptance_rate <= 0:
+            raise ValueError(f"The '{self.type}' distribution can not draw positive numbers")
+
+        # Uniform numbers in (0, 1]
+        uniforms = 1.0 - np.asarray(self._rng.random(size))
+        if self.type == "norm":
+            values = self.loc - self.scale * ndtri(uniforms * self._acceptance_rate)
+        elif self.type == "expon":
+            # The exponential distribution is memoryless
+            values = -self.scale * np.log(uniforms)
+        else:
+            values = (self.loc + self.scale) * uniforms
+        values = np.maximum(values, np.finfo(float).tiny)
+
+        if size is None:
+            return float(values)
+        return values
+
+    def draw_positive(self, size=None):
+        """Return a positive sampled number.
+
+        The non-positive numbers are rejected, unless the probability of drawing a positive number
+        is lower than :data:`MIN_ACCEPTANCE_RATE`, in which case the positive part of the
+        distribution is sampled directly.
+
+        Args:
+            size (int): If given, an array of ``size`` positive numbers is returned. These numbers
+                are the positive ones among the numbers drawn sequentially from the distribution,
+                so they do not depend on the size.
+        """
+        if size is not None:
+            return self._draw_positive_array(size)
+
         if self.type == "data":
-            positives = np.where(self.distribution["bins"] > 0)
-            return self._rng.choice(
-                self.distribution["bins"][positives],
-                p=self.distribution["weights"][positives],
-            )
+            return self._draw_data(self._positive_bins, self._positive_cdf)
 
         if self.scale == 0:
             if self.loc >= 0:
@@ -86,11 +183,32 @@ class Distr:
                     f"{self.scale})"
                 )
 
+        if self._acceptance_rate < MIN_ACCEPTANCE_RATE:
+            return self._draw_truncated()
+
         val = self.loc + self.scale * self.distribution()
         while val <= 0:
             val = self.loc + self.scale * self.distribution()
         return val
 
+    def _draw_positive_array(self, size):
+        """Return an array of positive sampled numbers."""
+        if self.type == "data":
+            return self._draw_data(self._positive_bins, self._positive_cdf, size)
+
+        if self.scale == 0:
+            return np.full(size, self.draw_positive(), dtype=float)
+
+        if self._acceptance_rate < MIN_ACCEPTANCE_RATE:
+            return self._draw_truncated(size)
+
+        values = self.loc + self.scale * self.distribution(size=size)
+        values = values[values > 0]
+        while len(values) < size:
+            new_values = self.loc + self.scale * self.distribution(size=size - len(values))
+            values = np.concatenate([values, new_values[new_values > 0]])
+        return values
+
 
 def d_transform(distr, funct, **kwargs):
     """Transform a distribution according to a selected function."""
@@ -103,41 +221,104 @@ def d_transform(distr, funct, **kwargs):
     return transf
 
 
-def soma_size(distrib, random_generator=np.random):
-    """Return a random soma radius as sampled from a distribution plus some constraints."""
-    soma_d = Distr(distrib["soma"]["size"], random_generator)
-    return soma_d.draw_positive()
+class DistrCache:
+    """Build the :class:`Distr` objects of the input distributions only once.
+
+    The objects are built the first time each distribution is used and are then only bound to the
+    random number generators given later (see :meth:`Distr.with_generator`), so the distributions
+    must not be modified once they are used.
+    """
+
+    def __init__(self):
+        self._distrs = {}
+
+    def __getstate__(self):
+        """Do not copy the distributions since they are indexed by the IDs of their parameters."""
+        return {"_distrs": {}}
+
+    def get(self, params, random_generator=np.random, transform=None):
+        """Return the distribution built from the given parameters.
+
+        Args:
+            params (dict): The parameters of the distribution.
+            random_generator (numpy.random.Generator): The random number generator to use.
+            transform (Callable): If given, the parameters are transformed with this function (see
+                :func:`d_transform`).
+        """
+        key = (id(params), transform)
+        cached = self._distrs.get(key)
+        # The parameters are stored with the distribution so their ID can not be reused
+        if cached is None or cached[0] is not params:
+            cached = (params, _build_distr(params, np.random, transform))
+            self._distrs[key] = cached
+        return cached[1].with_generator(random_generator)
+
 
+def _build_distr(params, random_generator, transform):
+    """Build a distribution from optionally transformed parameters."""
+    if transform is not None:
+        params = d_transform(params, transform)
+    return Distr(params, random_generator)
 
-def n_neurites(distrib, random_generator=np.random):
+
+def get_distr(params, random_generator=np.random, distr_cache=None, transform=None):
+    """Return the distribution built from the given parameters.
+
+    Args:
+        params (dict): The parameters of the distribution.
+        random_generator (numpy.random.Generator): The random number generator to use.
+        distr_cache (DistrCache): If given, the distribution is only built the first time.
+        transform (Callable): If given, the parameters are transformed with this function (see
+            :func:`d_transform`).
+    """
+    if distr_cache is None:
+        return _build_distr(params, random_generator, transform)
+    return distr_cache.get(params, random_generator, transform)
+
+
+def soma_size(distrib, random_generator=np.random, size=None, distr_cache=None):
+    """Return a random soma radius as sampled from a distribution plus some constraints.
+
+    If ``size`` is given, an array of ``size`` radii is returned. If ``distr_cache`` is given, the
+    distribution is taken from this :class:`DistrCache`.
+    """
+    soma_d = get_distr(distrib["soma"]["size"], random_generator, distr_cache)
+    return soma_d.draw_positive(size)
+
+
+def n_neurites(distrib, random_generator=np.random, size=None, distr_cache=None):
     """Return a number of neurites as sampled from a distribution plus some constraints.
 
-    It ensures the number will be an INT.
+    It ensures the number will be an INT. If ``size`` is given, an array of ``size`` numbers is
+    returned. If ``distr_cache`` is given, the distribution is taken from this :class:`DistrCache`.
     """
-    neurites_d = Distr(distrib, random_generator)
+    neurites_d = get_distr(distrib, random_generator, distr_cache)
+    if size is not None:
+        return neurites_d.draw(size).astype(int)
     numtrees = int(neurites_d.draw())
     return numtrees
 
 
-def trunk_angles(distrib, N, random_generator=np.random):
+def trunk_angles(distrib, N, random_generator=np.random, distr_cache=None):
     """Return N relative angles, depending on the input distribution."""
-    trunks_d = Distr(distrib["trunk"]["orientation_deviation"], random_generator)
-    angles = [trunks_d.draw() for _ in range(N - 1)]
+    trunks_d = get_distr(distrib["trunk"]["orientation_deviation"], random_generator, distr_cache)
+    angles = trunks_d.draw(max(N - 1, 0)).tolist()
     angles = angles + [sum(angles)]
     return angles
 
 
-def trunk_absolute_angles(distrib, N, random_generator=np.random):
+def trunk_absolute_angles(distrib, N, random_generator=np.random, distr_cache=None):
     """Return N absolute angles, depending on the input distribution."""
-    trunks_d = Distr(distrib["trunk"]["absolute_elevation_deviation"], random_generator)
-    return [trunks_d.draw() for _ in range(N)]
+    trunks_d = get_distr(
+        distrib["trunk"]["absolute_elevation_deviation"], random_generator, distr_cache
+    )
+    return trunks_d.draw(N).tolist()
 
 
-def azimuth_angles(distrib, N, random_generator=np.random):
+def azimuth_angles(distrib, N, random_generator=np.random, distr_cache=None):
     """Return N azimuth angles, depending on the input distribution."""
-    trunks_d = Distr(d_transform(distrib["trunk"]["azimuth"], np.cos), random_generator)
-    tmp = np.array([trunks_d.draw() for _ in range(N)])
-    angles = np.arccos(tmp)
+    trunks_d = get_distr(distrib["trunk"]["azimuth"], random_generator, distr_cache, np.cos)
+    angles = np.arccos(trunks_d.draw(N))
     return angles
 
 
@@ -155,3 +336,161 @@ def sample_spherical_unit_vectors(rng):
     """
     x = rng.normal(0, 1, 3)
     return x / np.linalg.norm(x)
+
+
+class DirectSampler:
+    """Draw the random numbers used to grow sections one by one.
+
+    Args:
+        step_size_distribution (Distr): The step size distribution.
+        random_generator (numpy.random.Generator): The random number generator to use.
+    """
+
+    __slots__ = ("_step_size_distribution", "_rng")
+
+    def __init__(self, step_size_distribution, random_generator=np.random):
+        self._step_size_distribution = step_size_distribution
+        self._rng = random_generator
+
+    def random_direction(self):
+        """Return a random unit vector."""
+        return get_random_point(random_generator=self._rng)
+
+    def random_directions(self, size):
+        """Return an array of random unit vectors.
+
+        The vectors follow the same distribution as the ones returned by :meth:`random_direction`
+        but all the azimuths are drawn before the elevations.
+        """
+        phi = self._rng.uniform(0.0, 2.0 * np.pi, size=size)
+        theta = np.arccos(self._rng.uniform(-1.0, 1.0, size=size))
+        sn_theta = np.sin(theta)
+        return np.column_stack([np.cos(phi) * sn_theta, np.sin(phi) * sn_theta, np.cos(theta)])
+
+    def step_length(self):
+        """Return a positive step length."""
+        return self._step_size_distribution.draw_positive()
+
+    def step_lengths(self, size):
+        """Return an array of positive step lengths."""
+        return np.asarray(self._step_size_distribution.draw_positive(size), dtype=float)
+
+    def uniform(self):
+        """Return a number drawn uniformly in [0, 1)."""
+        return self._rng.random()
+
+
+class BlockSampler:
+    """Draw the random numbers used to grow sections by blocks.
+
+    A seed is drawn from the given random number generator when the sampler is created. Four
+    independent streams are spawned from this seed using :class:`numpy.random.SeedSequence`: the
+    azimuths and the cosines of the elevations of the random directions (combined as in
+    :func:`neurots.morphmath.utils.get_random_point`), the step lengths (only the positive values
+    are kept) and the uniform numbers. Each stream is consumed by blocks of ``block_size`` values
+    but the values are returned in the order they are drawn, so the results only depend on the
+    state of the given random number generator, not on the block size.
+
+    Args:
+        step_size (dict): The parameters of the step size distribution.
+        random_generator (numpy.random.Generator): The random number generator used to draw the
+            seed.
+        block_size (int): The number of values drawn at once in each stream.
+    """
+
+    __slots__ = (
+        "block_size",
+        "_azimuth_rng",
+        "_cosine_rng",
+        "_uniform_rng",
+        "_step_size_distribution",
+        "_directions",
+        "_direction_index",
+        "_step_lengths",
+        "_uniforms",
+    )
+
+    def __init__(self, step_size, random_generator=np.random, block_size=4096):
+        if isinstance(random_generator, np.random.Generator):
+            seed = random_generator.integers(np.iinfo(np.int64).max)
+        else:
+            seed = random_generator.randint(np.iinfo(np.int64).max, dtype=np.int64)
+        azimuth_seed, cosine_seed, step_seed, uniform_seed = np.random.SeedSequence(
+            int(seed)
+        ).spawn(4)
+
+        self.block_size = block_size
+        self._azimuth_rng = np.random.default_rng(azimuth_seed)
+        self._cosine_rng = np.random.default_rng(cosine_seed)
+        self._uniform_rng = np.random.default_rng(uniform_seed)
+        self._step_size_distribution = Distr(step_size, np.random.default_rng(step_seed))
+        self._directions = np.empty((0, 3))
+        self._direction_index = 0
+        self._step_lengths = []
+        self._uniforms = []
+
+    def _draw_directions(self):
+        """Draw a new block of random unit vectors."""
+        phi = self._azimuth_rng.uniform(0.0, 2.0 * np.pi, size=self.block_size)
+        theta = np.arccos(self._cosine_rng.uniform(-1.0, 1.0, size=self.block_size))
+        sn_theta = np.sin(theta)
+        self._directions = np.column_stack(
+            [np.cos(phi) * sn_theta, np.sin(phi) * sn_theta, np.cos(theta)]
+        )
+        self._direction_index = 0
+
+    def _draw_step_lengths(self):
+        """Draw a new block of step lengths."""
+        # The values are reversed so they can be popped from the end of the list
+        step_lengths = self._step_size_distribution.draw_positive(self.block_size)
+        self._step_lengths = step_lengths[::-1].tolist()
+
+    def random_direction(self):
+        """Return a random unit vector."""
+        if self._direction_index == len(self._directions):
+            self._draw_directions()
+        direction = self._directions[self._direction_index]
+        self._direction_index += 1
+        return direction
+
+    def random_directions(self, size):
+        """Return an array of random unit vectors.
+
+        The vectors are the same as the ones returned by ``size`` calls to
+        :meth:`random_direction`.
+        """
+        chunks = [np.empty((0, 3))]
+        while size > 0:
+            if self._direction_index == len(self._directions):
+                self._draw_directions()
+            chunk = self._directions[self._direction_index : self._direction_index + size]
+            self._direction_index += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return np.concatenate(chunks)
+
+    def step_length(self):
+        """Return a positive step length."""
+        if not self._step_lengths:
+            self._draw_step_lengths()
+        return self._step_lengths.pop()
+
+    def step_lengths(self, size):
+        """Return an array of positive step lengths.
+
+        The lengths are the same as the ones returned by ``size`` calls to :meth:`step_length`.
+        """
+        values = []
+        while len(values) < size:
+            if not self._step_lengths:
+                self._draw_step_lengths()
+            n = min(size - len(values), len(self._step_lengths))
+            values.extend(self._step_lengths[: -n - 1 : -1])
+            del self._step_lengths[-n:]
+        return np.array(values, dtype=float)
+
+    def uniform(self):
+        """Return a number drawn uniformly in [0, 1)."""
+        if not self._uniforms:
+            self._uniforms = self._uniform_rng.random(self.block_size).tolist()[::-1]
+        return self._uniforms.pop()
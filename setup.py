@@ -21,6 +21,7 @@ from setuptools import find_namespace_packages
 from setuptools import setup
 
 reqs = [
+    "h5py>=3",
     "jsonschema>=3.0.1",
     "importlib-resources>=5; python_version < '3.9'",
     "matplotlib>=3.4",
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 # pylint: disable=missing-function-docstring
+import copy
 import json
 import os
 
@@ -23,6 +24,7 @@ import numpy as np
 from numpy.testing import assert_array_almost_equal
 from numpy.testing import assert_equal
 
+from neurots.generate.algorithms.barcode import BarcodeTemplates
 from neurots.generate.algorithms.basicgrower import TrunkAlgo
 from neurots.generate.algorithms.common import TMDStop
 from neurots.generate.algorithms.tmdgrower import TMDAlgo
@@ -226,6 +228,49 @@ def test_TMDAlgo_modify():
     )
 
 
+def test_TMDAlgo_modify_in_place():
+    def double_in_place(ph, context):
+        # pylint: disable=unused-argument
+        for tmd_bar in ph:
+            tmd_bar[0] *= 2
+            tmd_bar[1] *= 2
+        return ph
+
+    with open(os.path.join(_PATH, "dummy_distribution.json"), encoding="utf-8") as f:
+        distributions = json.load(f)["basal_dendrite"]
+    with open(os.path.join(_PATH, "dummy_params.json"), encoding="utf-8") as f:
+        parameters = json.load(f)["basal_dendrite"]
+    parameters["modify"] = {"funct": double_in_place, "kwargs": {}}
+    expected_distributions = copy.deepcopy(distributions)
+    templates = BarcodeTemplates(distributions["persistence_diagram"])
+
+    # The input diagrams are neither modified nor used as templates, so each tree gets the
+    # diagram modified once
+    for _ in range(3):
+        algo = TMDAlgo(
+            distributions, parameters, [0, 0, 0], random_generator=np.random.default_rng(0)
+        )
+        expected = TMDAlgo(
+            copy.deepcopy(expected_distributions),
+            parameters,
+            [0, 0, 0],
+            random_generator=np.random.default_rng(0),
+        )
+        assert algo.barcode.bifs == expected.barcode.bifs
+        assert algo.barcode.terms == expected.barcode.terms
+        assert distributions == expected_distributions
+        algo = TMDAlgo(
+            distributions,
+            parameters,
+            [0, 0, 0],
+            random_generator=np.random.default_rng(0),
+            barcode_templates=templates,
+        )
+        assert algo.barcode.bifs == expected.barcode.bifs
+        assert algo.barcode.terms == expected.barcode.terms
+        assert distributions == expected_distributions
+
+
 def test_TMDApicalAlgo():
     algo, grower = _setup_test(TMDApicalAlgo, SectionGrowerPath)
 
@@ -19,14 +19,18 @@
 # pylint: disable=no-member
 # pylint: disable=redefined-outer-name
 import copy
+import logging
 import os
 
 import morphio
 import numpy as np
 import pytest
+from diameter_synthesis import build_diameters
 from morphio import SectionType
 from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
 from numpy.testing import assert_equal
+from scipy.stats import chisquare
 
 from neurots.generate import diametrizer
 
@@ -309,14 +313,23 @@ def test_diametrize_from_tips_axon(neu3):
 def test_redefine_diameter_section(neu1):
     section = neu1.root_sections[0]
     assert_equal(section.diameters[0], 4)
-    diametrizer.redefine_diameter_section(section, 0, 999)
+    with pytest.warns(DeprecationWarning, match="'redefine_diameter_section' function"):
+        diametrizer.redefine_diameter_section(section, 0, 999)
     assert_equal(section.diameters[0], 999)
 
     section.points = np.array([[0, 1, 2]])
-    with pytest.raises(Exception):
+    with pytest.raises(Exception), pytest.warns(DeprecationWarning):
         diametrizer.redefine_diameter_section(section, 1, 2)
 
 
+def test_merger(neu1):
+    section = neu1.root_sections[0]
+    with pytest.warns(DeprecationWarning, match="'merger' function"):
+        diametrizer.merger(section, 10, 2)
+    children = [child.diameters[1] for child in section.children]
+    assert_array_almost_equal(section.diameters[-1], np.sqrt(np.sum(np.square(children))))
+
+
 def test_build_uniform(neu2):
     diametrizer.build(neu2, diam_method="uniform", diam_params={"basal_dendrite": 10})
     for sec in neu2.sections.values():
@@ -443,3 +456,255 @@ def test_build_unknown_model(neu1):
 def test_build_empty_model(neu1):
     with pytest.raises(ValueError):
         diametrizer.build(neu1, None, None, object())
+
+
+def test_block_sampler():
+    # pylint: disable=protected-access
+    # Use a small block to test the refills
+    rng = np.random.default_rng(5)
+    sampler = diametrizer._BlockSampler(rng, block_size=16)
+    values = [sampler.choice(range(7)) for _ in range(40)]
+
+    # The indices of each length of sequence are drawn by blocks
+    other_values = [sampler.choice("abc") for _ in range(5)]
+    expected_rng = np.random.default_rng(5)
+    expected = np.concatenate([expected_rng.integers(0, 7, 16) for _ in range(3)])
+    assert values == expected[:40].tolist()
+    assert other_values == ["abc"[i] for i in expected_rng.integers(0, 3, 16)[:5]]
+    assert [sampler.choice(range(7)) for _ in range(8)] == expected[40:].tolist()
+
+    # The values are uniformly sampled
+    for size in [1, 2, 1000, 5_000_000_000]:
+        values = np.array([sampler.choice(range(size)) for _ in range(300)])
+        assert ((values >= 0) & (values < size)).all()
+    values = [sampler.choice(range(7)) for _ in range(7000)]
+    assert chisquare(np.bincount(values, minlength=7)).pvalue > 0.01
+
+    with pytest.raises(ValueError):
+        sampler.choice([])
+
+
+def test_optional_arguments():
+    # pylint: disable=protected-access
+    def diam_method(neuron, tree_type, random_generator):
+        # pylint: disable=unused-argument
+        pass
+
+    assert diametrizer._optional_arguments(diametrizer.diametrize_from_root) == (
+        "model_params",
+        "random_generator",
+    )
+    assert diametrizer._optional_arguments(diametrizer.diametrize_uniform) == ("diam_params",)
+    assert diametrizer._optional_arguments(diam_method) == ("random_generator",)
+
+
+@pytest.mark.parametrize("diam_method", ["M1", "M4", "M5"])
+def test_build_population(diam_method):
+    # pylint: disable=protected-access
+    model = copy.deepcopy(MODEL)
+    model["basal_dendrite"]["taper"] = [0.1, 0.05, 0.2]
+    model["basal_dendrite"]["term"] = [0.6, 0.5]
+
+    # The values of the M4 and M5 models are sampled by blocks
+    rng = np.random.default_rng(0)
+    random_generator = rng if diam_method == "M1" else diametrizer._BlockSampler(rng)
+    expected = [morphio.mut.Morphology(NEU_PATH1) for _ in range(10)]
+    for neuron in expected:
+        diametrizer.build(neuron, model, diam_method=diam_method, random_generator=random_generator)
+    expected_state = rng.bit_generator.state
+
+    rng = np.random.default_rng(0)
+    population = [morphio.mut.Morphology(NEU_PATH1) for _ in range(10)]
+    diametrizer.build_population(population, model, diam_method=diam_method, random_generator=rng)
+    assert rng.bit_generator.state == expected_state
+    for neuron, expected_neuron in zip(population, expected):
+        assert_array_equal(
+            morphio.Morphology(neuron).diameters, morphio.Morphology(expected_neuron).diameters
+        )
+
+    # All the values of the model are sampled, from the trunks with M4 and from the tips with M5
+    if diam_method == "M4":
+        sampled = {
+            section.diameters[0]
+            for neuron in population
+            for section in neuron.root_sections
+            if section.type == SectionType.basal_dendrite
+        }
+        assert sampled == set(np.float32(model["basal_dendrite"]["trunk"]))
+    elif diam_method == "M5":
+        sampled = {
+            section.diameters[-1]
+            for neuron in population
+            for section in neuron.iter()
+            if section.type == SectionType.basal_dendrite and not section.children
+        }
+        assert sampled == set(np.float32(model["basal_dendrite"]["term"]))
+
+
+def test_build_population_diam_method():
+    calls = []
+
+    def diam_method(neuron, tree_type, diam_params):
+        calls.append((neuron, tree_type, diam_params))
+
+    population = [morphio.mut.Morphology(NEU_PATH2) for _ in range(2)]
+    diametrizer.build_population(
+        population,
+        neurite_types=["basal_dendrite"],
+        diam_method=diam_method,
+        diam_params={"a": 1},
+    )
+    assert calls == [(neuron, SectionType.basal_dendrite, {"a": 1}) for neuron in population]
+
+    with pytest.raises(KeyError):
+        diametrizer.build_population(population, diam_method="UNKNOWN")
+
+
+def test_default_diameter_model():
+    model_params = {"basal_dendrite": [1.0, 2.0, -0.5], "axon": [0.5, 1.0], "method": "default"}
+    diam_params = {"method": "default"}
+    expected_params = copy.deepcopy(model_params)
+    expected_diam_params = copy.deepcopy(diam_params)
+
+    for path, neurite_types in [
+        (NEU_PATH1, ["basal_dendrite"]),
+        (NEU_PATH3, ["basal_dendrite", "axon"]),
+        (NEU_PATH2, ["basal_dendrite", "apical_dendrite"]),
+    ]:
+        model = diametrizer.DefaultDiameterModel(model_params, diam_params, neurite_types)
+        neuron = morphio.mut.Morphology(path)
+        model(neuron, apical_point_sec_ids=[0], random_generator=np.random.default_rng(0))
+
+        # Same diameters as the simpler model of diameter-synthesis
+        expected = morphio.mut.Morphology(path)
+        build_diameters.build(expected, neurite_types, model_params, {"models": ["simpler"]})
+        assert_array_equal(
+            morphio.Morphology(neuron).diameters, morphio.Morphology(expected).diameters
+        )
+
+    assert model.diam_params == {"method": "default", "models": ["simpler"]}
+    assert model_params == expected_params
+    assert diam_params == expected_diam_params
+
+    # The neurite types of the parameters are used first
+    model = diametrizer.DefaultDiameterModel(
+        model_params, {"neurite_types": ["axon"]}, ["basal_dendrite"]
+    )
+    assert model.neurite_types == [SectionType.axon]
+
+    # A null neurite types entry is ignored, as in the generic diametrizer path
+    model = diametrizer.DefaultDiameterModel(
+        model_params, {"neurite_types": None}, ["basal_dendrite"]
+    )
+    assert model.neurite_types == [SectionType.basal_dendrite]
+
+
+def test_default_diameter_model_arguments(monkeypatch, caplog):
+    calls = []
+    monkeypatch.setattr(diametrizer.build_diameters, "build", lambda *args: calls.append(args))
+    model_params = {"basal_dendrite": [1.0, 2.0], "apical_dendrite": [1.0], "method": "default"}
+    diam_params = {"models": ["generic"], "seed": 1}
+    with caplog.at_level(logging.WARNING):
+        model = diametrizer.DefaultDiameterModel(model_params, diam_params)
+    assert "the ['generic'] models are ignored" in caplog.text
+    assert diam_params == {"models": ["generic"], "seed": 1}
+
+    # The apical points and the generator are given to diameter-synthesis for each neurite type
+    rng = np.random.default_rng(0)
+    model("neuron", apical_point_sec_ids=[3], random_generator=rng)
+    assert calls == [
+        (
+            "neuron",
+            neurite_type,
+            {**model_params, "apical_point_sec_ids": [3]},
+            {"models": ["simpler"], "seed": 1},
+            rng,
+        )
+        for neurite_type in [SectionType.apical_dendrite, SectionType.basal_dendrite]
+    ]
+    assert model.model_params == model_params
+
+
+def _sequential_taper(initial_diam, steps, min_diam, max_diam):
+    diams = [initial_diam]
+    for step in steps:
+        new_diam = diams[-1] - step
+        if new_diam >= max_diam:
+            diams.append(max_diam)
+        elif new_diam <= min_diam:
+            diams.append(min_diam)
+        else:
+            diams.append(new_diam)
+    return diams
+
+
+def test_taper():
+    # pylint: disable=protected-access
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        initial_diam = rng.uniform(0, 5)
+        min_diam, max_diam = np.sort(rng.uniform(0, 5, size=2))
+        steps = rng.uniform(0, 0.5, size=rng.integers(0, 20)) * rng.choice([-1, 1])
+        assert_array_almost_equal(
+            diametrizer._taper(initial_diam, steps, min_diam, max_diam),
+            _sequential_taper(initial_diam, steps, min_diam, max_diam),
+        )
+
+
+def test_neurite_arrays(neu1):
+    # pylint: disable=protected-access
+    neurite = diametrizer._NeuriteArrays(neu1.root_sections[0])
+    sections = list(neu1.root_sections[0].iter())
+    assert_equal(neurite.parents, [-1, 0, 0])
+    assert neurite.children == [[1, 2], [], []]
+    assert_equal(neurite.offsets, np.cumsum([0] + [len(sec.points) for sec in sections]))
+    for i, sec in enumerate(sections):
+        assert_array_almost_equal(
+            neurite.section_lengths(i), diametrizer.section_lengths(sec), decimal=5
+        )
+        assert_equal(neurite.diameters[neurite.section_slice(i)], sec.diameters)
+
+    neurite.diameters[:] = np.arange(len(neurite.diameters))
+    neurite.connect_children()
+    neurite.write()
+    assert_equal(sections[1].diameters[0], sections[0].diameters[-1])
+    assert_equal(sections[2].diameters[1:], np.arange(14, 19))
+
+
+def _binary_tree(depth):
+    neuron = morphio.mut.Morphology()
+    sections = [
+        neuron.append_root_section(
+            morphio.PointLevel([[0, 0, 0], [0, 1, 0], [0, 2, 0]], [1, 1, 1]),
+            SectionType.basal_dendrite,
+        )
+    ]
+    for _ in range(depth):
+        parents, sections = sections, []
+        for parent in parents:
+            start = parent.points[-1]
+            for direction in [[1, 1, 0], [-1, 1, 0]]:
+                points = [start, start + direction, start + 2 * np.array(direction)]
+                sections.append(parent.append_section(morphio.PointLevel(points, [1, 1, 1])))
+    return neuron
+
+
+def test_diametrize_from_tips_large_tree():
+    neuron = _binary_tree(10)
+    model = copy.deepcopy(MODEL)
+    model["basal_dendrite"]["trunk"] = [3.0]
+    diametrizer.diametrize_from_tips(neuron, model_params=model)
+    rall_ratio = model["basal_dendrite"]["Rall_ratio"]
+    for section in neuron.iter():
+        if section.children:
+            # The diameters are merged from the tips to the root with the Rall law, unless the
+            # merged diameter is larger than the trunk one
+            children_diams = [child.diameters[1] for child in section.children]
+            expected = np.sum(np.power(children_diams, rall_ratio)) ** (1.0 / rall_ratio)
+            if expected > 3.0:
+                expected = max(children_diams)
+            assert section.diameters[-1] == pytest.approx(expected, rel=1e-6)
+            for child in section.children:
+                assert child.diameters[0] == section.diameters[-1]
+        else:
+            assert section.diameters[-1] == pytest.approx(0.6)
@@ -20,10 +20,13 @@
 import numpy as np
 import pytest
 from numpy.testing import assert_array_almost_equal
+from scipy.stats import ks_2samp
 
 from neurots.generate import section
 from neurots.generate.algorithms.common import TMDStop
+from neurots.generate.tree import SectionParameters
 from neurots.morphmath import sample
+from neurots.utils import NeuroTSError
 
 EXPECTED_WEIGHTS = np.array([0.01831564, 0.04978707, 0.13533528, 0.36787944, 1.0])
 
@@ -96,3 +99,184 @@ def test_history(SEG_LEN):
     assert_array_almost_equal(s.history(), np.array([0.0, 0.34525776, 0.9385079]))
     s.latest_directions = np.array([[0.0, 0.0, 0.00000001]])
     assert_array_almost_equal(s.history(), np.array([0.0e00, 0.0e00, 1.0e-08]))
+
+
+def test_direction_history():
+    rng = np.random.default_rng(0)
+    directions = rng.normal(size=(12, 3))
+
+    history = section.DirectionHistory(directions[:2])
+    assert len(history) == 2
+    assert_array_almost_equal(history[0], directions[0])
+    assert_array_almost_equal(history[-1], directions[1])
+    with pytest.raises(IndexError):
+        history[2]  # pylint: disable=pointless-statement
+
+    # The running weighted sum matches the sum of the MEMORY last directions
+    for num, direction in enumerate(directions[2:], start=3):
+        history.append(direction)
+        latest = directions[max(0, num - section.MEMORY) : num]
+        assert len(history) == len(latest)
+        assert_array_almost_equal(history, latest)
+        assert_array_almost_equal(
+            history.weighted_sum, np.dot(section.WEIGHTS[section.MEMORY - len(latest) :], latest)
+        )
+
+
+def test_SectionGrower_storage(SEG_LEN):
+    s = section.SectionGrowerPath(
+        None, None, [0.0, 0.0, 0.0], [0.0, 1.0, 0.0], 0.0, 0.0, None, None, SEG_LEN, 0.0
+    )
+    assert not hasattr(s, "__dict__")
+
+    for num in range(100):
+        s.points.append([num, 0.0, 0.0])
+    assert len(s.points) == 101
+    assert s.points.data.dtype == np.float64
+    assert_array_almost_equal(s.last_point, [99.0, 0.0, 0.0])
+
+    s.latest_directions = [[0.0, 1.0, 0.0]]
+    assert isinstance(s.latest_directions, section.DirectionHistory)
+
+
+@pytest.mark.parametrize("num_seg", [1, 2, 50])
+def test_SectionGrower_next_all(num_seg):
+    parameters = SectionParameters(randomness=0.3, targeting=0.5, scale_prob=1.0, history=0.2)
+    step_size = {"norm": {"mean": 1.0, "std": 0.2}}
+
+    sections = []
+    for block_size in [7, 100]:
+        sampler = sample.BlockSampler(step_size, np.random.default_rng(0), block_size=block_size)
+        s = section.SectionGrower(
+            None,
+            0,
+            [1.0, 2.0, 3.0],
+            [0.0, 1.0, 0.0],
+            parameters,
+            "major",
+            {"num_seg": num_seg},
+            None,
+            0.0,
+            sampler=sampler,
+        )
+        s.latest_directions.append([1.0, 0.0, 0.0])
+        s.first_point()
+        sections.append(s)
+
+    # Grow the same section point by point and at once
+    states = [sections[0].next()]
+    while states[-1] == "continue":
+        states.append(sections[0].next())
+    assert sections[1].next_all() == states[-1] == "terminate"
+
+    assert len(sections[1].points) == len(sections[0].points) == max(num_seg, 3)
+    np.testing.assert_allclose(sections[1].points.data, sections[0].points.data)
+    np.testing.assert_allclose(sections[1].pathlength, sections[0].pathlength)
+    np.testing.assert_allclose(
+        sections[1].latest_directions.weighted_sum, sections[0].latest_directions.weighted_sum
+    )
+
+
+def _grow_sections(grower_class, analytic_stop, n_sections, seed, new_bif_after=None):
+    """Grow sections until they stop and return their states and their last values.
+
+    If ``new_bif_after`` is given, the bifurcation criterion is changed after this number of steps.
+    """
+    parameters = SectionParameters(
+        randomness=0.3, targeting=0.5, scale_prob=0.5, history=0.2, analytic_stop=analytic_stop
+    )
+    rng = np.random.default_rng(seed)
+    states = []
+    values = []
+    for _ in range(n_sections):
+        s = grower_class(
+            None,
+            0,
+            [0.0, 0.0, 0.0],
+            [0.0, 1.0, 0.0],
+            parameters,
+            "major",
+            {"TMD": TMDStop(1, 10.0, 0, 12.0, 0.0)},
+            sample.Distr({"norm": {"mean": 1.0, "std": 0.2}}),
+            0.0,
+            random_generator=rng,
+        )
+        s.first_point()
+        n_steps = 1
+        state = s.next()
+        while state == "continue":
+            if n_steps == new_bif_after:
+                stop = s.stop_criteria["TMD"].copy()
+                stop.update_bif(2, 6.0)
+                s.stop_criteria["TMD"] = stop
+            n_steps += 1
+            state = s.next()
+        states.append(state)
+        values.append(s.get_val())
+    return np.array(states), np.array(values)
+
+
+def _assert_same_stops(per_step, analytic):
+    """Check that the stops follow the same distribution in both modes."""
+    (per_step_states, per_step_values), (analytic_states, analytic_values) = per_step, analytic
+    n_sections = len(per_step_states)
+    assert ks_2samp(per_step_values, analytic_values).pvalue > 0.01
+    per_step_bif = np.mean(per_step_states == "bifurcate")
+    analytic_bif = np.mean(analytic_states == "bifurcate")
+    assert 0 < per_step_bif < 1
+    assert abs(per_step_bif - analytic_bif) < 4 * np.sqrt(
+        per_step_bif * (1 - per_step_bif) / n_sections
+    )
+
+
+@pytest.mark.parametrize("grower_class", [section.SectionGrowerPath, section.SectionGrowerTMD])
+@pytest.mark.parametrize("new_bif_after", [None, 3])
+def test_analytic_stop(grower_class, new_bif_after):
+    n_sections = 2000
+    _assert_same_stops(
+        _grow_sections(grower_class, False, n_sections, 0, new_bif_after),
+        _grow_sections(grower_class, True, n_sections, 1, new_bif_after),
+    )
+
+
+def test_analytic_stop_sections():
+    def new_section(grower_class=section.SectionGrowerPath):
+        return grower_class(
+            None,
+            0,
+            [0.0, 0.0, 0.0],
+            [0.0, 1.0, 0.0],
+            SectionParameters(0.3, 0.5, 0.5, 0.2, analytic_stop=True),
+            "major",
+            {"TMD": TMDStop(1, 10.0, 0, 12.0, 0.0)},
+            sample.Distr({"norm": {"mean": 1.0, "std": 0.2}}),
+            0.0,
+            random_generator=np.random.default_rng(0),
+        )
+
+    # The points grown ahead are added one by one and the section can be grown further after a
+    # stop that is not used by the caller
+    s = new_section()
+    s.first_point()
+    states = [s.next() for _ in range(100)]
+    assert "bifurcate" in states
+    assert len(s.points) == 102
+    steps = np.diff(s.points, axis=0)
+    assert s.pathlength == pytest.approx(np.linalg.norm(steps, axis=1).sum())
+    assert_array_almost_equal(s.latest_directions[-1], steps[-1] / np.linalg.norm(steps[-1]))
+
+    # A value beyond the criterion always stops the section
+    s = new_section()
+    s.pathlength = 11.0
+    s.first_point()
+    assert s.next() == "bifurcate"
+
+    # The subclasses must grow the points as SectionGrower
+    class CustomGrower(section.SectionGrowerPath):
+        """A section grower with actions performed after each point."""
+
+        def post_next_point(self):
+            """Do something after each point."""
+
+    with pytest.raises(NeuroTSError, match="not supported by CustomGrower"):
+        new_section(CustomGrower)
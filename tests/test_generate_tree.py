@@ -22,9 +22,12 @@ import os
 
 import numpy as np
 import pytest
+from morph_tool import diff
+from morphio.mut import Morphology
 from numpy import testing as npt
 
 from neurots import NeuronGrower
+from neurots.generate.morphology_builder import MorphologyBuilder
 from neurots.generate.tree import TreeGrower
 from neurots.generate.tree import _create_section_parameters
 from neurots.utils import NeuroTSError
@@ -133,3 +136,51 @@ def test_TreeGrower_3d_angles():
             i,
             sections[len(sections) - num - 1],
         )
+
+
+def test_TreeGrower_builder():
+    with open(os.path.join(_path, "bio_distribution.json"), encoding="utf-8") as f:
+        distributions = json.load(f)
+
+    with open(os.path.join(_path, "bio_path_params.json"), encoding="utf-8") as f:
+        params = json.load(f)
+
+    # The sections of the trees are stored in the morphology builder of the neuron grower
+    grower = NeuronGrower(input_distributions=distributions, input_parameters=params)
+    grower._grow_soma()
+    for tree in grower.active_neurites:
+        assert tree.builder is grower._morphology_builder
+
+
+def test_TreeGrower_morphology():
+    with open(os.path.join(_path, "bio_distribution.json"), encoding="utf-8") as f:
+        distributions = json.load(f)
+
+    with open(os.path.join(_path, "bio_path_params.json"), encoding="utf-8") as f:
+        params = json.load(f)
+
+    grower = NeuronGrower(input_distributions=distributions, input_parameters=params)
+    grower._grow_soma()
+    tree = grower.active_neurites[0]
+
+    def grow_tree(builder):
+        tree_grower = TreeGrower(
+            builder,
+            tree.direction,
+            tree.point,
+            tree.params,
+            tree.distr,
+            random_generator=np.random.default_rng(0),
+        )
+        while not tree_grower.end():
+            tree_grower.next_point()
+        return tree_grower
+
+    # The sections are appended directly to a given morphology
+    morphology = Morphology()
+    with pytest.warns(DeprecationWarning, match="Passing a morphio.mut.Morphology"):
+        grow_tree(morphology)
+    builder = MorphologyBuilder()
+    assert grow_tree(builder).builder is builder
+    assert len(morphology.sections) == len(builder) > 1
+    assert not diff(morphology, builder.to_morphology())
@@ -0,0 +1,190 @@
+"""Test neurots.generate.lockstep code."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-function-docstring
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from morph_tool import diff
+from morphio import Morphology
+from scipy.stats import ks_2samp
+
+from neurots import NeuronGrower
+from neurots import NeuroTSError
+from neurots.generate import tree
+from neurots.generate.algorithms.tmdgrower import TMDAlgo
+from neurots.generate.grower import CompiledSynthesisInputs
+from neurots.generate.lockstep import LockstepGrower
+from neurots.generate.section import SectionGrowerPath
+
+DATA = Path(__file__).parent / "data"
+
+
+def _load_inputs(parameters="bio_path_params.json", distributions="bio_path_distribution.json"):
+    with open(DATA / parameters, encoding="utf-8") as f:
+        parameters = json.load(f)
+    with open(DATA / distributions, encoding="utf-8") as f:
+        distributions = json.load(f)
+    return CompiledSynthesisInputs(parameters, distributions)
+
+
+def test_lockstep_grower():
+    inputs = _load_inputs()
+    growers = [NeuronGrower(inputs, rng_or_seed=seed) for seed in range(3)]
+    neurons = LockstepGrower(growers).grow()
+
+    # All the bars of the barcodes are used, so the topology is the same as with the default engine
+    expected = NeuronGrower(inputs, rng_or_seed=0).grow()
+
+    assert len(neurons) == 3
+    for neuron, grower in zip(neurons, growers):
+        assert neuron is grower.neuron
+        assert not grower.active_neurites
+        assert len(neuron.sections) == len(expected.sections)
+        assert [sec.type for sec in neuron.root_sections] == [
+            sec.type for sec in expected.root_sections
+        ]
+
+        # The sections are connected and the apical point is exposed
+        morph = Morphology(neuron)
+        for sec in morph.iter():
+            if not sec.is_root:
+                np.testing.assert_array_equal(sec.points[0], sec.parent.points[-1])
+        assert len(grower.apical_sections) == 1
+        assert grower.apical_sections[0] is not None
+
+    # Each neuron only depends on its own random generator
+    alone = LockstepGrower([NeuronGrower(inputs, rng_or_seed=1)]).grow()[0]
+    assert not diff(alone, neurons[1])
+
+
+def test_lockstep_grower_instrumented():
+    inputs = _load_inputs()
+    growers = [
+        NeuronGrower(inputs, rng_or_seed=0, instrument=True),
+        NeuronGrower(inputs, rng_or_seed=1),
+    ]
+    neurons = LockstepGrower(growers).grow()
+
+    result = growers[0].statistics.to_dict()
+    assert set(result["timings"]) == {
+        "trunk_orientation",
+        "soma",
+        "section_stepping",
+        "bifurcation",
+        "termination",
+        "build_morphology",
+        "post_grow",
+        "diametrization",
+    }
+    counts = result["counts"]
+    assert counts["sections"] == len(neurons[0].sections)
+    assert counts["points"] == sum(len(sec.points) for sec in neurons[0].iter())
+    assert counts["sections"] == counts["bifurcations"] + counts["terminations"]
+    assert counts["sections"] < counts["steps"] < counts["points"]
+    assert counts["barcode_lookups"] > 0
+    assert growers[1].statistics.to_dict() == {"timings": {}, "counts": {}}
+
+    # The instrumentation does not change the grown cells
+    expected = LockstepGrower([NeuronGrower(inputs, rng_or_seed=seed) for seed in range(2)]).grow()
+    for neuron, expected_neuron in zip(neurons, expected):
+        assert not diff(neuron, expected_neuron)
+
+
+def _lengths(neurons):
+    """Return the section lengths and the path lengths of the terminations of the neurons."""
+    section_lengths = []
+    path_lengths = []
+    for neuron in neurons:
+        lengths = {}
+        for sec in Morphology(neuron).iter():
+            length = np.linalg.norm(np.diff(sec.points, axis=0), axis=1).sum()
+            section_lengths.append(length)
+            lengths[sec.id] = length if sec.is_root else length + lengths[sec.parent.id]
+            if not sec.children:
+                path_lengths.append(lengths[sec.id])
+    return section_lengths, path_lengths
+
+
+def test_lockstep_grower_distributions():
+    # With radial distances, the stops depend on the points added to the other sections of a tree
+    # when a section bifurcates
+    inputs = _load_inputs()
+    for neurite_type in inputs.parameters["grow_types"]:
+        inputs.parameters[neurite_type]["metric"] = "radial_distances"
+        inputs.distributions[neurite_type]["filtration_metric"] = "radial_distances"
+
+    expected = _lengths([NeuronGrower(inputs, rng_or_seed=seed).grow() for seed in range(10)])
+    lengths = _lengths(
+        LockstepGrower([NeuronGrower(inputs, rng_or_seed=seed) for seed in range(10, 20)]).grow()
+    )
+
+    for values, expected_values in zip(lengths, expected):
+        assert ks_2samp(values, expected_values).pvalue > 0.01
+
+
+@pytest.mark.parametrize(
+    "parameters,distributions",
+    [
+        ("trunk_parameters.json", "bio_trunk_distribution.json"),
+        ("axon_trunk_parameters.json", "axon_trunk_distribution.json"),
+    ],
+)
+def test_lockstep_grower_trunks(parameters, distributions):
+    inputs = _load_inputs(parameters, distributions)
+    neurons = LockstepGrower([NeuronGrower(inputs, rng_or_seed=seed) for seed in range(2)]).grow()
+    expected = NeuronGrower(inputs, rng_or_seed=0).grow()
+    for neuron in neurons:
+        assert len(neuron.sections) == len(expected.sections)
+        for sec, expected_sec in zip(neuron.iter(), expected.iter()):
+            assert len(sec.points) == len(expected_sec.points)
+
+
+def test_lockstep_grower_unsupported(monkeypatch):
+    class CustomSectionGrower(SectionGrowerPath):
+        """A section grower unknown to the lockstep engine."""
+
+    monkeypatch.setitem(tree.section_growers, "path_distances", CustomSectionGrower)
+    with pytest.raises(NeuroTSError, match="CustomSectionGrower is not supported"):
+        LockstepGrower([NeuronGrower(_load_inputs(), rng_or_seed=0)]).grow()
+
+
+@pytest.mark.parametrize("method", ["extend", "bifurcate", "terminate"])
+def test_lockstep_grower_overridden_algorithm(monkeypatch, method):
+    class CustomAlgo(TMDAlgo):
+        """A growth algorithm that overrides one of the methods of the TMD algorithm."""
+
+    setattr(CustomAlgo, method, lambda self, current_section: None)
+    monkeypatch.setitem(tree.growth_algorithms, "tmd", CustomAlgo)
+    with pytest.raises(
+        NeuroTSError, match=f"CustomAlgo is not supported .* overrides the {method}\\(\\) method"
+    ):
+        LockstepGrower([NeuronGrower(_load_inputs(), rng_or_seed=0)]).grow()
+
+    # The subclasses that do not override these methods are supported
+    monkeypatch.setitem(tree.growth_algorithms, "tmd", type("OtherAlgo", (TMDAlgo,), {}))
+    LockstepGrower([NeuronGrower(_load_inputs(), rng_or_seed=0)]).grow()
+
+
+def test_lockstep_grower_analytic_stop():
+    inputs = _load_inputs()
+    for neurite_type in inputs.parameters["grow_types"]:
+        inputs.parameters[neurite_type]["stop_sampling"] = "analytic"
+    with pytest.raises(NeuroTSError, match="analytic sampling of the stops is not supported"):
+        LockstepGrower([NeuronGrower(inputs, rng_or_seed=0)]).grow()
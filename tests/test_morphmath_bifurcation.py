@@ -63,3 +63,17 @@ def test_get_bif_symmetric():
         _bf.symmetric([0, 0, 1], [1, 1, 1, 1]),
         [[0.0, -0.479426, 0.877583], [0.0, 0.479426, 0.877583]],
     )
+
+
+def test_get_bif_batch():
+    rng = np.random.default_rng(0)
+    directions = rng.normal(size=(10, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    angles = rng.uniform(-np.pi, np.pi, size=(10, 4))
+
+    for method in [_bf.symmetric, _bf.bio_oriented, _bf.directional]:
+        dirs1, dirs2 = method(directions, angles)
+        assert dirs1.shape == dirs2.shape == (10, 3)
+        expected = [method(direction, angle) for direction, angle in zip(directions, angles)]
+        assert_array_almost_equal(dirs1, [dir1 for dir1, _ in expected])
+        assert_array_almost_equal(dirs2, [dir2 for _, dir2 in expected])
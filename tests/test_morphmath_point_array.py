@@ -68,3 +68,31 @@ def test_dynamic_point_array_append(dynamic_array):
     npt.assert_allclose(dynamic_array.data, np.vstack((p0, p1, p2, p3)))
     assert len(dynamic_array) == 4
     assert dynamic_array.capacity == 6
+
+
+def test_dynamic_point_array_items():
+    array = _pa.DynamicPointArray(3, 2, dtype=np.float64)
+    for i in range(5):
+        array.append([i, i, i])
+
+    assert array.data.dtype == np.float64
+    npt.assert_array_equal(array[-1], [4, 4, 4])
+    npt.assert_array_equal(array[1:3], [[1, 1, 1], [2, 2, 2]])
+
+    array[-1] *= 2
+    npt.assert_array_equal(array.data[-1], [8, 8, 8])
+
+    with pytest.raises(IndexError):
+        array[5]  # pylint: disable=pointless-statement
+
+
+def test_dynamic_point_array_extend():
+    array = _pa.DynamicPointArray(3, 2, dtype=np.float64)
+    array.append([0, 0, 0])
+    array.extend(np.ones((2, 3)))
+    assert array.capacity == 3
+
+    array.extend(np.full((10, 3), 2.0))
+    assert len(array) == 13
+    assert array.capacity == 13
+    npt.assert_array_equal(array.data, [[0, 0, 0]] + [[1, 1, 1]] * 2 + [[2, 2, 2]] * 10)
@@ -0,0 +1,63 @@
+"""Test neurots.generate.morphology_builder code."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-function-docstring
+import numpy as np
+from morphio import Morphology
+from morphio import SectionType
+from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_equal
+
+from neurots.generate.morphology_builder import MorphologyBuilder
+
+
+def test_morphology_builder():
+    # Use a small capacity to test the resizing of the arrays
+    builder = MorphologyBuilder(initial_capacity=2)
+    points = np.arange(15, dtype=float).reshape(5, 3)
+
+    # The sections are not appended in depth-first order
+    root_1 = builder.append_section(points[:2], SectionType.basal_dendrite)
+    root_2 = builder.append_section(points[2:], SectionType.apical_dendrite)
+    child_1 = builder.append_section(points[1:3], SectionType.basal_dendrite, parent=root_1)
+    child_2 = builder.append_section(points[4:], SectionType.apical_dendrite, parent=root_2)
+    grand_child = builder.append_section(points[2:4], SectionType.basal_dendrite, parent=child_1)
+    child_3 = builder.append_section(points[1:2], SectionType.basal_dendrite, parent=root_1)
+
+    assert [root_1, root_2, child_1, child_2, grand_child, child_3] == list(range(6))
+    assert len(builder) == 6
+    assert len(builder.points) == 11
+    assert_array_equal(builder.parents, [-1, -1, 0, 1, 2, 0])
+    assert_array_equal(builder.types, [3, 4, 3, 4, 3, 3])
+    assert_array_equal(builder.section_points(root_2), points[2:])
+    assert_array_equal(builder.section_points(child_3), points[1:2])
+
+    assert builder.final_section_ids is None
+    neuron = builder.to_morphology()
+    assert_array_equal(builder.final_section_ids, [0, 4, 1, 5, 2, 3])
+    sections = list(neuron.iter())
+    assert [sec.id for sec in sections] == list(range(6))
+    expected = [points[:2], points[1:3], points[2:4], points[1:2], points[2:], points[4:]]
+    for sec, expected_points in zip(sections, expected):
+        assert_array_almost_equal(sec.points, expected_points)
+        assert_array_equal(sec.diameters, np.ones(len(expected_points)))
+
+    # The IDs are the same as the ones given by the loader
+    morph = Morphology(neuron)
+    assert [sec.id for sec in morph.iter()] == [sec.id for sec in neuron.iter()]
+    assert [sec.type for sec in morph.iter()] == [3, 3, 3, 3, 4, 4]
+    assert [sec.parent.id for sec in morph.iter() if not sec.is_root] == [0, 1, 0, 4]
@@ -27,6 +27,7 @@ Finally, we need to check the TMD of the produced cells.
 # pylint: disable=protected-access
 import json
 import os
+from copy import deepcopy
 from os.path import basename
 from os.path import join
 from pathlib import Path
@@ -45,9 +46,16 @@ from numpy.testing import assert_array_equal
 from scipy.spatial.distance import cdist
 
 from neurots import extract_input
+from neurots.generate import orientations
+from neurots.generate import population_orientations
 from neurots.generate.diametrizer import diametrize_constant_per_neurite
+from neurots.generate.grower import CompiledSynthesisInputs
 from neurots.generate.grower import NeuronGrower
+from neurots.generate.soma import Soma
+from neurots.preprocess import preprocess_inputs
 from neurots.preprocess.exceptions import NeuroTSValidationError
+from neurots.utils import NeuroTSError
+from neurots.validator import ValidationError
 
 DATA_PATH = Path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_data"))
 _path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
@@ -168,6 +176,170 @@ def test_seeding():
     assert ng._rng.bit_generator.state["bit_generator"] == "PCG64"
 
 
+def test_compiled_inputs():
+    """Test that compiled inputs can be shared by several growers without being modified"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_distr_breaker.json"),
+        os.path.join(_path, "bio_params_breaker.json"),
+    )
+    compiled = CompiledSynthesisInputs(parameters, distributions)
+    compiled_parameters = deepcopy(compiled.parameters)
+    compiled_distributions = deepcopy(compiled.distributions)
+
+    for seed in range(3):
+        neuron = NeuronGrower(compiled, rng_or_seed=seed).grow()
+        expected = NeuronGrower(parameters, distributions, rng_or_seed=seed).grow()
+        assert not diff(neuron, expected)
+
+    assert compiled.parameters == compiled_parameters
+    assert compiled.distributions == compiled_distributions
+
+    # The compiled inputs are not preprocessed again
+    compiled.parameters["basal_dendrite"]["metric"] = "unknown metric"
+    NeuronGrower(compiled)
+
+
+def test_compiled_inputs_default_diameters():
+    """Test that the default diameter model is prepared once and does not modify the inputs"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_path_distribution.json"),
+        os.path.join(_path, "bio_path_params.json"),
+    )
+    assert CompiledSynthesisInputs(parameters, distributions).diameter_model is None
+
+    parameters["diameter_params"] = {"method": "default"}
+    distributions["diameter"] = {
+        "method": "default",
+        "basal_dendrite": [0.5, 2.0],
+        "apical_dendrite": [0.8, 1.5, 0.5],
+    }
+    compiled = CompiledSynthesisInputs(parameters, distributions)
+    compiled_parameters = deepcopy(compiled.parameters)
+    compiled_distributions = deepcopy(compiled.distributions)
+
+    growers = [NeuronGrower(compiled, rng_or_seed=seed) for seed in range(2)]
+    for grower in growers:
+        grower.grow()
+        assert grower._diameter_model is compiled.diameter_model
+        assert grower.input_parameters["diameter_params"] == {"method": "default"}
+    assert compiled.parameters == compiled_parameters
+    assert compiled.distributions == compiled_distributions
+
+    # The diameters are computed from the model
+    diameters = np.concatenate([sec.diameters for sec in growers[0].neuron.iter()])
+    assert diameters.min() >= 0.5
+    assert len(np.unique(diameters)) > 10
+
+
+def test_random_block_size():
+    """Test that the cells grown with block-buffered random numbers do not depend on the block"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_path_distribution.json"),
+        os.path.join(_path, "bio_path_params.json"),
+    )
+    compiled = CompiledSynthesisInputs(parameters, distributions)
+    neurons = [
+        NeuronGrower(compiled, rng_or_seed=0, random_block_size=block_size).grow()
+        for block_size in [16, 16, 4096]
+    ]
+    assert not diff(neurons[0], neurons[1])
+    assert not diff(neurons[0], neurons[2])
+
+    # The random numbers are not drawn in the same order as in the default growth
+    assert diff(NeuronGrower(compiled, rng_or_seed=0).grow(), neurons[0])
+
+
+def test_population_orientations():
+    """Test the growth from the soma radii and trunk orientations computed for a population"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_distribution_3d_angles.json"),
+        os.path.join(_path, "bio_parameters_3d_angles.json"),
+    )
+    compiled = CompiledSynthesisInputs(parameters, distributions)
+    manager = population_orientations.PopulationOrientationManager(
+        soma=None,
+        parameters=compiled.parameters,
+        distributions=compiled.distributions,
+        context=None,
+        rng=np.random.default_rng(0),
+        distr_cache=compiled.distr_cache,
+    )
+    radii, population = manager.compute_population_orientations(3, soma_factory=Soma)
+
+    origin = np.array(compiled.parameters["origin"])
+    for seed, (radius, trunk_orientations) in enumerate(zip(radii, population)):
+        grower = NeuronGrower(
+            compiled, rng_or_seed=seed, soma_radius=radius, trunk_orientations=trunk_orientations
+        )
+        neuron = grower.grow()
+        assert grower.soma_grower.soma.radius == radius
+
+        for tree_type, tree_orientations in trunk_orientations.items():
+            section_type = SectionType(compiled.parameters[tree_type]["tree_type"])
+            starts = [sec.points[0] for sec in neuron.root_sections if sec.type == section_type]
+            assert len(starts) == len(tree_orientations)
+            expected_starts = origin + radius * np.asarray(tree_orientations)
+            assert cdist(starts, expected_starts).min(axis=0).max() < 1e-4
+
+    # The orientations of all the tree types are needed
+    missing_basals = {
+        tree_type: tree_orientations
+        for tree_type, tree_orientations in population[0].items()
+        if tree_type != "basal_dendrite"
+    }
+    grower = NeuronGrower(compiled, trunk_orientations=missing_basals)
+    with pytest.raises(
+        NeuroTSError, match="The trunk orientations of the 'basal_dendrite' trees are missing"
+    ):
+        grower.grow()
+
+
+def test_analytic_stop_sampling():
+    """Test the growth with the analytic sampling of the section stops"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_path_distribution.json"),
+        os.path.join(_path, "bio_path_params.json"),
+    )
+    expected = NeuronGrower(deepcopy(parameters), distributions, rng_or_seed=0).grow()
+    for neurite_type in parameters["grow_types"]:
+        parameters[neurite_type]["stop_sampling"] = "analytic"
+    neuron = NeuronGrower(parameters, distributions, rng_or_seed=0).grow()
+
+    # All the bars are used, so only the lengths of the sections change
+    assert len(neuron.sections) == len(expected.sections)
+    assert diff(neuron, expected)
+
+    parameters["basal_dendrite"]["stop_sampling"] = "unknown"
+    with pytest.raises(ValidationError, match="'unknown' is not one of"):
+        NeuronGrower(parameters, distributions)
+
+
+def test_batch_3d_angles_fit(monkeypatch):
+    """Test that the batch sampling of the 3d angles is kept when the angles are fitted"""
+    distributions, parameters = _load_inputs(
+        os.path.join(_path, "bio_distribution_3d_angles.json"),
+        os.path.join(_path, "bio_parameters_3d_angles.json"),
+    )
+    parameters["basal_dendrite"]["orientation"]["values"] = {"sampling": "batch"}
+
+    preprocessed_parameters, _ = preprocess_inputs(parameters, distributions)
+    values = preprocessed_parameters["basal_dendrite"]["orientation"]["values"]
+    assert values["sampling"] == "batch"
+    assert values.keys() == {"form", "params", "sampling"}
+
+    batch_calls = []
+    sample_trunks = orientations._sample_trunks_from_3d_angle
+
+    def _sample_trunks_from_3d_angle(*args, **kwargs):
+        batch_calls.append(args)
+        return sample_trunks(*args, **kwargs)
+
+    monkeypatch.setattr(orientations, "_sample_trunks_from_3d_angle", _sample_trunks_from_3d_angle)
+    neuron = NeuronGrower(parameters, distributions, rng_or_seed=0).grow()
+    assert len(batch_calls) == 1
+    assert len(neuron.root_sections) > 1
+
+
 def test_grow_trunk_1_basal():
     """Test NeuronGrower._grow_trunk() with only 1 basal (should raise an Exception)"""
     distributions, parameters = _load_inputs(
@@ -187,6 +359,14 @@ def test_grow_trunk_1_basal():
     with pytest.raises(Exception, match=r"There should be at least 2 basal dendrites \(got 1\)"):
         ng.grow()
 
+    ng = NeuronGrower(
+        parameters,
+        distributions,
+        trunk_orientations={tree_type: [[0.0, 1.0, 0.0]] for tree_type in parameters["grow_types"]},
+    )
+    with pytest.raises(Exception, match=r"There should be at least 2 basal dendrites \(got 1\)"):
+        ng.grow()
+
 
 def test_external_diametrizer():
     """Test external diametrizer"""
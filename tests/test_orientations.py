@@ -18,10 +18,12 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=protected-access
 import inspect
+import logging
 
 import numpy as np
 import pytest
 from numpy import testing as npt
+from scipy.stats import ks_2samp
 
 from neurots.generate import orientations as tested
 from neurots.generate.soma import Soma
@@ -542,6 +544,72 @@ def test_orientation_manager__apical_constraint():
     npt.assert_allclose(actual, expected, rtol=2e-5)
 
 
+@pytest.mark.parametrize("mode", ["pia_constraint", "apical_constraint"])
+def test_orientation_manager__batch_3d_angles(mode):
+    parameters = {
+        "grow_types": ["apical_dendrite", "basal_dendrite"],
+        "apical_dendrite": {
+            "orientation": {
+                "mode": "use_predefined",
+                "values": {"orientations": [[0.0, 0.0, 1.0]]},
+            }
+        },
+        "basal_dendrite": {
+            "orientation": {
+                "mode": mode,
+                "values": {"form": "step", "params": [1.5, 0.25], "sampling": "batch"},
+            }
+        },
+    }
+    distributions = {
+        "apical_dendrite": {"num_trees": {"data": {"bins": [1], "weights": [1]}}},
+        "basal_dendrite": {"num_trees": {"data": {"bins": [500], "weights": [1]}}},
+    }
+    om = tested.OrientationManager(
+        soma=None,
+        parameters=parameters,
+        distributions=distributions,
+        context=None,
+        rng=np.random.default_rng(seed=0),
+    )
+    for tree_type in parameters["grow_types"]:
+        om.compute_tree_type_orientations(tree_type)
+    actual = om.get_tree_type_orientations("basal_dendrite")
+    assert actual.shape == (500, 3)
+    npt.assert_allclose(np.linalg.norm(actual, axis=1), 1)
+
+    # The angles follow the same distribution as the ones sampled trunk by trunk
+    ref_dir = [0.0, 1.0, 0.0] if mode == "pia_constraint" else [0.0, 0.0, 1.0]
+    rng = np.random.default_rng(1)
+    expected = np.array(
+        [
+            tested._sample_trunk_from_3d_angle(parameters, rng, "basal_dendrite", ref_dir)
+            for _ in range(500)
+        ]
+    )
+    assert ks_2samp(actual.dot(ref_dir), expected.dot(ref_dir)).pvalue > 0.01
+
+    with pytest.warns(UserWarning, match="We could not sample from distribution"):
+        random_trunks = tested._sample_trunks_from_3d_angle(
+            parameters, rng, "basal_dendrite", ref_dir, 3, max_tries=0
+        )
+    assert random_trunks.shape == (3, 3)
+
+
+def test_compute_interval_n_tree():
+    soma = Soma((1.0, 2.0, 3.0), 6.0, [[1.0, 8.0, 3.0], [-5.0, 2.0, 3.0], [7.0, 2.0, 3.0]])
+    phi_intervals, n_trees = tested.compute_interval_n_tree(soma, 100, np.random.default_rng(0))
+    npt.assert_allclose(
+        phi_intervals, [[0, np.pi / 2], [np.pi / 2, np.pi], [np.pi, 2 * np.pi]], atol=1e-12
+    )
+    assert n_trees.sum() == 100
+    assert n_trees[2] > n_trees[0]
+
+    soma.points.append(soma.center)
+    with pytest.raises(ValueError, match="Point overlaps with soma center"):
+        tested.compute_interval_n_tree(soma, 1)
+
+
 def test_probability_function():
     func = tested.get_probability_function(form="flat")
     npt.assert_equal(func(1.0), 0.8414709848078965)
@@ -632,3 +700,70 @@ def test_fit_3d_angles():
     new_parameters = tested.fit_3d_angles(parameters, distributions)
     assert new_parameters["basal_dendrite"]["orientation"]["values"]["form"] == "flat"
     assert new_parameters["basal_dendrite"]["orientation"]["values"]["params"] == []
+
+
+def test_fit_3d_angles_cache(monkeypatch, tmpdir, caplog):
+    n_fits = []
+
+    def curve_fit(*args, **kwargs):
+        # pylint: disable=unused-argument
+        n_fits.append(1)
+        return (np.array([1.0, 2.0]),)
+
+    monkeypatch.setattr(tested, "curve_fit", curve_fit)
+    monkeypatch.setattr(tested, "_FIT_3D_ANGLES_CACHE", {})
+    monkeypatch.setenv(tested.FIT_3D_ANGLES_CACHE_DIR_VAR, str(tmpdir / "cache"))
+    data = {"bins": [0, 0.5, 1], "weights": [0.2, 0.8, 0.2]}
+
+    fit = tested._fit_single_3d_angles(data, "basal_dendrite", "with_apical")
+    assert fit == {"form": "step", "params": [1.0, 2.0]}
+    assert len(n_fits) == 1
+
+    # The fit is cached in memory and the returned values can be modified
+    fit["params"].append(3)
+    assert tested._fit_single_3d_angles(data, "basal_dendrite", "with_apical") == {
+        "form": "step",
+        "params": [1.0, 2.0],
+    }
+    assert len(n_fits) == 1
+
+    # The fit is cached on disk
+    assert len(tmpdir.join("cache").listdir()) == 1
+    monkeypatch.setattr(tested, "_FIT_3D_ANGLES_CACHE", {})
+    fit = tested._fit_single_3d_angles(data, "basal_dendrite", "with_apical")
+    assert fit["params"] == [1.0, 2.0]
+    assert len(n_fits) == 1
+
+    # Other data or fit parameters lead to new fits
+    tested._fit_single_3d_angles(
+        {"bins": [0, 0.5, 1], "weights": [0.2, 0.8, 0.3]}, "basal_dendrite", "with_apical"
+    )
+    assert len(n_fits) == 2
+    tested._fit_single_3d_angles(
+        data, "basal_dendrite", "with_apical", fit_params={"bounds": ([0, 0.1], [np.pi, 5])}
+    )
+    assert len(n_fits) == 3
+    assert len(tmpdir.join("cache").listdir()) == 3
+
+    # Without cache directory, the fits are only cached in memory
+    monkeypatch.delenv(tested.FIT_3D_ANGLES_CACHE_DIR_VAR)
+    monkeypatch.setattr(tested, "_FIT_3D_ANGLES_CACHE", {})
+    tested._fit_single_3d_angles(data, "basal_dendrite", "with_apical")
+    tested._fit_single_3d_angles(data, "basal_dendrite", "with_apical")
+    assert len(n_fits) == 4
+
+    # The fits are still returned when they can not be saved and no temporary file is left
+    def replace(*args, **kwargs):
+        raise OSError("read-only cache")
+
+    monkeypatch.setenv(tested.FIT_3D_ANGLES_CACHE_DIR_VAR, str(tmpdir / "cache"))
+    monkeypatch.setattr(tested.os, "replace", replace)
+    monkeypatch.setattr(tested, "_FIT_3D_ANGLES_CACHE", {})
+    with caplog.at_level(logging.WARNING):
+        fit = tested._fit_single_3d_angles(
+            data, "basal_dendrite", "with_apical", fit_params={"bounds": ([0, 0.2], [np.pi, 5])}
+        )
+    assert fit["params"] == [1.0, 2.0]
+    assert len(n_fits) == 5
+    assert "Could not save the fit of the 3d angles" in caplog.text
+    assert len(tmpdir.join("cache").listdir()) == 3
@@ -0,0 +1,302 @@
+"""Test neurots.generate.population code."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-function-docstring
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from morph_tool import diff
+from morphio import Collection
+from morphio import SectionType
+from numpy.testing import assert_allclose
+from numpy.testing import assert_array_equal
+from scipy.stats import ks_2samp
+
+from neurots import NeuronGrower
+from neurots import NeuroTSError
+from neurots import synthesize_placed_population
+from neurots import synthesize_population
+from neurots.generate import population as tested
+from neurots.generate.grower import CompiledSynthesisInputs
+from neurots.generate.population import MorphologyContainerWriter
+from neurots.generate.population import arrays_to_morphology
+from neurots.generate.population import iter_placed_population
+from neurots.generate.population import iter_population
+from neurots.generate.population import morphology_to_arrays
+from neurots.generate.population import synthesize_population_to_container
+from neurots.generate.population_orientations import PopulationOrientationManager
+from neurots.generate.soma import Soma
+
+DATA = Path(__file__).parent / "data"
+
+
+def _load_inputs():
+    with open(DATA / "bio_path_distribution.json", encoding="utf-8") as f:
+        distributions = json.load(f)
+    with open(DATA / "bio_path_params.json", encoding="utf-8") as f:
+        parameters = json.load(f)
+    return parameters, distributions
+
+
+def test_morphology_arrays_round_trip():
+    parameters, distributions = _load_inputs()
+    neuron = NeuronGrower(parameters, distributions, rng_or_seed=0).grow()
+
+    data = morphology_to_arrays(neuron)
+    assert data["structure"].shape == (len(neuron.sections), 3)
+    assert data["structure"][0, 2] == -1
+
+    new_neuron = arrays_to_morphology(data)
+    assert not diff(neuron, new_neuron)
+    assert_array_equal(new_neuron.soma.points, neuron.soma.points)
+    assert_array_equal(new_neuron.soma.diameters, neuron.soma.diameters)
+    assert new_neuron.soma.type == neuron.soma.type
+
+
+def test_synthesize_population():
+    parameters, distributions = _load_inputs()
+
+    population = synthesize_population(parameters, distributions, 3, seed=0)
+    assert len(population) == 3
+
+    # Each cell is grown from its own child seed
+    expected = NeuronGrower(
+        parameters, distributions, rng_or_seed=np.random.SeedSequence(0).spawn(3)[1]
+    ).grow()
+    assert not diff(population[1], expected)
+
+    # The population does not depend on the number of workers
+    population_parallel = synthesize_population(parameters, distributions, 3, seed=0, n_workers=2)
+    for cell, cell_parallel in zip(population, population_parallel):
+        assert not diff(cell, cell_parallel)
+        assert_array_equal(cell.soma.points, cell_parallel.soma.points)
+
+    # The inputs are not modified
+    assert (parameters, distributions) == _load_inputs()
+
+    # A seed sequence gives the same population each time it is used
+    seed_sequence = np.random.SeedSequence(0)
+    for _ in range(2):
+        population_from_sequence = synthesize_population(
+            parameters, distributions, 3, seed=seed_sequence
+        )
+        for cell, cell_from_sequence in zip(population, population_from_sequence):
+            assert not diff(cell, cell_from_sequence)
+    assert seed_sequence.n_children_spawned == 0
+
+    # The children already spawned from a seed sequence are not used again
+    seed_sequence.spawn(2)
+    population_from_sequence = synthesize_population(
+        parameters, distributions, 1, seed=seed_sequence
+    )
+    expected = NeuronGrower(parameters, distributions, rng_or_seed=seed_sequence.spawn(1)[0]).grow()
+    assert not diff(population_from_sequence[0], expected)
+    assert not diff(population_from_sequence[0], population[2])
+
+
+def test_iter_population():
+    parameters, distributions = _load_inputs()
+    expected = synthesize_population(parameters, distributions, 5, seed=1)
+
+    population = iter_population(parameters, distributions, 5, seed=1, n_workers=2, chunksize=2)
+    assert not isinstance(population, list)
+    for cell, expected_cell in zip(population, expected):
+        assert not diff(cell, expected_cell)
+
+
+def _placed_orientations(parameters, distributions, pia_directions, seed, n_cells):
+    """Compute the soma radii and the trunk orientations of the placed cells."""
+    inputs = CompiledSynthesisInputs(parameters, distributions)
+    manager = PopulationOrientationManager(
+        soma=None,
+        parameters=inputs.parameters,
+        distributions=inputs.distributions,
+        context=None,
+        rng=np.random.default_rng(np.random.SeedSequence(seed).spawn(n_cells + 1)[-1]),
+        distr_cache=inputs.distr_cache,
+    )
+    return manager.compute_population_orientations(
+        n_cells, soma_factory=Soma, pia_directions=np.broadcast_to(pia_directions, (n_cells, 3))
+    )
+
+
+def test_placed_population():
+    with open(DATA / "bio_distribution_3d_angles.json", encoding="utf-8") as f:
+        distributions = json.load(f)
+    with open(DATA / "bio_parameters_3d_angles.json", encoding="utf-8") as f:
+        parameters = json.load(f)
+    origins = np.array([[0.0, 0.0, 0.0], [100.0, 0.0, 0.0], [0.0, -50.0, 20.0]])
+    pia_directions = np.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, -2.0]])
+    expected_parameters = json.loads(json.dumps(parameters))
+
+    population = synthesize_placed_population(
+        parameters, distributions, origins, pia_directions, seed=0
+    )
+    assert len(population) == 3
+
+    # The somata and the trunks of all the cells are computed at once
+    radii, orientations = _placed_orientations(parameters, distributions, pia_directions, 0, 3)
+    seeds = np.random.SeedSequence(0).spawn(3)
+    for cell, origin, pia_direction, seed, radius, trunk_orientations in zip(
+        population, origins, pia_directions, seeds, radii, orientations
+    ):
+        expected = NeuronGrower(
+            parameters,
+            distributions,
+            rng_or_seed=seed,
+            origin=origin,
+            pia_direction=pia_direction,
+            soma_radius=radius,
+            trunk_orientations=trunk_orientations,
+        ).grow()
+        assert not diff(cell, expected)
+        assert_array_equal(cell.soma.points, expected.soma.points)
+
+        # The apical trunk is oriented along the pia direction of the cell
+        apical = [sec for sec in cell.root_sections if sec.type == SectionType.apical_dendrite][0]
+        trunk_direction = apical.points[0] - origin
+        assert_allclose(
+            trunk_direction / np.linalg.norm(trunk_direction),
+            pia_direction / np.linalg.norm(pia_direction),
+            atol=1e-5,
+        )
+
+    # The inputs are not modified
+    assert parameters == expected_parameters
+
+    # The same pia direction can be used for all the cells and several workers can be used
+    population = iter_placed_population(
+        parameters, distributions, origins, pia_directions[1], seed=0, n_workers=2
+    )
+    radii, orientations = _placed_orientations(parameters, distributions, pia_directions[1], 0, 3)
+    for cell, origin, seed, radius, trunk_orientations in zip(
+        population, origins, seeds, radii, orientations
+    ):
+        expected = NeuronGrower(
+            parameters,
+            distributions,
+            rng_or_seed=seed,
+            origin=origin,
+            pia_direction=pia_directions[1],
+            soma_radius=radius,
+            trunk_orientations=trunk_orientations,
+        ).grow()
+        assert not diff(cell, expected)
+
+
+def _trunk_directions(trunk_orientations):
+    """Return the apical and the basal trunk directions of several cells."""
+    return [
+        np.concatenate([cell[tree_type] for cell in trunk_orientations])
+        for tree_type in ["apical_dendrite", "basal_dendrite"]
+    ]
+
+
+def test_placed_population_flipped_pia_directions():
+    # pylint: disable=protected-access
+    with open(DATA / "bio_distribution_3d_angles.json", encoding="utf-8") as f:
+        distributions = json.load(f)
+    with open(DATA / "bio_parameters_3d_angles.json", encoding="utf-8") as f:
+        parameters = json.load(f)
+    pia_direction = np.array([0.0, -1.0, 0.0])
+
+    # The trunks of the placed cells follow the same distribution as the ones of the cells grown
+    # one by one with the same pia direction
+    inputs = CompiledSynthesisInputs(parameters, distributions)
+    n_cells = 50
+    _, orientations = zip(
+        *tested._placed_orientations(inputs, np.tile(pia_direction, (n_cells, 1)), 0, n_cells, {})
+    )
+    expected = []
+    for seed in range(n_cells):
+        grower = NeuronGrower(inputs, rng_or_seed=seed, pia_direction=pia_direction)
+        grower._grow_soma()
+        expected.append({"apical_dendrite": [], "basal_dendrite": []})
+        for tree in grower.active_neurites:
+            expected[-1][SectionType(tree.type).name].append(tree.direction)
+    apicals, basals = _trunk_directions(orientations)
+    expected_apicals, expected_basals = _trunk_directions(expected)
+    assert_allclose(apicals, np.broadcast_to(pia_direction, apicals.shape), atol=1e-12)
+    assert_allclose(expected_apicals, np.broadcast_to(pia_direction, apicals.shape), atol=1e-12)
+    assert ks_2samp(basals.dot(pia_direction), expected_basals.dot(pia_direction)).pvalue > 0.01
+
+    # The apical trunks of the placed cells are oriented along their pia direction
+    origins = np.array([[0.0, 0.0, 0.0], [100.0, 0.0, 0.0]])
+    for cell, origin in zip(
+        synthesize_placed_population(parameters, distributions, origins, [pia_direction] * 2),
+        origins,
+    ):
+        apical = [sec for sec in cell.root_sections if sec.type == SectionType.apical_dendrite][0]
+        trunk_direction = apical.points[0] - origin
+        assert_allclose(trunk_direction / np.linalg.norm(trunk_direction), pia_direction, atol=1e-5)
+
+
+def test_placed_population_legacy_orientations():
+    parameters, distributions = _load_inputs()
+    origins = np.array([[0.0, 0.0, 0.0], [100.0, 0.0, 0.0]])
+
+    # The legacy orientations are computed by the grower of each cell
+    population = synthesize_placed_population(parameters, distributions, origins, seed=0)
+    for cell, origin, seed in zip(population, origins, np.random.SeedSequence(0).spawn(2)):
+        expected = NeuronGrower(
+            {**parameters, "origin": origin.tolist()}, distributions, rng_or_seed=seed
+        ).grow()
+        assert not diff(cell, expected)
+
+
+@pytest.mark.parametrize(
+    "origins, pia_directions, message",
+    [
+        ([0.0, 0.0, 0.0], None, "The origins must be an array of shape"),
+        ([[0.0, np.nan, 0.0]], None, "The origins must be finite"),
+        ([[0.0, 0.0, 0.0]] * 2, [[0.0, 1.0, 0.0]] * 3, "The pia directions must be an array"),
+        ([[0.0, 0.0, 0.0]] * 2, [0.0, 0.0, 0.0], "The pia directions must be non-zero"),
+    ],
+)
+def test_placed_population_errors(origins, pia_directions, message):
+    parameters, distributions = _load_inputs()
+    with pytest.raises(NeuroTSError, match=message):
+        synthesize_placed_population(parameters, distributions, origins, pia_directions)
+
+
+def test_container(tmpdir):
+    parameters, distributions = _load_inputs()
+    expected = synthesize_population(parameters, distributions, 3, seed=1)
+
+    # Write with a buffer smaller than the number of cells
+    path = tmpdir / "population.h5"
+    with MorphologyContainerWriter(path, buffer_size=2) as writer:
+        for i, cell in enumerate(expected):
+            writer.write(f"morph_{i}", cell)
+
+    collection = Collection(str(path))
+    for i, cell in enumerate(expected):
+        loaded = collection.load(f"morph_{i}")
+        assert not diff(loaded, cell)
+        assert_array_equal(loaded.soma.points, cell.soma.points)
+        assert_array_equal(loaded.soma.diameters, cell.soma.diameters)
+
+    # Synthesize directly into a container
+    path = tmpdir / "population_parallel.h5"
+    synthesize_population_to_container(
+        path, parameters, distributions, 3, seed=1, n_workers=2, buffer_size=2
+    )
+    collection = Collection(str(path))
+    for i, cell in enumerate(expected):
+        assert not diff(collection.load(f"cell_{i}"), cell)
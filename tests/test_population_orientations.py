@@ -0,0 +1,276 @@
+"""Test neurots.generate.population_orientations code."""
+
+# Copyright (C) 2021  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-function-docstring
+# pylint: disable=protected-access
+from copy import deepcopy
+
+import numpy as np
+import pytest
+from numpy import testing as npt
+from scipy.stats import ks_2samp
+
+from neurots.generate import population_orientations as tested
+from neurots.generate.soma import Soma
+from neurots.morphmath import sample
+from neurots.utils import NeuroTSError
+
+_POPULATION_DISTRIBUTIONS = {
+    "soma": {"size": {"norm": {"mean": 6, "std": 1}}},
+    "apical_dendrite": {"num_trees": {"data": {"bins": [1], "weights": [1]}}},
+    "basal_dendrite": {
+        "num_trees": {"data": {"bins": [2, 5], "weights": [1, 1]}},
+        "trunk": {
+            "azimuth": {"uniform": {"min": np.pi, "max": 0.0}},
+            "absolute_elevation_deviation": {"uniform": {"min": -0.5, "max": 0.5}},
+            "orientation_deviation": {"norm": {"mean": 0.0, "std": 0.3}},
+        },
+    },
+}
+
+
+_POPULATION_MODES = [
+    ("use_predefined", {"orientations": [[0.0, 2.0, 0.0], [1.0, 0.0, 0.0]]}),
+    ("uniform", {}),
+    ("sample_pairwise_angles", {}),
+    ("sample_around_primary_orientation", {"primary_orientation": [0.0, 1.0, 0.0]}),
+    ("normal_pia_constraint", {"direction": {"mean": [1.0], "std": [0.3]}}),
+    ("pia_constraint", {"form": "step", "params": [1.5, 0.25]}),
+    ("apical_constraint", {"form": "step", "params": [1.5, 0.25]}),
+]
+
+
+@pytest.mark.parametrize(
+    "mode, values, with_apical",
+    [
+        (mode, values, with_apical)
+        for mode, values in _POPULATION_MODES
+        for with_apical in [True, False]
+        # The apical constraint mode needs an apical dendrite
+        if mode != "apical_constraint" or with_apical
+    ],
+)
+def test_orientation_manager__population(mode, values, with_apical):
+    parameters = {
+        "grow_types": ["apical_dendrite", "basal_dendrite"] if with_apical else ["basal_dendrite"],
+        "apical_dendrite": {
+            "orientation": {"mode": "use_predefined", "values": {"orientations": [[0, 0, 1]]}}
+        },
+        "basal_dendrite": {"orientation": {"mode": mode, "values": values}},
+    }
+    rng = np.random.default_rng(0)
+    om = tested.PopulationOrientationManager(
+        soma=None,
+        parameters=parameters,
+        distributions=_POPULATION_DISTRIBUTIONS,
+        context=None,
+        rng=rng,
+    )
+    other_rng = np.random.default_rng(1)
+    radii, population = om.compute_population_orientations(50, other_rng, soma_factory=Soma)
+
+    # The random generator of the manager is not used
+    assert om._rng is rng
+    assert rng.bit_generator.state == np.random.default_rng(0).bit_generator.state
+
+    assert radii.shape == (50,)
+    assert (radii > 0).all()
+    assert len(population) == 50
+    n_trees = set()
+    for cell in population:
+        assert list(cell) == parameters["grow_types"]
+        if with_apical:
+            npt.assert_array_equal(cell["apical_dendrite"], [[0, 0, 1]])
+        basals = cell["basal_dendrite"]
+        npt.assert_allclose(np.linalg.norm(basals, axis=1), 1)
+        n_trees.add(len(basals))
+    assert n_trees == ({2} if mode == "use_predefined" else {2, 5})
+
+
+def test_orientation_manager__population_pia_directions():
+    parameters = {
+        "grow_types": ["basal_dendrite"],
+        "basal_dendrite": {
+            "orientation": {
+                "mode": "normal_pia_constraint",
+                "values": {"direction": {"mean": [0.0], "std": [0.0]}},
+            }
+        },
+    }
+    om = tested.PopulationOrientationManager(
+        soma=None,
+        parameters=parameters,
+        distributions=_POPULATION_DISTRIBUTIONS,
+        context=None,
+        rng=np.random.default_rng(0),
+    )
+    pia_directions = np.random.default_rng(1).normal(size=(50, 3))
+    _, population = om.compute_population_orientations(
+        50, soma_factory=Soma, pia_directions=pia_directions
+    )
+    for cell, pia_direction in zip(population, pia_directions):
+        basals = cell["basal_dendrite"]
+        npt.assert_allclose(
+            basals, np.broadcast_to(pia_direction, basals.shape) / np.linalg.norm(pia_direction)
+        )
+
+    # The angles with the pia direction of each cell follow the same distribution as the ones
+    # with a pia direction shared by all the cells
+    parameters["basal_dendrite"]["orientation"] = {
+        "mode": "pia_constraint",
+        "values": {"form": "step", "params": [1.5, 0.25]},
+    }
+    _, population = om.compute_population_orientations(
+        50, soma_factory=Soma, pia_directions=pia_directions
+    )
+    actual = np.concatenate(
+        [
+            cell["basal_dendrite"].dot(pia_direction / np.linalg.norm(pia_direction))
+            for cell, pia_direction in zip(population, pia_directions)
+        ]
+    )
+    _, population = om.compute_population_orientations(50, soma_factory=Soma)
+    expected = np.concatenate([cell["basal_dendrite"][:, 1] for cell in population])
+    assert ks_2samp(actual, expected).pvalue > 0.01
+
+    with pytest.raises(NeuroTSError, match=r"must be an array of shape \(50, 3\) \(got \(3,\)\)"):
+        om.compute_population_orientations(50, pia_directions=[0.0, 1.0, 0.0])
+    assert om._pia_directions is None
+
+
+def test_orientation_manager__population_flipped_pia_directions():
+    parameters = {
+        "grow_types": ["basal_dendrite"],
+        "pia_direction": [0.0, -1.0, 0.0],
+        "basal_dendrite": {
+            "orientation": {
+                "mode": "normal_pia_constraint",
+                "values": {"direction": {"mean": [0.0], "std": [0.0]}},
+            }
+        },
+    }
+    om = tested.PopulationOrientationManager(
+        soma=None,
+        parameters=parameters,
+        distributions=_POPULATION_DISTRIBUTIONS,
+        context=None,
+        rng=np.random.default_rng(0),
+    )
+    pia_directions = np.tile([0.0, -1.0, 0.0], (50, 1))
+    pia_directions[::2] = [0.0, 1.0, 0.0]
+    _, population = om.compute_population_orientations(
+        50, soma_factory=Soma, pia_directions=pia_directions
+    )
+    for cell, pia_direction in zip(population, pia_directions):
+        basals = cell["basal_dendrite"]
+        npt.assert_allclose(basals, np.broadcast_to(pia_direction, basals.shape), atol=1e-12)
+
+    # The angles with a flipped pia direction follow the same distribution as the ones of the
+    # trunks sampled cell by cell with this pia direction
+    parameters["basal_dendrite"]["orientation"] = {
+        "mode": "pia_constraint",
+        "values": {"form": "step", "params": [1.5, 0.25]},
+    }
+    _, population = om.compute_population_orientations(
+        50, soma_factory=Soma, pia_directions=pia_directions[1::2].repeat(2, axis=0)
+    )
+    actual = np.concatenate([cell["basal_dendrite"][:, 1] for cell in population])
+    expected = np.concatenate(
+        [om.compute_tree_type_orientations("basal_dendrite")[:, 1] for _ in range(50)]
+    )
+    assert ks_2samp(actual, expected).pvalue > 0.01
+
+
+def test_orientation_manager__population_no_trunk():
+    parameters = {
+        "grow_types": ["basal_dendrite"],
+        "basal_dendrite": {"orientation": {"mode": "sample_pairwise_angles", "values": {}}},
+    }
+    distributions = deepcopy(_POPULATION_DISTRIBUTIONS)
+    distributions["basal_dendrite"]["num_trees"] = {"data": {"bins": [0, 3], "weights": [1, 1]}}
+    om = tested.PopulationOrientationManager(
+        soma=None,
+        parameters=parameters,
+        distributions=distributions,
+        context=None,
+        rng=np.random.default_rng(0),
+    )
+
+    # The cells that get no trunk are kept with an empty array of orientations
+    _, population = om.compute_population_orientations(50, soma_factory=Soma)
+    shapes = [cell["basal_dendrite"].shape for cell in population]
+    assert set(shapes) == {(0, 3), (3, 3)}
+    for cell in population:
+        npt.assert_allclose(np.linalg.norm(cell["basal_dendrite"], axis=1), 1)
+
+    # The cells may all have no trunk
+    distributions["basal_dendrite"]["num_trees"] = {"data": {"bins": [0], "weights": [1]}}
+    _, population = om.compute_population_orientations(5, soma_factory=Soma)
+    assert [cell["basal_dendrite"].shape for cell in population] == [(0, 3)] * 5
+
+
+def test_orientation_manager__population_cell_by_cell():
+    class CustomOrientationManager(tested.PopulationOrientationManager):
+        """Orientation manager with a mode that has no population method."""
+
+        def _mode_custom(self, _, tree_type):
+            assert self._soma.radius > 0
+            npt.assert_allclose(
+                self._soma.points, self._soma.radius * self._orientations["apical_dendrite"]
+            )
+            n_trees = sample.n_neurites(self._distributions[tree_type]["num_trees"], self._rng)
+            return np.tile(self._soma.points[0] / self._soma.radius, (n_trees, 1))
+
+    parameters = {
+        "grow_types": ["apical_dendrite", "basal_dendrite"],
+        "apical_dendrite": {"orientation": {"mode": "uniform", "values": {}}},
+        "basal_dendrite": {"orientation": {"mode": "custom", "values": {}}},
+    }
+    soma = Soma((0.0, 0.0, 0.0), 1.0)
+    om = CustomOrientationManager(
+        soma=soma,
+        parameters=parameters,
+        distributions=_POPULATION_DISTRIBUTIONS,
+        context=None,
+        rng=np.random.default_rng(0),
+    )
+    assert "custom" in om.mode_names
+    assert "custom" not in om._population_modes
+
+    radii, population = om.compute_population_orientations(10)
+    assert len(radii) == 10
+    for cell in population:
+        npt.assert_allclose(cell["basal_dendrite"][0], cell["apical_dendrite"][0])
+    assert om._soma is soma
+    assert not om._orientations
+
+    # The pairwise angles are sampled cell by cell when some trunks already exist
+    parameters["basal_dendrite"]["orientation"]["mode"] = "sample_pairwise_angles"
+    parameters["apical_dendrite"]["orientation"] = {
+        "mode": "use_predefined",
+        "values": {"orientations": [[1.0, 0.0, 0.0]]},
+    }
+    _, population = om.compute_population_orientations(10)
+    for cell in population:
+        phis = np.arctan2(cell["basal_dendrite"][:, 1], cell["basal_dendrite"][:, 0])
+        assert (np.abs(phis) > 1e-6).all()
+
+    # The somata of the cells can not be built without a soma or a soma factory
+    om._soma = None
+    with pytest.raises(NeuroTSError, match="A soma factory is needed"):
+        om.compute_population_orientations(10)
+    assert om._soma_factory is None
@@ -56,3 +56,51 @@ def test_rotation_matrix_from_vectors():
 
     rot = test_module.rotation_matrix_from_vectors(vec1, vec1)
     assert_array_almost_equal(rot, np.eye(3))
+
+    # Opposite vectors are aligned by a half turn
+    for vec in [vec1, vec2, np.array([0, 0, -3])]:
+        rot = test_module.rotation_matrix_from_vectors(vec, -vec)
+        assert_array_almost_equal(rot.dot(vec), -vec)
+        assert_array_almost_equal(rot.dot(rot.T), np.eye(3))
+        assert_array_almost_equal(np.linalg.det(rot), 1)
+
+
+def test_batch():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(10, 3))
+    axes = rng.normal(size=(10, 3))
+    angles = rng.uniform(-np.pi, np.pi, size=10)
+
+    assert_array_almost_equal(
+        test_module.rotation_around_axis(axes, angles),
+        [test_module.rotation_around_axis(axis, angle) for axis, angle in zip(axes, angles)],
+    )
+    assert_array_almost_equal(
+        test_module.rotation_around_axis([0, 0, 1], angles),
+        [test_module.rotation_around_axis([0, 0, 1], angle) for angle in angles],
+    )
+    assert_array_almost_equal(
+        test_module.rotate_vector(vectors, axes, angles),
+        [test_module.rotate_vector(*args) for args in zip(vectors, axes, angles)],
+    )
+    assert_array_almost_equal(
+        test_module.rotate_vector(vectors, [1, 0, 0], 0.5),
+        [test_module.rotate_vector(vector, [1, 0, 0], 0.5) for vector in vectors],
+    )
+    assert_array_almost_equal(
+        test_module.angle3D(vectors, axes),
+        [test_module.angle3D(*args) for args in zip(vectors, axes)],
+    )
+
+    # Include aligned and opposite vectors
+    axes[3] = 2 * vectors[3]
+    axes[4] = -vectors[4]
+    assert_array_almost_equal(
+        test_module.rotation_matrix_from_vectors(vectors, axes),
+        [test_module.rotation_matrix_from_vectors(*args) for args in zip(vectors, axes)],
+    )
+    assert_array_almost_equal(test_module.rotation_matrix_from_vectors(vectors, axes)[3], np.eye(3))
+    assert_array_almost_equal(
+        test_module.rotation_matrix_from_vectors([0, 1, 0], [[0, -1, 0], [0, 1, 0]]),
+        [test_module.rotation_matrix_from_vectors([0, 1, 0], [0, -1, 0]), np.eye(3)],
+    )
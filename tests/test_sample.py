@@ -17,9 +17,12 @@
 
 # pylint: disable=missing-function-docstring
 # pylint: disable=protected-access
+import pickle
+
 import numpy as np
 import pytest
 from numpy.testing import assert_equal
+from scipy import stats
 
 from neurots.morphmath import sample
 
@@ -141,3 +144,205 @@ def test_soma_size():
 
     val1_rng = sample.soma_size(params, random_generator=rng)
     assert_equal(val1_rng, 9.470017448440464)
+
+    radii = sample.soma_size(params, random_generator=np.random.default_rng(0), size=3)
+    assert radii.shape == (3,)
+    assert_equal(radii[0], val1_rng)
+
+
+def test_n_neurites():
+    params = {"data": {"bins": [2, 3.5], "weights": [1, 1]}}
+    n_trees = sample.n_neurites(params, np.random.default_rng(0), size=100)
+    assert n_trees.dtype == int
+    assert set(n_trees) == {2, 3}
+    assert sample.n_neurites(params, np.random.default_rng(0)) == n_trees[0]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"norm": {"mean": 0.5, "std": 1}},
+        {"uniform": {"min": -1, "max": 1}},
+        {"data": {"bins": [-1, 0, 1, 2], "weights": [0.3, 0.2, 0.4, 0.1]}},
+        {"norm": {"mean": 1, "std": 0}},
+    ],
+)
+def test_draw_positive_size(params):
+    distr = sample.Distr(params, random_generator=np.random.default_rng(0))
+    values = np.concatenate([distr.draw_positive(20), distr.draw_positive(30)])
+    assert values.shape == (50,)
+    assert (values > 0).all()
+
+    # The values are the same as the ones drawn one by one
+    distr = sample.Distr(params, random_generator=np.random.default_rng(0))
+    expected = [distr.draw_positive() for _ in range(50)]
+    np.testing.assert_allclose(values, expected)
+
+
+@pytest.mark.parametrize("random_generator", [np.random.default_rng, np.random.RandomState])
+def test_draw_data(random_generator):
+    bins = np.array([-1.0, 0.0, 1.0, 2.5, 3.0])
+    weights = np.array([3.0, 1.0, 2.0, 5.0, 1.0])
+    distr = sample.Distr(
+        {"data": {"bins": bins.tolist(), "weights": weights.tolist()}}, random_generator(0)
+    )
+
+    # The values are the same as the ones drawn with the choice() method of the generator
+    rng = random_generator(0)
+    for _ in range(10):
+        assert distr.draw() == rng.choice(bins, p=weights / weights.sum())
+    positive_weights = weights[2:] / weights[2:].sum()
+    for _ in range(10):
+        assert distr.draw_positive() == rng.choice(bins[2:], p=positive_weights)
+    assert_equal(distr.draw_positive(10), rng.choice(bins[2:], size=10, p=positive_weights))
+
+    distr = sample.Distr({"data": {"bins": [-1, 0], "weights": [1, 1]}}, random_generator(0))
+    with pytest.raises(ValueError, match="no bin"):
+        distr.draw_positive()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"norm": {"mean": 0.5, "std": 1}},
+        {"uniform": {"min": -1, "max": 1}},
+        {"expon": {"loc": 1, "lambda": 2}},
+        {"data": {"bins": [-1, 0, 1, 2], "weights": [0.3, 0.2, 0.4, 0.1]}},
+    ],
+)
+@pytest.mark.parametrize("random_generator", [np.random.default_rng, np.random.RandomState])
+def test_draw_size(params, random_generator):
+    values = sample.Distr(params, random_generator(0)).draw(20)
+    distr = sample.Distr(params, random_generator(0))
+    assert_equal(values, [distr.draw() for _ in range(20)])
+    assert sample.Distr(params, random_generator(0)).draw(0).shape == (0,)
+
+
+@pytest.mark.parametrize(
+    "params,expected",
+    [
+        ({"norm": {"mean": -10, "std": 2}}, stats.truncnorm(5, np.inf, loc=-10, scale=2)),
+        ({"expon": {"loc": -10, "lambda": 2}}, stats.expon(scale=0.5)),
+        ({"uniform": {"min": -1000, "max": 1}}, stats.uniform(0, 1)),
+    ],
+)
+def test_draw_positive_truncated(params, expected):
+    distr = sample.Distr(params, random_generator=np.random.default_rng(0))
+    values = np.concatenate(
+        [distr.draw_positive(1000), [distr.draw_positive() for _ in range(500)]]
+    )
+    assert (values > 0).all()
+    assert stats.kstest(values, expected.cdf).pvalue > 0.01
+
+    # The values do not depend on the size
+    values = sample.Distr(params, random_generator=np.random.default_rng(0)).draw_positive(10)
+    distr = sample.Distr(params, random_generator=np.random.default_rng(0))
+    assert_equal(values, [distr.draw_positive() for _ in range(10)])
+
+    with pytest.raises(ValueError, match="can not draw positive numbers"):
+        sample.Distr({"uniform": {"min": -2, "max": -1}}).draw_positive()
+
+
+def test_trunk_angles():
+    distrib = {
+        "trunk": {
+            "orientation_deviation": {"norm": {"mean": 1, "std": 0.5}},
+            "absolute_elevation_deviation": {"uniform": {"min": 0, "max": 1}},
+            "azimuth": {"uniform": {"min": 0, "max": np.pi}},
+        }
+    }
+    rng = np.random.default_rng(0)
+    angles = sample.trunk_angles(distrib, 4, np.random.default_rng(0))
+    assert_equal(angles[:3], 1 + 0.5 * rng.standard_normal(3))
+    assert angles[3] == sum(angles[:3])
+    assert sample.trunk_angles(distrib, 1, rng) == [0]
+
+    rng = np.random.default_rng(0)
+    assert_equal(
+        sample.trunk_absolute_angles(distrib, 4, np.random.default_rng(0)), rng.uniform(size=4)
+    )
+
+    rng = np.random.default_rng(0)
+    assert_equal(
+        sample.azimuth_angles(distrib, 4, np.random.default_rng(0)),
+        np.arccos(1 - 2 * rng.uniform(size=4)),
+    )
+
+
+def test_distr_cache(monkeypatch):
+    distrib = {
+        "soma": {"size": {"norm": {"mean": 9, "std": 3}}},
+        "num_trees": {"data": {"bins": [2, 3, 4], "weights": [1, 2, 1]}},
+        "trunk": {
+            "orientation_deviation": {"norm": {"mean": 1, "std": 0.5}},
+            "absolute_elevation_deviation": {"uniform": {"min": 0, "max": 1}},
+            "azimuth": {"uniform": {"min": 0, "max": np.pi}},
+        },
+    }
+    cache = sample.DistrCache()
+
+    def draw_all(seed, distr_cache=None):
+        rng = np.random.default_rng(seed)
+        return [
+            sample.soma_size(distrib, rng, distr_cache=distr_cache),
+            sample.n_neurites(distrib["num_trees"], rng, size=3, distr_cache=distr_cache).tolist(),
+            sample.trunk_angles(distrib, 3, rng, distr_cache=distr_cache),
+            sample.trunk_absolute_angles(distrib, 3, rng, distr_cache=distr_cache),
+            sample.azimuth_angles(distrib, 3, rng, distr_cache=distr_cache).tolist(),
+        ]
+
+    # The cached distributions give the same numbers and use the given generators
+    expected = [draw_all(seed) for seed in range(3)]
+    assert [draw_all(seed, cache) for seed in range(3)] == expected
+    assert len(cache._distrs) == 5
+
+    # The distributions are not built again
+    built = []
+    monkeypatch.setattr(sample, "d_transform", lambda *args: built.append(args))
+    assert draw_all(0, cache) == expected[0]
+    assert not built
+    monkeypatch.undo()
+
+    # Other parameters give other distributions
+    other = sample.DistrCache()
+    size = {"norm": {"mean": 9, "std": 3}}
+    assert other.get(size).with_generator(np.random).distribution == np.random.standard_normal
+    assert other.get(size, transform=np.cos).loc == np.cos(9)
+    assert len(other._distrs) == 2
+    assert other.get({"norm": {"mean": 1, "std": 0}}).draw() == 1
+
+    # The cache is not copied since it is indexed by the IDs of the parameters
+    assert not pickle.loads(pickle.dumps(cache))._distrs
+
+
+def test_samplers():
+    step_size = {"norm": {"mean": 1, "std": 0.5}}
+
+    # The direct sampler draws the numbers from the given generator
+    direct = sample.DirectSampler(
+        sample.Distr(step_size, np.random.default_rng(0)), np.random.default_rng(1)
+    )
+    rng = np.random.default_rng(1)
+    np.testing.assert_allclose(
+        direct.random_direction(), sample.get_random_point(random_generator=rng)
+    )
+    assert direct.uniform() == rng.random()
+
+    # The numbers given by the block sampler only depend on the given generator
+    samplers = [
+        sample.BlockSampler(step_size, np.random.default_rng(0), block_size=block_size)
+        for block_size in [3, 4096]
+    ]
+    for _ in range(10):
+        directions = [i.random_direction() for i in samplers]
+        np.testing.assert_allclose(directions[0], directions[1])
+        np.testing.assert_allclose(np.linalg.norm(directions[0]), 1)
+        steps = [i.step_length() for i in samplers]
+        assert steps[0] == steps[1] > 0
+        uniforms = [i.uniform() for i in samplers]
+        assert uniforms[0] == uniforms[1]
+        assert 0 <= uniforms[0] < 1
+
+    # The block sampler also works with the legacy random number generators
+    sampler = sample.BlockSampler(step_size, np.random.RandomState(0), block_size=3)
+    assert sampler.step_length() > 0
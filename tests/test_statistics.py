@@ -0,0 +1,85 @@
+"""Test neurots.generate.statistics code."""
+
+# Copyright (C) 2023  Blue Brain Project, EPFL
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-function-docstring
+import json
+from pathlib import Path
+
+from morph_tool import diff
+
+from neurots import NeuronGrower
+from neurots.generate.statistics import NULL_STATISTICS
+from neurots.generate.statistics import GrowthStatistics
+
+DATA = Path(__file__).parent / "data"
+
+
+def test_growth_statistics():
+    statistics = GrowthStatistics()
+    with statistics.timer("phase"):
+        pass
+    with statistics.timer("phase"):
+        statistics.count("event")
+        statistics.count("event", 3)
+    statistics.add_time("other_phase", 2.0)
+
+    result = statistics.to_dict()
+    assert list(result["timings"]) == ["phase", "other_phase"]
+    assert result["timings"]["phase"] >= 0
+    assert result["timings"]["other_phase"] == 2.0
+    assert result["counts"] == {"event": 4}
+    assert statistics.enabled
+    assert not NULL_STATISTICS.enabled
+
+    with NULL_STATISTICS.timer("phase"):
+        NULL_STATISTICS.count("event")
+    NULL_STATISTICS.add_time("phase", 1.0)
+    assert NULL_STATISTICS.to_dict() == {"timings": {}, "counts": {}}
+
+
+def test_instrumented_grower():
+    with open(DATA / "bio_path_distribution.json", encoding="utf-8") as f:
+        distributions = json.load(f)
+    with open(DATA / "bio_path_params.json", encoding="utf-8") as f:
+        parameters = json.load(f)
+
+    grower = NeuronGrower(parameters, distributions, rng_or_seed=0, instrument=True)
+    neuron = grower.grow()
+    result = grower.statistics.to_dict()
+
+    assert set(result["timings"]) == {
+        "trunk_orientation",
+        "soma",
+        "section_stepping",
+        "bifurcation",
+        "termination",
+        "build_morphology",
+        "post_grow",
+        "diametrization",
+    }
+    counts = result["counts"]
+    assert counts["sections"] == len(neuron.sections)
+    assert counts["points"] == sum(len(sec.points) for sec in neuron.iter())
+    assert counts["terminations"] == counts["bifurcations"] + len(neuron.root_sections)
+    assert counts["sections"] == counts["bifurcations"] + counts["terminations"]
+    assert counts["sections"] < counts["steps"] < counts["points"]
+    assert counts["barcode_lookups"] > 0
+
+    # The instrumentation does not change the grown cell
+    expected_grower = NeuronGrower(parameters, distributions, rng_or_seed=0)
+    assert not diff(neuron, expected_grower.grow())
+    assert expected_grower.statistics.to_dict() == {"timings": {}, "counts": {}}
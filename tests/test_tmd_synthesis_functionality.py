@@ -15,8 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
 import json
 import os
+import pickle
 
 import numpy as np
 import pytest
@@ -24,9 +26,12 @@ from numpy.testing import assert_array_almost_equal
 from numpy.testing import assert_array_equal
 from numpy.testing import assert_equal
 
+from neurots.generate.algorithms import barcode as barcode_module
 from neurots.generate.algorithms.barcode import Barcode
+from neurots.generate.algorithms.barcode import BarcodeTemplates
 from neurots.generate.algorithms.common import TMDStop
 from neurots.generate.algorithms.common import checks_bif_term
+from neurots.generate.algorithms.common import copy_stop_criteria
 from neurots.utils import NeuroTSError
 
 _PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
@@ -66,6 +71,55 @@ def test_barcode():
     assert_array_almost_equal(barcode_test.min_term(), (1, 204.0442))
 
 
+def _scan_first(items, default, below, above, *, term_bounds=None, barcode=None):
+    """Return the first bar whose value is in the bounds (and whose term is in the term bounds)."""
+    for bar_id, value in items:
+        if not below <= value <= above:
+            continue
+        if term_bounds is None or term_bounds[0] <= barcode.get_term(bar_id) <= term_bounds[1]:
+            return (bar_id, value)
+    return default
+
+
+def test_barcode_queries():
+    """Compare the queries of the barcode with a scan of its bars while bars are removed"""
+    rng = np.random.default_rng(0)
+    # Use rounded values to get ties
+    bifs = np.round(rng.uniform(0, 100, size=200), 0)
+    ph_angles = [[bif + np.round(rng.uniform(1, 100), 0), bif, 0, 0, 0, 0] for bif in bifs]
+    barcode = Barcode(ph_angles)
+
+    while barcode.terms:
+        for _ in range(5):
+            below, above, below_term, above_term = np.sort(rng.uniform(-10, 210, size=4))
+            assert barcode.min_bif(below, above) == _scan_first(
+                barcode.bifs.items(), (None, np.inf), below, above
+            )
+            assert barcode.min_term(below, above) == _scan_first(
+                barcode.terms.items(), (None, 0), below, above
+            )
+            assert barcode.select_compatible_bif(
+                below, above, below_term, above_term
+            ) == _scan_first(
+                barcode.bifs.items(),
+                (None, np.inf),
+                below,
+                above,
+                term_bounds=(below_term, above_term),
+                barcode=barcode,
+            )
+        assert barcode.max_term() == list(barcode.terms.items())[-1]
+
+        if barcode.bifs and rng.random() < 0.5:
+            barcode.remove_bif(rng.choice(list(barcode.bifs)))
+        else:
+            barcode.remove_term(rng.choice(list(barcode.terms)))
+
+    assert barcode.min_term() == (None, 0)
+    with pytest.raises(StopIteration):
+        barcode.max_term()
+
+
 def test_barcode_validate_persistence():
     """Tests the barcode functionality"""
 
@@ -143,3 +197,68 @@ def test_TMDStop():
     child_stop = TMDStop(1, 26.3027, 999999, 5, 10.0)
     with pytest.raises(NeuroTSError):
         barcode_test.curate_stop_criterion(parent_stop, child_stop)
+
+
+def test_TMDStop_copy():
+    """Test the copies of the TMDStop class"""
+    tmd_stop = TMDStop(1, 26.3027, 0, 633.5966, 10.0)
+    assert not hasattr(tmd_stop, "__dict__")
+
+    for new_stop in [tmd_stop.copy(), copy.copy(tmd_stop), copy.deepcopy(tmd_stop)]:
+        assert new_stop is not tmd_stop
+        assert new_stop == tmd_stop
+        new_stop.update_bif(2, 30.0)
+        assert tmd_stop.bif_id == 1
+
+    stop_criteria = {"TMD": tmd_stop, "num_seg": 5}
+    new_criteria = copy_stop_criteria(stop_criteria)
+    assert new_criteria == stop_criteria
+    assert new_criteria["TMD"] is not tmd_stop
+
+
+def test_barcode_templates(monkeypatch):
+    """Test the copies of the barcodes and the barcode templates"""
+    with open(os.path.join(_PATH, "dummy_distribution.json"), encoding="utf-8") as f:
+        persistence_diagrams = json.load(f)["apical_dendrite"]["persistence_diagram"]
+    expected_diagrams = copy.deepcopy(persistence_diagrams)
+
+    templates = BarcodeTemplates(persistence_diagrams)
+
+    # The templates of all the diagrams are built when the templates are created
+    with monkeypatch.context() as m:
+        m.setattr(barcode_module, "Barcode", None)
+        assert len([templates.barcode(diagram) for diagram in persistence_diagrams]) == len(
+            persistence_diagrams
+        )
+    barcode = templates.barcode(persistence_diagrams[0])
+    expected = Barcode(list(expected_diagrams[0]))
+    assert barcode.bifs == expected.bifs
+    assert barcode.terms == expected.terms
+
+    # The copies are independent
+    other_barcode = templates.barcode(persistence_diagrams[0])
+    barcode.remove_bif(1)
+    barcode.remove_term(2)
+    assert barcode.min_bif() == (2, 52.4013)
+    assert barcode.min_term() == (1, 204.0442)
+    assert other_barcode.min_bif() == expected.min_bif()
+    assert other_barcode.min_term() == expected.min_term()
+    assert other_barcode.bifs == expected.bifs
+    assert other_barcode.angles is barcode.angles
+    assert other_barcode.bifs.bar_values is barcode.bifs.bar_values
+    assert isinstance(barcode.angles, np.ndarray)
+    assert barcode.angles.shape == (len(persistence_diagrams[0]), 4)
+
+    # The input persistence diagrams are not modified
+    assert persistence_diagrams == expected_diagrams
+
+    # Other persistence diagrams are not stored
+    modified_diagram = [[2 * term, 2 * bif] + angles for term, bif, *angles in expected_diagrams[0]]
+    assert templates.barcode(modified_diagram).bifs[1] == pytest.approx(
+        2 * expected.bifs[1], abs=1e-3
+    )
+    assert templates.barcode(list(persistence_diagrams[0])).bifs == expected.bifs
+
+    # The templates can be pickled
+    new_diagrams, new_templates = pickle.loads(pickle.dumps([persistence_diagrams, templates]))
+    assert new_templates.barcode(new_diagrams[0]).bifs == expected.bifs